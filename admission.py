@@ -0,0 +1,87 @@
+# admission.py
+import math, threading, time
+
+# Clients may send their remaining time budget; the proxy sheds the request
+# with a 503 as soon as it can tell the budget will not be met
+DEADLINE_HEADER = "X-Request-Deadline-Ms"
+SHED_HEADER = "X-Proxy-Shed"
+SHED_REASONS = ("deadline", "queue_full", "queue_timeout")
+
+class AdmissionControl:
+    """Bounded admission in front of the upstream.
+
+    At most `limit` requests are forwarded at once. Up to `queue_size` more
+    wait for a slot, each for at most `max_queue_time` seconds, and never
+    past the point where its deadline leaves less than the expected upstream
+    time (a moving average of recent upstream times). Anything else is shed
+    at once instead of piling up behind a slow upstream. With limit=0 every
+    request is admitted, but deadlines are still checked.
+    """
+
+    def __init__(self, limit=0, queue_size=64, max_queue_time=1.0, smoothing=0.1):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.max_queue_time = max_queue_time
+        self.smoothing = smoothing
+        self.expected = 0.0  # seconds
+        self.waiting = 0
+        self.inflight = 0
+        self._slots = threading.Semaphore(limit) if limit else None
+        self._lock = threading.Lock()
+
+    def admit(self, deadline=None):
+        """Wait for an upstream slot. Returns (reason, wait): reason is None
+        once admitted, else one of SHED_REASONS; wait is seconds queued.
+        `deadline` is a Unix time, or None for no deadline."""
+        start = time.time()
+        budget = self._budget(deadline, start)
+        if budget <= 0:
+            return "deadline", 0.0
+        if self._slots is None or self._slots.acquire(blocking=False):
+            return self._admitted(), 0.0
+        with self._lock:
+            if self.waiting >= self.queue_size:
+                return "queue_full", 0.0
+            self.waiting += 1
+        try:
+            admitted = self._slots.acquire(timeout=min(self.max_queue_time, budget))
+        finally:
+            with self._lock:
+                self.waiting -= 1
+        wait = time.time() - start
+        if admitted:
+            return self._admitted(), wait
+        return ("deadline" if budget < self.max_queue_time else "queue_timeout"), wait
+
+    def expired(self, deadline):
+        """Whether `deadline` already leaves less than the expected upstream
+        time, so the request can be shed without waiting for anything"""
+        return self._budget(deadline, time.time()) <= 0
+
+    def _budget(self, deadline, now):
+        return math.inf if deadline is None else deadline - now - self.expected
+
+    def _admitted(self):
+        with self._lock:
+            self.inflight += 1
+        return None
+
+    def release(self, upstream_time=None):
+        """Give back an admitted request's slot; `upstream_time` (seconds)
+        updates the expected upstream time when the request got an answer"""
+        with self._lock:
+            self.inflight -= 1
+            if upstream_time is not None:
+                self.expected += self.smoothing * (upstream_time - self.expected)
+        if self._slots is not None:
+            self._slots.release()
+
+    def snapshot(self):
+        return {
+            "limit": self.limit,
+            "queue_size": self.queue_size,
+            "max_queue_ms": self.max_queue_time * 1000,
+            "inflight": self.inflight,
+            "waiting": self.waiting,
+            "expected_upstream_ms": round(self.expected * 1000, 2),
+        }
@@ -1,56 +1,162 @@
 # app.py
-from flask import Flask, request, jsonify
-import threading, time, random, os, psutil
+from flask import Flask, Response, request, jsonify
+from werkzeug.serving import WSGIRequestHandler, make_server
+import threading, multiprocessing, time, random, os, io, json, socket, signal, psutil, re
+from importlib.metadata import version
+from collections import deque
+from metrics import ShardedMetrics, SharedMetricsBoard
+from exposition import Exposition, CONTENT_TYPE as PROM_CONTENT_TYPE
+from scenarios import ScenarioEngine
+from tracing import TRACE_HEADER, APP_SPAN_HEADER, encode_span
 
 app = Flask(__name__)
-lock = threading.Lock()
 
-# Metrics collection
-metrics = {
+# Contention scenario for mode=app/mixed; requests can pick another with
+# ?scenario=... (see scenarios.py). Rebuilt with cross-process primitives
+# in pre-fork mode.
+SCENARIO = os.environ.get("APP_SCENARIO", "lock")
+scenarios = ScenarioEngine(SCENARIO)
+
+# Metrics collection (per-thread shards, merged on read)
+metrics = ShardedMetrics({
     "requests_total": 0,
     "requests_waiting": 0,
     "lock_contention_count": 0,
     "total_processing_time": 0.0,
     "total_wait_time": 0.0,
-}
-metrics_lock = threading.Lock()
+}, histograms=("processing_time_ms", "wait_time_ms"))
+
+class SystemSampler(threading.Thread):
+    """Samples CPU and thread count on a fixed interval into a ring buffer so
+    request handlers read the latest sample instead of blocking on psutil."""
+    
+    def __init__(self, interval=0.1, history=600):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.samples = deque(maxlen=history)  # (timestamp, cpu_percent, active_threads)
+    
+    def run(self):
+        psutil.cpu_percent(interval=None)  # prime the counter
+        while True:
+            cpu = psutil.cpu_percent(interval=self.interval)  # blocks this thread only
+            self.samples.append((time.time(), cpu, threading.active_count()))
+    
+    def latest(self):
+        try:
+            return self.samples[-1]
+        except IndexError:
+            return (time.time(), 0.0, threading.active_count())
+
+sampler = SystemSampler(interval=float(os.environ.get("APP_SAMPLE_INTERVAL", "0.1")))
+
+# Pre-fork mode: every worker process publishes its metrics into its own slot
+# of a shared-memory board, so /metrics can report totals across workers
+board = None
+board_generation = 0
+worker_slot = 0
+
+def sync_reset():
+    """Apply a reset requested by another worker. Checked at the start of
+    every request (a single shared-memory read) so that requests served after
+    a reset are never wiped by it."""
+    global board_generation
+    if board is not None and board.generation != board_generation:
+        with reset_lock:
+            if board.generation != board_generation:
+                board_generation = board.generation
+                metrics.reset()
+                scenarios.reset()
+
+reset_lock = threading.Lock()
+
+def publish_metrics():
+    """Publish this worker's metrics into its board slot"""
+    sync_reset()
+    generation = board_generation  # a reset after this point drops the snapshot
+    m, hists = metrics.snapshot()
+    m["active_threads"] = sampler.latest()[2]
+    board.publish(worker_slot, m, hists, generation)
+
+class MetricsPublisher(threading.Thread):
+    def __init__(self, interval=0.1):
+        super().__init__(daemon=True)
+        self.interval = interval
+    
+    def run(self):
+        while True:
+            publish_metrics()
+            time.sleep(self.interval)
+
+def current_metrics():
+    """(counters, histograms, active_threads) for this process, or summed
+    across all workers in pre-fork mode"""
+    if board is None:
+        m, hists = metrics.snapshot()
+        return m, hists, sampler.latest()[2]
+    publish_metrics()  # make our own slot current
+    m, hists = board.read()
+    return m, hists, m["active_threads"]
+
+def payload_response(response_data, payload_kb, chunk_kb, chunk_ms):
+    """The JSON result line followed by `payload_kb` of filler. With chunk_ms
+    the filler is streamed in chunk_kb pieces, pausing before each one
+    (chunked transfer encoding); otherwise it goes out in one piece."""
+    head = (json.dumps(response_data) + "\n").encode()
+    total = int(payload_kb * 1024)
+    if not chunk_ms:
+        return Response(head + b"." * total, mimetype="application/octet-stream")
+    
+    def generate():
+        yield head
+        chunk = b"." * max(1, int(chunk_kb * 1024))
+        sent = 0
+        while sent < total:
+            time.sleep(chunk_ms / 1000)
+            piece = chunk[:total - sent]
+            yield piece
+            sent += len(piece)
+    return Response(generate(), mimetype="application/octet-stream")
 
 @app.route("/work")
 def work():
-    global metrics
-    
     # Record request arrival
     arrival_time = time.time()
+    sync_reset()
     mode = request.args.get("mode", "none")
     base = 0.002
     
-    # Measure CPU before processing
-    cpu_before = psutil.cpu_percent(interval=0.01)
+    # Optional large or slow-streamed response body
+    try:
+        payload_kb = float(request.args.get("payload_kb", 0))
+        chunk_kb = float(request.args.get("chunk_kb", 16))
+        chunk_ms = float(request.args.get("chunk_ms", 0))
+    except ValueError as e:
+        return jsonify({"status": "error", "error": str(e)}), 400
+    
+    # CPU before processing (latest background sample, non-blocking)
+    cpu_before = sampler.latest()[1]
     
     # Track waiting (for application contention scenario)
     wait_time = 0.0
     processing_start = time.time()
     
     if mode == "app" or mode == "mixed":
-        # 5% requests hit a lock and sleep to simulate contention (app mode)
-        # 5% for mixed mode as well (realistic)
-        contention_rate = 0.05
+        try:
+            scenario = scenarios.for_request(request.args)
+        except ValueError as e:
+            return jsonify({"status": "error", "error": str(e)}), 400
         
-        if random.random() < contention_rate:
-            with metrics_lock:
-                metrics["requests_waiting"] += 1
-            
-            # This simulates waiting for a shared resource (database, cache, etc.)
-            wait_start = time.time()
-            with lock:
-                wait_time = time.time() - wait_start
-                with metrics_lock:
-                    metrics["lock_contention_count"] += 1
-                    metrics["total_wait_time"] += wait_time
-                time.sleep(0.1)   # heavy blocking work
-            
-            with metrics_lock:
-                metrics["requests_waiting"] -= 1
+        # By default 5% of requests hit the global lock and hold it for 100ms
+        if random.random() < scenario.rate:
+            metrics.inc("requests_waiting")
+            try:
+                # This simulates waiting for a shared resource (database, cache, etc.)
+                wait_time, _ = scenario.run(key=request.args.get("key"))
+            finally:
+                metrics.dec("requests_waiting")
+            metrics.inc("lock_contention_count")
+            metrics.inc("total_wait_time", wait_time)
+            metrics.observe("wait_time_ms", wait_time * 1000)
         else:
             time.sleep(base)
     else:
@@ -59,13 +165,13 @@ def work():
     # Calculate processing time
     processing_time = time.time() - processing_start
     
-    # Measure CPU after processing
-    cpu_after = psutil.cpu_percent(interval=0.01)
+    # CPU after processing
+    cpu_after = sampler.latest()[1]
     
     # Update metrics
-    with metrics_lock:
-        metrics["requests_total"] += 1
-        metrics["total_processing_time"] += processing_time
+    metrics.inc("requests_total")
+    metrics.inc("total_processing_time", processing_time)
+    metrics.observe("processing_time_ms", processing_time * 1000)
     
     # Return metrics with response (for debugging)
     response_data = {
@@ -75,46 +181,183 @@ def work():
         "cpu_delta": round(cpu_after - cpu_before, 2)
     }
     
-    return jsonify(response_data), 200
+    if payload_kb > 0:
+        response = payload_response(response_data, payload_kb, chunk_kb, chunk_ms)
+    else:
+        response = jsonify(response_data)
+    
+    # Span for the caller's trace: lock wait vs. everything else
+    if TRACE_HEADER in request.headers:
+        response.headers[TRACE_HEADER] = request.headers[TRACE_HEADER]
+    response.headers[APP_SPAN_HEADER] = encode_span(
+        arrival=arrival_time, wait=wait_time * 1000, work=(processing_time - wait_time) * 1000)
+    return response, 200
 
 @app.route("/metrics")
 def get_metrics():
     """Endpoint to retrieve application metrics"""
-    with metrics_lock:
-        avg_processing = (metrics["total_processing_time"] / metrics["requests_total"] 
-                         if metrics["requests_total"] > 0 else 0)
-        avg_wait = (metrics["total_wait_time"] / metrics["lock_contention_count"] 
-                   if metrics["lock_contention_count"] > 0 else 0)
-        
-        return jsonify({
-            "requests_total": metrics["requests_total"],
-            "requests_waiting": metrics["requests_waiting"],
-            "lock_contention_count": metrics["lock_contention_count"],
-            "contention_rate": round(metrics["lock_contention_count"] / metrics["requests_total"] * 100, 2) 
-                               if metrics["requests_total"] > 0 else 0,
-            "avg_processing_time_ms": round(avg_processing * 1000, 2),
-            "avg_wait_time_ms": round(avg_wait * 1000, 2),
-            "cpu_percent": psutil.cpu_percent(interval=0.1),
-            "active_threads": threading.active_count()
-        })
+    cpu_percent = sampler.latest()[1]
+    m, hists, active_threads = current_metrics()
+    avg_processing = (m["total_processing_time"] / m["requests_total"] 
+                     if m["requests_total"] > 0 else 0)
+    avg_wait = (m["total_wait_time"] / m["lock_contention_count"] 
+               if m["lock_contention_count"] > 0 else 0)
+    
+    return jsonify({
+        "requests_total": m["requests_total"],
+        "requests_waiting": m["requests_waiting"],
+        "lock_contention_count": m["lock_contention_count"],
+        "contention_rate": round(m["lock_contention_count"] / m["requests_total"] * 100, 2) 
+                           if m["requests_total"] > 0 else 0,
+        "avg_processing_time_ms": round(avg_processing * 1000, 2),
+        "avg_wait_time_ms": round(avg_wait * 1000, 2),
+        "processing_time_ms": hists["processing_time_ms"].summary(),
+        "wait_time_ms": hists["wait_time_ms"].summary(),
+        "cpu_percent": cpu_percent,
+        "active_threads": active_threads,
+        "workers": board.slots if board is not None else 1
+    })
+
+@app.route("/metrics/prom")
+def get_prometheus_metrics():
+    """Prometheus text format, rendered from the merged counters and histograms"""
+    m, hists, active_threads = current_metrics()
+    out = Exposition()
+    out.counter("app_requests", "Requests served by /work", m["requests_total"])
+    out.counter("app_lock_contention", "Requests that waited on the contention primitive",
+                m["lock_contention_count"])
+    out.gauge("app_requests_waiting", "Requests currently waiting on the contention primitive",
+              m["requests_waiting"])
+    out.histogram_ms("app_lock_wait", "Time spent waiting on the contention primitive",
+                     hists["wait_time_ms"])
+    out.histogram_ms("app_processing", "Time to process a /work request", hists["processing_time_ms"])
+    out.gauge("app_cpu_percent", "Latest sampled CPU usage", sampler.latest()[1])
+    out.gauge("app_active_threads", "Active threads (summed across workers)", active_threads)
+    out.gauge("app_workers", "Worker processes", board.slots if board is not None else 1)
+    return Response(out.render(), mimetype=None, content_type=PROM_CONTENT_TYPE)
+
+@app.route("/metrics/scenarios")
+def get_scenario_metrics():
+    """Wait and hold distributions for each contention primitive in use
+    (this worker process only in pre-fork mode)"""
+    return jsonify({"default": scenarios.default.spec, "scenarios": scenarios.stats()})
 
 @app.route("/metrics/reset")
 def reset_metrics():
     """Reset metrics for a fresh test"""
-    global metrics
-    with metrics_lock:
-        metrics = {
-            "requests_total": 0,
-            "requests_waiting": 0,
-            "lock_contention_count": 0,
-            "total_processing_time": 0.0,
-            "total_wait_time": 0.0,
-        }
+    global board_generation
+    with reset_lock:
+        if board is not None:
+            # other workers reset on their next request or publish
+            board_generation = board.request_reset()
+        metrics.reset()
+        scenarios.reset()
     return jsonify({"status": "reset"}), 200
 
+# Werkzeug releases whose run_wsgi drain loop KeepAliveRequestHandler was checked against
+KEEPALIVE_WERKZEUG = ((2, 3), (3, 2))
+
+def keepalive_supported():
+    """Whether the installed werkzeug is in the KEEPALIVE_WERKZEUG range"""
+    installed = tuple(int(part) for part in re.findall(r"\d+", version("werkzeug"))[:2])
+    low, high = KEEPALIVE_WERKZEUG
+    return low <= installed < high
+
+class KeepAliveRequestHandler(WSGIRequestHandler):
+    """Werkzeug's dev server always sends `Connection: close`, then drains the
+    socket for up to 10ms, which would swallow (or delay) the next request on
+    a kept-alive connection. GET and HEAD carry no body, so for those we drop
+    the close header and hand werkzeug an empty stream to drain instead."""
+    timeout = 60  # close idle keep-alive connections
+    disable_nagle_algorithm = True  # headers and body are separate writes
+    
+    def setup(self):
+        super().setup()
+        # A socket whose peer is closed: always readable, at EOF
+        self._drained, peer = socket.socketpair()
+        peer.close()
+    
+    def finish(self):
+        super().finish()
+        self._drained.close()
+    
+    def run_wsgi(self):
+        if self.command not in ("GET", "HEAD"):
+            return super().run_wsgi()
+        connection, rfile = self.connection, self.rfile
+        self.connection, self.rfile = self._drained, io.BytesIO()
+        try:
+            super().run_wsgi()
+        finally:
+            self.connection, self.rfile = connection, rfile
+    
+    def send_header(self, keyword, value):
+        if (keyword.lower() == "connection" and value.lower() == "close"
+                and self.command in ("GET", "HEAD")):
+            return
+        super().send_header(keyword, value)
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+def serve_prefork(host, port, workers, request_handler):
+    """Fork `workers` processes that accept on one shared listening socket.
+    Each runs its own threaded server, so CPU-bound work scales past the GIL;
+    the default scenario's locks are shared across processes."""
+    global board, worker_slot, scenarios
+    listener = socket.create_server((host, port), backlog=128)
+    board = SharedMetricsBoard(workers, dict(metrics.initial_counters, active_threads=0),
+                               metrics.histogram_names)
+    scenarios = ScenarioEngine(SCENARIO, lock_factory=multiprocessing.Lock,
+                               semaphore_factory=multiprocessing.Semaphore)
+    
+    children = []
+    for slot in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            worker_slot = slot
+            sampler.start()
+            MetricsPublisher().start()
+            server = make_server(host, port, app, threaded=True,
+                                 request_handler=request_handler, fd=listener.fileno())
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                os._exit(0)
+        children.append(pid)
+    listener.close()
+    print(f"Pre-forked {workers} workers: {', '.join(map(str, children))}")
+    
+    signal.signal(signal.SIGTERM, _interrupt)
+    try:
+        for pid in children:
+            os.waitpid(pid, 0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
 if __name__ == "__main__":
     host = os.environ.get("APP_HOST", "0.0.0.0")
     port = int(os.environ.get("APP_PORT", "5000"))
+    workers = int(os.environ.get("APP_WORKERS", "1"))
     print(f"Application server starting on {host}:{port}")
     print(f"Metrics available at http://{host}:{port}/metrics")
-    app.run(host=host, port=port, threaded=True)
+    print(f"Contention scenario: {scenarios.default.spec}")
+    keepalive = os.environ.get("APP_KEEPALIVE", "1") != "0"
+    if keepalive and not keepalive_supported():
+        print(f"App keep-alive: off (werkzeug {version('werkzeug')} not verified, "
+              f"needs >=2.3,<3.2)")
+        keepalive = False
+    request_handler = KeepAliveRequestHandler if keepalive else WSGIRequestHandler
+    if workers > 1:
+        serve_prefork(host, port, workers, request_handler)
+    else:
+        sampler.start()
+        app.run(host=host, port=port, threaded=True, request_handler=request_handler)
@@ -0,0 +1,142 @@
+# cache.py
+import threading, time
+from collections import OrderedDict, deque
+
+CACHE_HEADER = "X-Proxy-Cache"
+OUTCOMES = ("hit", "miss", "coalesced")
+
+class _Flight:
+    """One upstream fetch in progress that identical requests wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+class ResponseCache:
+    """In-memory cache of upstream responses, keyed on path and query.
+
+    Entries are (status, headers, body), kept for `ttl` seconds and evicted
+    least recently used first once there are more than `max_entries` or
+    their bodies and headers take more than `max_bytes`. Only 200s without
+    Cache-Control no-store/private are stored. Misses are single-flight: the
+    first request for a key fetches it, and identical requests arriving
+    meanwhile wait for that fetch instead of going upstream themselves.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024, ttl=1.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.bytes = 0
+        self._entries = OrderedDict()  # key -> (expires, size, response), least recently used first
+        self._expiry = deque()  # (expires, key) in store order, which is expiry order (one TTL)
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats = {outcome: 0 for outcome in OUTCOMES}
+            self.stats.update(evictions=0, expirations=0, uncacheable=0)
+
+    def get(self, key):
+        """The fresh cached response for key (counted as a hit), else None"""
+        with self._lock:
+            response = self._lookup(key, time.time())
+            if response is not None:
+                self.stats["hit"] += 1
+            return response
+
+    def fetch(self, key, load):
+        """Cached response for key, else the result of load(), sharing one
+        load() between concurrent callers. Returns (response, outcome), the
+        outcome being one of OUTCOMES. A failed load() raises in every caller
+        that waited on it."""
+        with self._lock:
+            response = self._lookup(key, time.time())
+            if response is not None:
+                self.stats["hit"] += 1
+                return response, "hit"
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            self.stats["miss" if leader else "coalesced"] += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.response, "coalesced"
+
+        try:
+            flight.response = load()
+        except BaseException as e:
+            flight.error = e
+            raise
+        else:
+            self._store(key, flight.response)
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.response, "miss"
+
+    def _purge(self, now):
+        """Drop expired entries (lock held), oldest first, so the footprint
+        only counts live ones; amortised O(1) per stored entry"""
+        while self._expiry and self._expiry[0][0] <= now:
+            expires, key = self._expiry.popleft()
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == expires:  # not since replaced or evicted
+                del self._entries[key]
+                self.bytes -= entry[1]
+                self.stats["expirations"] += 1
+
+    def _lookup(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, size, response = entry
+        if expires <= now:
+            del self._entries[key]
+            self.bytes -= size
+            self.stats["expirations"] += 1
+            return None
+        self._entries.move_to_end(key)
+        return response
+
+    def _store(self, key, response):
+        status, headers, body = response
+        cache_control = next((v.lower() for k, v in headers if k.lower() == "cache-control"), "")
+        size = len(key) + len(body) + sum(len(k) + len(v) for k, v in headers)
+        with self._lock:
+            if status != 200 or "no-store" in cache_control or "private" in cache_control \
+                    or size > self.max_bytes:
+                self.stats["uncacheable"] += 1
+                return
+            now = time.time()
+            self._purge(now)
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._entries[key] = (now + self.ttl, size, response)
+            self._expiry.append((now + self.ttl, key))
+            self.bytes += size
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                _, (_, evicted, _) = self._entries.popitem(last=False)
+                self.bytes -= evicted
+                self.stats["evictions"] += 1
+
+    def snapshot(self):
+        """Stats plus current occupancy; hit_ratio counts coalesced requests
+        as served without an upstream call"""
+        with self._lock:
+            self._purge(time.time())
+            data = dict(self.stats)
+            data.update(entries=len(self._entries), bytes=self.bytes, inflight=len(self._flights))
+        lookups = data["hit"] + data["miss"] + data["coalesced"]
+        data["hit_ratio"] = round((data["hit"] + data["coalesced"]) / lookups, 4) if lookups else 0.0
+        data.update(max_entries=self.max_entries, max_bytes=self.max_bytes, ttl_s=self.ttl)
+        return data
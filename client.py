@@ -1,710 +1,442 @@
 # client.py
-import requests, time, numpy as np, argparse, os, json
-import matplotlib.pyplot as plt
-from collections import defaultdict
+import time, argparse, os, sys, threading, multiprocessing, queue, signal
+import report, compare
+from dashboard import LiveDashboard
+from replay import read_trace
+from runstore import RunWriter, open_run
+from admission import DEADLINE_HEADER
+from tracing import (TRACE_HEADER, PROXY_SPAN_HEADER, APP_SPAN_HEADER, COMPONENTS,
+                     new_trace_id, decode_span, join_spans)
+
+# Subcommands that work on stored runs instead of sending traffic
+if sys.argv[1:2] == ["analyze"]:
+    report.main(sys.argv[2:])
+    sys.exit()
+if sys.argv[1:2] == ["compare"]:
+    compare.main(sys.argv[2:])
+    sys.exit()
+
+import requests  # only sending traffic needs it; it adds ~0.1s to the subcommands above
 
 parser = argparse.ArgumentParser()
-parser.add_argument("--mode", choices=["app","proxy","network","mixed"], required=True)
-parser.add_argument("--n", type=int, default=1000)
+parser.add_argument("--mode", choices=["app","proxy","network","mixed"], default=None,
+                    help="delay scenario (required unless --replay; with it, the default for records without a mode)")
+parser.add_argument("--n", type=int, default=None,
+                    help="number of requests (default: 1000, or the whole trace with --replay)")
 parser.add_argument("--hist", action="store_true", help="show histogram")
 parser.add_argument("--analyze", action="store_true", help="show detailed analysis")
+parser.add_argument("--rate", type=float, default=None,
+                    help="open-loop mode: send on a fixed arrival schedule of RATE requests/sec")
+parser.add_argument("--concurrency", type=int, default=None,
+                    help="max in-flight requests (default: 64 with --rate or --replay, otherwise 1)")
+parser.add_argument("--workers", type=int, default=1,
+                    help="load-generating processes, each sending its share of the schedule (default: 1)")
+parser.add_argument("--replay", metavar="TRACE", default=None,
+                    help="replay a JSONL workload trace (offset_ms, path, mode, params) at its recorded timing")
+parser.add_argument("--speed", type=float, default=1.0,
+                    help="replay the trace this many times faster (default: 1)")
+parser.add_argument("--window", type=int, default=50,
+                    help="rolling percentile window in requests (default: 50)")
+parser.add_argument("--window-seconds", type=float, default=None,
+                    help="use a time-based rolling window of this many seconds instead")
+parser.add_argument("--payload-kb", type=float, default=0,
+                    help="ask the app for a response body of this many KB")
+parser.add_argument("--chunk-ms", type=float, default=0,
+                    help="stream the payload in 16KB chunks, this many ms apart")
+parser.add_argument("--keepalive", action="store_true",
+                    help="reuse one connection per worker thread instead of connecting for every request")
+parser.add_argument("--deadline-ms", type=float, default=None,
+                    help="latency budget per request; the proxy sheds requests that can't meet it with a 503")
+parser.add_argument("--scrape-interval", type=float, default=0.1,
+                    help="seconds between background samples of app/proxy metrics (default: 0.1)")
+parser.add_argument("--runs-dir", default=os.environ.get("RUNS_DIR", "runs"),
+                    help="directory to store run results in (default: runs)")
+parser.add_argument("--live", action="store_true",
+                    help="show a live dashboard of rolling percentiles during the run")
+parser.add_argument("--live-window", type=float, default=5.0,
+                    help="seconds of traffic the live dashboard covers (default: 5)")
+report.add_render_arguments(parser)
 args = parser.parse_args()
 
+if args.rate is not None and args.rate <= 0:
+    parser.error("--rate must be positive")
+if args.replay:
+    if args.rate:
+        parser.error("--rate and --replay are exclusive: the trace sets the timing")
+    if args.speed <= 0:
+        parser.error("--speed must be positive")
+    if not os.path.exists(args.replay):
+        parser.error(f"no such trace: {args.replay}")
+    args.mode = args.mode or "mixed"
+elif args.mode is None:
+    parser.error("--mode is required unless --replay is given")
+elif args.n is None:
+    args.n = 1000
+if args.workers < 1:
+    parser.error("--workers must be at least 1")
+concurrency = args.concurrency or (64 if args.rate or args.replay else args.workers)
+if concurrency < 1:
+    parser.error("--concurrency must be at least 1")
+# --concurrency is the total across all --workers processes
+process_concurrency = -(-concurrency // args.workers)
+
 host = os.environ.get("HOST", "http://127.0.0.1:8080")
+app_url = os.environ.get("APP_URL", "http://127.0.0.1:5000")
 
 # Reset metrics before starting
 print(f"Resetting metrics for mode: {args.mode}")
 try:
     requests.get(f"{host}/proxy/metrics/reset", timeout=2)
-    requests.get("http://127.0.0.1:5000/metrics/reset", timeout=2)
+    requests.get(f"{app_url}/metrics/reset", timeout=2)
 except:
     pass
 
-url = f"{host}/work?mode={args.mode}"
-latencies = []
-latency_timestamps = []  # Track when each request completed
+defaults = {"mode": args.mode}
+if args.payload_kb:
+    defaults.update(payload_kb=f"{args.payload_kb:g}", chunk_ms=f"{args.chunk_ms:g}")
+url = f"{host}/work?" + "&".join(f"{k}={v}" for k, v in defaults.items())
 errors = 0
 
-# Track detailed metrics from headers
-proxy_queue_waits = []
-proxy_processing_times = []
-network_delays = []
-upstream_times = []
-
-# Track application metrics over time
-app_metrics_timeline = {
-    'timestamps': [],
-    'cpu_usage': [],
-    'active_threads': [],
-    'lock_contention_count': [],
-    'requests_waiting': [],
-}
-
-# Track proxy metrics over time
-proxy_metrics_timeline = {
-    'timestamps': [],
-    'requests_in_queue': [],
-    'proxy_overhead_count': [],
-    'avg_queue_wait': [],
-    'connection_errors': [],
-    'retries': [],
-}
-
-print(f"\nRunning {args.n} requests in mode: {args.mode}")
+# Every request and metrics sample is appended to a columnar run store
+# (runstore.py) in batches instead of being held in memory. Times are
+# seconds since the run started; status 0 marks a request that failed
+# without a response; header timings are NaN when absent. Request rows are
+# appended as they reach the coordinator, so concurrent requests and
+# --workers batches leave them out of `completed` order: readers that need
+# time order sort on read (report.RunAnalysis does).
+REQUEST_COLUMNS = [
+    ("intended", "f8"),    # scheduled send time
+    ("completed", "f8"),
+    ("latency_ms", "f8"),  # from the intended send time
+    ("ttfb_ms", "f8"),
+    ("status", "i2"),
+    ("trace_id", "u8"),
+    ("queue_wait_ms", "f4"),
+    ("upstream_ms", "f4"),
+] + [(f"{c}_ms", "f4") for c in COMPONENTS]  # joined trace spans
+APP_TIMELINE_COLUMNS = ("timestamps", "cpu_usage", "active_threads",
+                        "lock_contention_count", "requests_waiting")
+PROXY_TIMELINE_COLUMNS = ("timestamps", "requests_in_queue", "proxy_overhead_count",
+                          "avg_queue_wait", "connection_errors", "retries")
+
+run_path = os.path.join(args.runs_dir, time.strftime("%Y%m%d-%H%M%S") + ("-replay" if args.replay else f"-{args.mode}"))
+run = RunWriter(run_path, {
+    "requests": REQUEST_COLUMNS,
+    "app_timeline": [(name, "f8") for name in APP_TIMELINE_COLUMNS],
+    "proxy_timeline": [(name, "f8") for name in PROXY_TIMELINE_COLUMNS],
+}, meta={"args": vars(args), "url": url, "concurrency": concurrency}, unique=True)
+run_path = run.path  # names have 1s resolution; a run started in the same second gets a suffix
+
+total = args.n if args.n is not None else "?"
+if args.replay:
+    print(f"\nReplaying {args.replay} at {args.speed:g}x"
+          + (f" (first {args.n} requests)" if args.n is not None else "")
+          + f", up to {concurrency} in flight")
+else:
+    print(f"\nRunning {args.n} requests in mode: {args.mode}")
+    if args.rate:
+        print(f"Open-loop: {args.rate:g} req/s on a fixed schedule, up to {concurrency} in flight")
+    elif concurrency > 1:
+        print(f"Closed-loop: {concurrency} concurrent workers")
+if args.workers > 1:
+    print(f"Load generated by {args.workers} processes x {process_concurrency} threads")
 print("=" * 60)
 
-start_time = time.time()
+results_lock = threading.Lock()
+schedule_lock = threading.Lock()
 
-for i in range(args.n):
-    if (i + 1) % 100 == 0:
-        print(f"Progress: {i + 1}/{args.n} requests...")
-    
-    # Poll metrics every 10 requests to track over time
-    if i % 10 == 0:
+def make_schedule(share=0, shares=1):
+    """(offset in seconds, or None to send at once; URL) for every `shares`-th
+    request starting at `share`. A replayed trace is read lazily, one line
+    per request handed out."""
+    if args.replay:
+        return ((offset, host + target) for offset, target
+                in read_trace(args.replay, defaults, args.speed, args.n, share=(share, shares)))
+    if args.rate:
+        return ((i / args.rate, url) for i in range(share, args.n, shares))
+    return ((None, url) for _ in range(share, args.n, shares))
+
+schedule = make_schedule()
+completed = 0
+# With --workers, load is generated in forked child processes (see load_process)
+fork = multiprocessing.get_context("fork")
+# Ctrl-C: stop sending, keep what we have
+stop_requested = fork.Event() if args.workers > 1 else threading.Event()
+live = LiveDashboard(args.n, "replay" if args.replay else args.mode, window=args.live_window) if args.live else None
+
+def next_request():
+    """Hand out the next scheduled request; None once the schedule is used
+    up or the run was stopped. A malformed trace line stops the run."""
+    if stop_requested.is_set():
+        return None
+    with schedule_lock:
+        try:
+            return next(schedule, None)
+        except ValueError as e:
+            if not stop_requested.is_set():
+                print(f"[ERROR] {e}; stopping the replay")
+                stop_requested.set()
+            return None
+
+class MetricsScraper(threading.Thread):
+    """Samples app and proxy metrics on a fixed wall-clock interval, off the
+    request path. Each endpoint's sample is timestamped when it returns, so
+    the timeline panels line up with latency samples at any request rate."""
+    
+    def __init__(self, interval):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.session = requests.Session()
+        self.stopped = threading.Event()
+    
+    def sample(self):
         try:
             # Always poll app metrics
-            app_resp = requests.get("http://127.0.0.1:5000/metrics", timeout=1).json()
-            app_metrics_timeline['timestamps'].append(time.time() - start_time)
-            app_metrics_timeline['cpu_usage'].append(app_resp.get('cpu_percent', 0))
-            app_metrics_timeline['active_threads'].append(app_resp.get('active_threads', 0))
-            app_metrics_timeline['lock_contention_count'].append(app_resp.get('lock_contention_count', 0))
-            app_metrics_timeline['requests_waiting'].append(app_resp.get('requests_waiting', 0))
-            
-            # Also poll proxy metrics
-            proxy_resp = requests.get(f"{host}/proxy/metrics", timeout=1).json()
-            proxy_metrics_timeline['timestamps'].append(time.time() - start_time)
-            proxy_metrics_timeline['requests_in_queue'].append(proxy_resp.get('requests_in_queue', 0))
-            proxy_metrics_timeline['proxy_overhead_count'].append(proxy_resp.get('proxy_overhead_count', 0))
-            proxy_metrics_timeline['avg_queue_wait'].append(proxy_resp.get('avg_queue_wait_ms', 0))
-            proxy_metrics_timeline['connection_errors'].append(proxy_resp.get('connection_errors', 0))
-            proxy_metrics_timeline['retries'].append(proxy_resp.get('retries', 0))
+            app_resp = self.session.get(f"{app_url}/metrics", timeout=1).json()
+            app_resp["timestamps"] = time.time() - start_time
+            app_resp["cpu_usage"] = app_resp.get("cpu_percent", 0)
+            run.append("app_timeline", tuple(app_resp.get(c, 0) for c in APP_TIMELINE_COLUMNS))
         except:
             pass  # Skip if metrics unavailable
-    
-    start = time.time()
-    try:
-        r = requests.get(url, timeout=10)
-        elapsed_ms = (time.time() - start) * 1000
-        latencies.append(elapsed_ms)
-        latency_timestamps.append(time.time() - start_time)  # Time since test started
-        
-        # Extract timing headers from proxy
-        if "X-Proxy-Queue-Wait-Ms" in r.headers:
-            proxy_queue_waits.append(float(r.headers["X-Proxy-Queue-Wait-Ms"]))
-        if "X-Proxy-Processing-Ms" in r.headers:
-            proxy_processing_times.append(float(r.headers["X-Proxy-Processing-Ms"]))
-        if "X-Network-Delay-Ms" in r.headers:
-            network_delays.append(float(r.headers["X-Network-Delay-Ms"]))
-        if "X-Upstream-Time-Ms" in r.headers:
-            upstream_times.append(float(r.headers["X-Upstream-Time-Ms"]))
-            
-    except Exception as e:
-        errors += 1
+        try:
+            # Also poll proxy metrics
+            proxy_resp = self.session.get(f"{host}/proxy/metrics", timeout=1).json()
+            proxy_resp["timestamps"] = time.time() - start_time
+            proxy_resp["avg_queue_wait"] = proxy_resp.get("avg_queue_wait_ms", 0)
+            run.append("proxy_timeline", tuple(proxy_resp.get(c, 0) for c in PROXY_TIMELINE_COLUMNS))
+        except:
+            pass
+    
+    def run(self):
+        tick = 0
+        while not self.stopped.is_set():
+            self.sample()
+            # Next tick on the fixed grid; skip ticks missed by a slow scrape
+            tick = max(tick + 1, int((time.time() - start_time) / self.interval) + 1)
+            self.stopped.wait(max(0.0, start_time + tick * self.interval - time.time()))
+    
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.sample()  # final totals
 
-# Calculate layer-specific percentiles and create visualization
-if latencies:
-    # Use actual measurements from headers, or use minimal values if not available
-    # APPLICATION LAYER: upstream processing time from app server
-    app_latencies = upstream_times if len(upstream_times) > 0 else [2.0] * len(latencies)
-    
-    # PROXY LAYER: proxy processing time (overhead)
-    proxy_latencies = proxy_processing_times if len(proxy_processing_times) > 0 else [0.0] * len(latencies)
-    
-    # NETWORK LAYER: network delays
-    net_latencies = network_delays if len(network_delays) > 0 else [0.0] * len(latencies)
-    
-    # Create comprehensive visualization: layer comparison + time series
-    # For mixed mode, use larger figure to show all metrics
-    if args.mode == "mixed":
-        fig = plt.figure(figsize=(18, 18))
-        gs_top = fig.add_gridspec(1, 3, hspace=0.3, wspace=0.3, 
-                                  top=0.95, bottom=0.60, left=0.08, right=0.98)
-    else:
-        fig = plt.figure(figsize=(18, 14))
-        gs_top = fig.add_gridspec(1, 3, hspace=0.3, wspace=0.3, 
-                                  top=0.95, bottom=0.50, left=0.08, right=0.98)
-    
-    # Top section: Layer comparison (3 bar charts)
-    axes = [fig.add_subplot(gs_top[0, i]) for i in range(3)]
-    
-    layers = [
-        ('APPLICATION LAYER', app_latencies, '#FF6B6B'),
-        ('PROXY LAYER', proxy_latencies, '#4ECDC4'),
-        ('NETWORK LAYER', net_latencies, '#95E1D3')
-    ]
-    
-    for idx, (layer_name, layer_data, color) in enumerate(layers):
-        ax = axes[idx]
-        
-        if layer_data and len(layer_data) > 0:
-            p50_layer = np.percentile(layer_data, 50)
-            p99_layer = np.percentile(layer_data, 99)
+def collect(row):
+    """Store one finished request and update the counts, progress and live view"""
+    global errors, completed
+    run.append("requests", row)
+    failed = row[4] == 0
+    if live:
+        if failed:
+            live.record_error()
         else:
-            p50_layer = 0
-            p99_layer = 0
-        
-        # Bar chart for p50 and p99
-        x_pos = [0, 1]
-        bar1 = ax.bar(x_pos[0], p50_layer, color=color, alpha=0.6, edgecolor='black', linewidth=2)
-        bar2 = ax.bar(x_pos[1], p99_layer, color=color, alpha=1.0, edgecolor='black', linewidth=2)
-        
-        ax.set_xticks(x_pos)
-        ax.set_xticklabels(['p50', 'p99'])
-        
-        # Add value labels on bars
-        ax.text(x_pos[0], p50_layer, f'{p50_layer:.2f}ms',
-               ha='center', va='bottom', fontweight='bold', fontsize=11)
-        ax.text(x_pos[1], p99_layer, f'{p99_layer:.2f}ms',
-               ha='center', va='bottom', fontweight='bold', fontsize=11)
-        
-        ax.set_ylabel('Latency (ms)', fontsize=11, fontweight='bold')
-        ax.set_title(layer_name, fontsize=12, fontweight='bold')
-        ax.grid(True, alpha=0.3, axis='y')
-        ax.set_ylim(bottom=0)
-        
-        # Highlight if p99 is significantly higher
-        if p99_layer > p50_layer * 2:
-            ax.set_facecolor('#fff5f5')
-            ax.text(0.5, 0.95, 'HIGH p99', transform=ax.transAxes,
-                   ha='center', va='top', fontsize=10, color='red', fontweight='bold',
-                   bbox=dict(boxstyle='round', facecolor='yellow', alpha=0.3))
-    
-    # Bottom section: Time-series graphs with SHARED X-AXIS for perfect correlation
-    if args.mode == "mixed":
-        # For mixed mode, show MORE metrics (9 total: 1 latency + 8 layer metrics)
-        gs_bottom = fig.add_gridspec(9, 1, hspace=0.05, 
-                                      top=0.57, bottom=0.03, left=0.10, right=0.95)
-    else:
-        gs_bottom = fig.add_gridspec(5, 1, hspace=0.05, 
-                                      top=0.45, bottom=0.05, left=0.10, right=0.95)
-    
-    # Calculate rolling percentiles (window size = 50 requests)
-    window_size = 50
-    times = []
-    p50_over_time = []
-    p99_over_time = []
-    
-    for i in range(window_size, len(latencies)):
-        window = latencies[i-window_size:i]
-        times.append(latency_timestamps[i])
-        p50_over_time.append(np.percentile(window, 50))
-        p99_over_time.append(np.percentile(window, 99))
-    
-    # Create subplots sharing the same x-axis
-    if args.mode == "mixed":
-        # 9 subplots for mixed mode (all layers)
-        ax1 = fig.add_subplot(gs_bottom[0])  # Latency
-        ax2 = fig.add_subplot(gs_bottom[1], sharex=ax1)  # App: Lock Contention
-        ax3 = fig.add_subplot(gs_bottom[2], sharex=ax1)  # App: CPU
-        ax4 = fig.add_subplot(gs_bottom[3], sharex=ax1)  # App: Blocked Requests
-        ax5 = fig.add_subplot(gs_bottom[4], sharex=ax1)  # Proxy: Overhead
-        ax6 = fig.add_subplot(gs_bottom[5], sharex=ax1)  # Proxy: Queue Depth
-        ax7 = fig.add_subplot(gs_bottom[6], sharex=ax1)  # Network: Retries
-        ax8 = fig.add_subplot(gs_bottom[7], sharex=ax1)  # Network: Variance
-        ax9 = fig.add_subplot(gs_bottom[8], sharex=ax1)  # Network: Delay
-    else:
-        # 5 subplots for single-layer modes
-        ax1 = fig.add_subplot(gs_bottom[0])  # Latency
-        ax2 = fig.add_subplot(gs_bottom[1], sharex=ax1)
-        ax3 = fig.add_subplot(gs_bottom[2], sharex=ax1)
-        ax4 = fig.add_subplot(gs_bottom[3], sharex=ax1)
-        ax5 = fig.add_subplot(gs_bottom[4], sharex=ax1)
-    
-    # Get max time for consistent x-axis
-    max_time = max(times) if times else 1
-    
-    # 1. Latency over time (p50 vs p99)
-    ax1.plot(times, p50_over_time, color='#4CAF50', linewidth=2.5, label='p50 (stable)', alpha=0.8)
-    ax1.plot(times, p99_over_time, color='#F44336', linewidth=2.5, label='p99 (spikes)', alpha=0.8)
-    ax1.fill_between(times, p50_over_time, p99_over_time, alpha=0.15, color='red')
-    
-    ax1.set_ylabel('Latency\n(ms)', fontsize=10, fontweight='bold', rotation=0, ha='right', va='center')
-    
-    # Dynamic title based on mode
-    if args.mode == "app":
-        layer_title = "APPLICATION LAYER"
-    elif args.mode == "proxy":
-        layer_title = "PROXY LAYER"
-    else:
-        layer_title = "NETWORK LAYER"
-    
-    ax1.set_title(f'{layer_title}: Time-Aligned Diagnostic Metrics', fontsize=12, fontweight='bold', pad=10)
-    ax1.legend(loc='upper right', fontsize=9, ncol=2)
-    ax1.grid(True, alpha=0.3, axis='y')
-    ax1.set_xlim(0, max_time)
-    plt.setp(ax1.get_xticklabels(), visible=False)
-    
-    # Choose which metrics to display based on mode
-    if args.mode == "mixed":
-        # MIXED MODE: Show ALL metrics from ALL layers for diagnosis
-        ax1.set_title('REALISTIC SCENARIO: Diagnose Which Layer is Causing p99 Spikes', 
-                     fontsize=12, fontweight='bold', pad=10)
-        
-        # APPLICATION METRICS
-        # 2. Lock Contention
-        if len(app_metrics_timeline['timestamps']) > 0:
-            contention_incremental = [0]
-            for i in range(1, len(app_metrics_timeline['lock_contention_count'])):
-                increment = app_metrics_timeline['lock_contention_count'][i] - app_metrics_timeline['lock_contention_count'][i-1]
-                contention_incremental.append(increment)
-            ax2.bar(app_metrics_timeline['timestamps'], contention_incremental, 
-                    width=0.5, color='#FF6B6B', alpha=0.7, edgecolor='darkred', linewidth=1)
-            for idx, val in enumerate(contention_incremental):
-                if val > 0:
-                    for ax in [ax1, ax2, ax3, ax4, ax5, ax6, ax7, ax8, ax9]:
-                        ax.axvline(app_metrics_timeline['timestamps'][idx], color='red', alpha=0.08, linewidth=1.5, linestyle='--')
-        ax2.set_ylabel('[APP]\nLock Events', fontsize=9, fontweight='bold', rotation=0, ha='right', va='center')
-        ax2.grid(True, alpha=0.3, axis='y')
-        ax2.set_xlim(0, max_time)
-        plt.setp(ax2.get_xticklabels(), visible=False)
-        
-        # 3. CPU
-        if len(app_metrics_timeline['timestamps']) > 0:
-            ax3.plot(app_metrics_timeline['timestamps'], app_metrics_timeline['cpu_usage'], 
-                    color='#FF9800', linewidth=2, marker='o', markersize=2)
-            ax3.fill_between(app_metrics_timeline['timestamps'], 0, app_metrics_timeline['cpu_usage'], alpha=0.2, color='#FF9800')
-        ax3.set_ylabel('[APP]\nCPU %', fontsize=9, fontweight='bold', rotation=0, ha='right', va='center')
-        ax3.grid(True, alpha=0.3, axis='y')
-        ax3.set_xlim(0, max_time)
-        plt.setp(ax3.get_xticklabels(), visible=False)
-        
-        # 4. Blocked Requests
-        if len(app_metrics_timeline['timestamps']) > 0:
-            ax4.plot(app_metrics_timeline['timestamps'], app_metrics_timeline['requests_waiting'], 
-                    color='#9C27B0', linewidth=2, marker='^', markersize=2)
-            ax4.fill_between(app_metrics_timeline['timestamps'], 0, app_metrics_timeline['requests_waiting'], alpha=0.2, color='#9C27B0')
-        ax4.set_ylabel('[APP]\nBlocked', fontsize=9, fontweight='bold', rotation=0, ha='right', va='center')
-        ax4.grid(True, alpha=0.3, axis='y')
-        ax4.set_xlim(0, max_time)
-        plt.setp(ax4.get_xticklabels(), visible=False)
-        
-        # PROXY METRICS
-        # 5. Proxy Overhead
-        if len(proxy_metrics_timeline['timestamps']) > 0:
-            overhead_incremental = [0]
-            for i in range(1, len(proxy_metrics_timeline['proxy_overhead_count'])):
-                increment = proxy_metrics_timeline['proxy_overhead_count'][i] - proxy_metrics_timeline['proxy_overhead_count'][i-1]
-                overhead_incremental.append(increment)
-            ax5.bar(proxy_metrics_timeline['timestamps'], overhead_incremental, 
-                    width=0.5, color='#4ECDC4', alpha=0.7, edgecolor='#008B8B', linewidth=1)
-            for idx, val in enumerate(overhead_incremental):
-                if val > 0:
-                    for ax in [ax1, ax2, ax3, ax4, ax5, ax6, ax7, ax8, ax9]:
-                        ax.axvline(proxy_metrics_timeline['timestamps'][idx], color='cyan', alpha=0.08, linewidth=1.5, linestyle='--')
-        ax5.set_ylabel('[PROXY]\nOverhead', fontsize=9, fontweight='bold', rotation=0, ha='right', va='center')
-        ax5.grid(True, alpha=0.3, axis='y')
-        ax5.set_xlim(0, max_time)
-        plt.setp(ax5.get_xticklabels(), visible=False)
-        
-        # 6. Queue Depth
-        if len(proxy_metrics_timeline['timestamps']) > 0:
-            ax6.plot(proxy_metrics_timeline['timestamps'], proxy_metrics_timeline['requests_in_queue'], 
-                    color='#FF9800', linewidth=2, marker='o', markersize=2)
-            ax6.fill_between(proxy_metrics_timeline['timestamps'], 0, proxy_metrics_timeline['requests_in_queue'], alpha=0.2, color='#FF9800')
-        ax6.set_ylabel('[PROXY]\nQueue', fontsize=9, fontweight='bold', rotation=0, ha='right', va='center')
-        ax6.grid(True, alpha=0.3, axis='y')
-        ax6.set_xlim(0, max_time)
-        plt.setp(ax6.get_xticklabels(), visible=False)
-        
-        # NETWORK METRICS
-        # 7. Network Retries
-        if len(proxy_metrics_timeline['timestamps']) > 0:
-            retries_incremental = [0]
-            for i in range(1, len(proxy_metrics_timeline['retries'])):
-                increment = proxy_metrics_timeline['retries'][i] - proxy_metrics_timeline['retries'][i-1]
-                retries_incremental.append(increment)
-            ax7.bar(proxy_metrics_timeline['timestamps'], retries_incremental, 
-                    width=0.5, color='#95E1D3', alpha=0.7, edgecolor='#00A896', linewidth=1)
-            for idx, val in enumerate(retries_incremental):
-                if val > 0:
-                    for ax in [ax1, ax2, ax3, ax4, ax5, ax6, ax7, ax8, ax9]:
-                        ax.axvline(proxy_metrics_timeline['timestamps'][idx], color='green', alpha=0.08, linewidth=1.5, linestyle='--')
-        ax7.set_ylabel('[NET]\nRetries', fontsize=9, fontweight='bold', rotation=0, ha='right', va='center')
-        ax7.grid(True, alpha=0.3, axis='y')
-        ax7.set_xlim(0, max_time)
-        plt.setp(ax7.get_xticklabels(), visible=False)
-        
-        # 8. Network Variance
-        if len(network_delays) > 0:
-            window = 20
-            network_variance = []
-            variance_times = []
-            for i in range(window, len(network_delays)):
-                window_data = network_delays[i-window:i]
-                variance_times.append(latency_timestamps[i])
-                network_variance.append(np.std(window_data))
-            ax8.plot(variance_times, network_variance, color='#FF5722', linewidth=2, marker='o', markersize=2)
-            ax8.fill_between(variance_times, 0, network_variance, alpha=0.2, color='#FF5722')
-        ax8.set_ylabel('[NET]\nVariance', fontsize=9, fontweight='bold', rotation=0, ha='right', va='center')
-        ax8.grid(True, alpha=0.3, axis='y')
-        ax8.set_xlim(0, max_time)
-        plt.setp(ax8.get_xticklabels(), visible=False)
-        
-        # 9. Network Delay
-        if len(network_delays) > 0 and len(latency_timestamps) == len(network_delays):
-            ax9.plot(latency_timestamps, network_delays, color='#673AB7', linewidth=1, alpha=0.5)
-            ax9.fill_between(latency_timestamps, 0, network_delays, alpha=0.15, color='#673AB7')
-        ax9.set_ylabel('[NET]\nDelay (ms)', fontsize=9, fontweight='bold', rotation=0, ha='right', va='center')
-        ax9.set_xlabel('Time (seconds)', fontsize=11, fontweight='bold')
-        ax9.grid(True, alpha=0.3, axis='y')
-        ax9.set_xlim(0, max_time)
-    
-    elif args.mode == "proxy":
-        # PROXY MODE: Show proxy-specific metrics
-        if len(proxy_metrics_timeline['timestamps']) > 0:
-            # Calculate incremental proxy overhead events
-            overhead_incremental = [0]
-            for i in range(1, len(proxy_metrics_timeline['proxy_overhead_count'])):
-                increment = proxy_metrics_timeline['proxy_overhead_count'][i] - proxy_metrics_timeline['proxy_overhead_count'][i-1]
-                overhead_incremental.append(increment)
-            
-            # 2. Proxy Overhead Events
-            ax2.bar(proxy_metrics_timeline['timestamps'], overhead_incremental, 
-                    width=0.5, color='#4ECDC4', alpha=0.8, edgecolor='#008B8B', linewidth=1.5)
-            
-            # Add vertical lines to show correlation
-            for idx, val in enumerate(overhead_incremental):
-                if val > 0:
-                    ax1.axvline(proxy_metrics_timeline['timestamps'][idx], color='cyan', alpha=0.15, linewidth=1.5, linestyle='--')
-                    ax2.axvline(proxy_metrics_timeline['timestamps'][idx], color='cyan', alpha=0.15, linewidth=1.5, linestyle='--')
-                    ax3.axvline(proxy_metrics_timeline['timestamps'][idx], color='cyan', alpha=0.15, linewidth=1.5, linestyle='--')
-                    ax4.axvline(proxy_metrics_timeline['timestamps'][idx], color='cyan', alpha=0.15, linewidth=1.5, linestyle='--')
-                    ax5.axvline(proxy_metrics_timeline['timestamps'][idx], color='cyan', alpha=0.15, linewidth=1.5, linestyle='--')
-        
-        ax2.set_ylabel('Proxy\nOverhead', fontsize=10, fontweight='bold', rotation=0, ha='right', va='center')
-        ax2.grid(True, alpha=0.3, axis='y')
-        ax2.set_xlim(0, max_time)
-        plt.setp(ax2.get_xticklabels(), visible=False)
-        
-        # 3. Queue Depth (Requests Waiting in Proxy)
-        if len(proxy_metrics_timeline['timestamps']) > 0:
-            ax3.plot(proxy_metrics_timeline['timestamps'], proxy_metrics_timeline['requests_in_queue'], 
-                    color='#FF9800', linewidth=2.5, marker='o', markersize=3)
-            ax3.fill_between(proxy_metrics_timeline['timestamps'], 0, proxy_metrics_timeline['requests_in_queue'], 
-                            alpha=0.3, color='#FF9800')
-        
-        ax3.set_ylabel('Queue\nDepth', fontsize=10, fontweight='bold', rotation=0, ha='right', va='center')
-        ax3.grid(True, alpha=0.3, axis='y')
-        ax3.set_xlim(0, max_time)
-        plt.setp(ax3.get_xticklabels(), visible=False)
-        
-        # 4. Average Queue Wait Time
-        if len(proxy_metrics_timeline['timestamps']) > 0:
-            ax4.plot(proxy_metrics_timeline['timestamps'], proxy_metrics_timeline['avg_queue_wait'], 
-                    color='#2196F3', linewidth=2.5, marker='s', markersize=3)
-            ax4.fill_between(proxy_metrics_timeline['timestamps'], 0, proxy_metrics_timeline['avg_queue_wait'], 
-                            alpha=0.3, color='#2196F3')
-        
-        ax4.set_ylabel('Avg Queue\nWait (ms)', fontsize=10, fontweight='bold', rotation=0, ha='right', va='center')
-        ax4.grid(True, alpha=0.3, axis='y')
-        ax4.set_xlim(0, max_time)
-        plt.setp(ax4.get_xticklabels(), visible=False)
-        
-        # 5. Connection Errors
-        if len(proxy_metrics_timeline['timestamps']) > 0:
-            ax5.plot(proxy_metrics_timeline['timestamps'], proxy_metrics_timeline['connection_errors'], 
-                    color='#9C27B0', linewidth=2.5, marker='^', markersize=3)
-            ax5.fill_between(proxy_metrics_timeline['timestamps'], 0, proxy_metrics_timeline['connection_errors'], 
-                            alpha=0.3, color='#9C27B0')
-        
-        ax5.set_ylabel('Connection\nErrors', fontsize=10, fontweight='bold', rotation=0, ha='right', va='center')
-        ax5.set_xlabel('Time (seconds)', fontsize=11, fontweight='bold')
-        ax5.grid(True, alpha=0.3, axis='y')
-        ax5.set_xlim(0, max_time)
-    
-    elif args.mode == "network":
-        # NETWORK MODE: Show network-specific metrics
-        if len(proxy_metrics_timeline['timestamps']) > 0:
-            # Calculate incremental retries (new retries since last poll)
-            retries_incremental = [0]
-            for i in range(1, len(proxy_metrics_timeline['retries'])):
-                increment = proxy_metrics_timeline['retries'][i] - proxy_metrics_timeline['retries'][i-1]
-                retries_incremental.append(increment)
-            
-            # 2. Network Retries/Retransmissions
-            ax2.bar(proxy_metrics_timeline['timestamps'], retries_incremental, 
-                    width=0.5, color='#95E1D3', alpha=0.8, edgecolor='#00A896', linewidth=1.5)
-            
-            # Add vertical lines to show correlation
-            for idx, val in enumerate(retries_incremental):
-                if val > 0:
-                    ax1.axvline(proxy_metrics_timeline['timestamps'][idx], color='green', alpha=0.15, linewidth=1.5, linestyle='--')
-                    ax2.axvline(proxy_metrics_timeline['timestamps'][idx], color='green', alpha=0.15, linewidth=1.5, linestyle='--')
-                    ax3.axvline(proxy_metrics_timeline['timestamps'][idx], color='green', alpha=0.15, linewidth=1.5, linestyle='--')
-                    ax4.axvline(proxy_metrics_timeline['timestamps'][idx], color='green', alpha=0.15, linewidth=1.5, linestyle='--')
-                    ax5.axvline(proxy_metrics_timeline['timestamps'][idx], color='green', alpha=0.15, linewidth=1.5, linestyle='--')
-        
-        ax2.set_ylabel('Network\nRetries', fontsize=10, fontweight='bold', rotation=0, ha='right', va='center')
-        ax2.grid(True, alpha=0.3, axis='y')
-        ax2.set_xlim(0, max_time)
-        plt.setp(ax2.get_xticklabels(), visible=False)
-        
-        # 3. Network Delay Variance (using rolling window)
-        if len(network_delays) > 0:
-            # Calculate rolling variance
-            window = 20
-            network_variance = []
-            variance_times = []
-            for i in range(window, len(network_delays)):
-                window_data = network_delays[i-window:i]
-                variance_times.append(latency_timestamps[i])
-                network_variance.append(np.std(window_data))
-            
-            ax3.plot(variance_times, network_variance, 
-                    color='#FF9800', linewidth=2.5, marker='o', markersize=3)
-            ax3.fill_between(variance_times, 0, network_variance, 
-                            alpha=0.3, color='#FF9800')
-        
-        ax3.set_ylabel('Network\nVariance', fontsize=10, fontweight='bold', rotation=0, ha='right', va='center')
-        ax3.grid(True, alpha=0.3, axis='y')
-        ax3.set_xlim(0, max_time)
-        plt.setp(ax3.get_xticklabels(), visible=False)
-        
-        # 4. Connection Errors Over Time
-        if len(proxy_metrics_timeline['timestamps']) > 0:
-            ax4.plot(proxy_metrics_timeline['timestamps'], proxy_metrics_timeline['connection_errors'], 
-                    color='#E53935', linewidth=2.5, marker='s', markersize=3)
-            ax4.fill_between(proxy_metrics_timeline['timestamps'], 0, proxy_metrics_timeline['connection_errors'], 
-                            alpha=0.3, color='#E53935')
-        
-        ax4.set_ylabel('Connection\nErrors', fontsize=10, fontweight='bold', rotation=0, ha='right', va='center')
-        ax4.grid(True, alpha=0.3, axis='y')
-        ax4.set_xlim(0, max_time)
-        plt.setp(ax4.get_xticklabels(), visible=False)
-        
-        # 5. Network Delay (instantaneous)
-        if len(network_delays) > 0 and len(latency_timestamps) == len(network_delays):
-            ax5.plot(latency_timestamps, network_delays, 
-                    color='#9C27B0', linewidth=1.5, alpha=0.6)
-            ax5.fill_between(latency_timestamps, 0, network_delays, 
-                            alpha=0.2, color='#9C27B0')
-        
-        ax5.set_ylabel('Network\nDelay (ms)', fontsize=10, fontweight='bold', rotation=0, ha='right', va='center')
-        ax5.set_xlabel('Time (seconds)', fontsize=11, fontweight='bold')
-        ax5.grid(True, alpha=0.3, axis='y')
-        ax5.set_xlim(0, max_time)
-    
-    else:
-        # APP MODE: Show application-specific metrics
-        # 2. Lock Contention Events over time
-        if len(app_metrics_timeline['timestamps']) > 0:
-            # Calculate incremental lock contention (new events since last poll)
-            contention_incremental = [0]
-            for i in range(1, len(app_metrics_timeline['lock_contention_count'])):
-                increment = app_metrics_timeline['lock_contention_count'][i] - app_metrics_timeline['lock_contention_count'][i-1]
-                contention_incremental.append(increment)
-            
-            ax2.bar(app_metrics_timeline['timestamps'], contention_incremental, 
-                    width=0.5, color='#FF6B6B', alpha=0.8, edgecolor='darkred', linewidth=1.5)
-            
-            # Add vertical lines to show correlation
-            for idx, val in enumerate(contention_incremental):
-                if val > 0:
-                    ax1.axvline(app_metrics_timeline['timestamps'][idx], color='red', alpha=0.1, linewidth=1.5, linestyle='--')
-                    ax2.axvline(app_metrics_timeline['timestamps'][idx], color='red', alpha=0.1, linewidth=1.5, linestyle='--')
-                    ax3.axvline(app_metrics_timeline['timestamps'][idx], color='red', alpha=0.1, linewidth=1.5, linestyle='--')
-                    ax4.axvline(app_metrics_timeline['timestamps'][idx], color='red', alpha=0.1, linewidth=1.5, linestyle='--')
-                    ax5.axvline(app_metrics_timeline['timestamps'][idx], color='red', alpha=0.1, linewidth=1.5, linestyle='--')
-        
-        ax2.set_ylabel('Lock\nEvents', fontsize=10, fontweight='bold', rotation=0, ha='right', va='center')
-        ax2.grid(True, alpha=0.3, axis='y')
-        ax2.set_xlim(0, max_time)
-        plt.setp(ax2.get_xticklabels(), visible=False)
-        
-        # 3. CPU Usage over time
-        if len(app_metrics_timeline['timestamps']) > 0:
-            ax3.plot(app_metrics_timeline['timestamps'], app_metrics_timeline['cpu_usage'], 
-                    color='#FF9800', linewidth=2.5, marker='o', markersize=3)
-            ax3.fill_between(app_metrics_timeline['timestamps'], 0, app_metrics_timeline['cpu_usage'], 
-                            alpha=0.3, color='#FF9800')
-        
-        ax3.set_ylabel('CPU\n(%)', fontsize=10, fontweight='bold', rotation=0, ha='right', va='center')
-        ax3.grid(True, alpha=0.3, axis='y')
-        ax3.set_xlim(0, max_time)
-        plt.setp(ax3.get_xticklabels(), visible=False)
-        
-        # 4. Active Threads over time
-        if len(app_metrics_timeline['timestamps']) > 0:
-            ax4.plot(app_metrics_timeline['timestamps'], app_metrics_timeline['active_threads'], 
-                    color='#2196F3', linewidth=2.5, marker='s', markersize=3)
-            ax4.fill_between(app_metrics_timeline['timestamps'], 
-                            min(app_metrics_timeline['active_threads']) - 0.5,
-                            app_metrics_timeline['active_threads'], 
-                            alpha=0.3, color='#2196F3')
-        
-        ax4.set_ylabel('Active\nThreads', fontsize=10, fontweight='bold', rotation=0, ha='right', va='center')
-        ax4.grid(True, alpha=0.3, axis='y')
-        ax4.set_xlim(0, max_time)
-        plt.setp(ax4.get_xticklabels(), visible=False)
-        
-        # 5. Requests Waiting (Blocked) over time
-        if len(app_metrics_timeline['timestamps']) > 0:
-            ax5.plot(app_metrics_timeline['timestamps'], app_metrics_timeline['requests_waiting'], 
-                    color='#9C27B0', linewidth=2.5, marker='^', markersize=3)
-            ax5.fill_between(app_metrics_timeline['timestamps'], 0, app_metrics_timeline['requests_waiting'], 
-                            alpha=0.3, color='#9C27B0')
-        
-        ax5.set_ylabel('Blocked\nRequests', fontsize=10, fontweight='bold', rotation=0, ha='right', va='center')
-        ax5.set_xlabel('Time (seconds)', fontsize=11, fontweight='bold')
-        ax5.grid(True, alpha=0.3, axis='y')
-        ax5.set_xlim(0, max_time)
-    
-    # Dynamic title based on mode
-    if args.mode == "app":
-        title = 'Tail Latency Diagnosis - Application Contention Metrics'
-    elif args.mode == "proxy":
-        title = 'Tail Latency Diagnosis - Proxy Overhead Metrics'
-    else:
-        title = 'Tail Latency Diagnosis - Network Variability Metrics'
-    
-    plt.suptitle(f'{title} (Mode: {args.mode.upper()})',
-                fontsize=15, fontweight='bold', y=0.99)
-    
-    # Save the figure
-    filename = f'layer_analysis_{args.mode}.png'
-    plt.savefig(filename, dpi=300, bbox_inches='tight')
-    print(f"\n[GRAPH] Saved as: {filename}")
-    
-    plt.show(block=False)
-    plt.pause(0.1)
+            live.record(row[2], dict(zip(COMPONENTS, row[8:])))
+    with results_lock:
+        errors += failed
+        completed += 1
+        if completed % 100 == 0 and not live:
+            print(f"Progress: {completed}/{total} requests...")
 
-print("\n" + "=" * 60)
-print("LATENCY RESULTS")
-print("=" * 60)
+emit = collect  # a RowBatcher in --workers child processes
+# Counts a request as in flight on the live view; in --workers children the
+# RowBatcher passes the count on to the coordinator's dashboard
+note_started = live.started if live else None
 
-if latencies:
-    p50 = np.percentile(latencies, 50)
-    p95 = np.percentile(latencies, 95)
-    p99 = np.percentile(latencies, 99)
-    p99_9 = np.percentile(latencies, 99.9)
-    max_lat = max(latencies)
-    
-    print(f"Mode: {args.mode}")
-    print(f"Requests: {args.n}  |  Errors: {errors}")
-    print(f"\nPercentiles:")
-    print(f"  p50:   {p50:.2f} ms")
-    print(f"  p95:   {p95:.2f} ms")
-    print(f"  p99:   {p99:.2f} ms  [TAIL LATENCY]")
-    print(f"  p99.9: {p99_9:.2f} ms")
-    print(f"  max:   {max_lat:.2f} ms")
-    
-    # Calculate the delta between p99 and p50 (key metric!)
-    p99_inflation = ((p99 - p50) / p50) * 100
-    print(f"\nP99 Inflation: {p99_inflation:.1f}% above p50")
-else:
-    print("No successful requests.")
+class RowBatcher:
+    """Child-process side of --workers: queues finished request rows for the
+    coordinator in batches, every `batch_rows` rows or `interval` seconds,
+    each with the number of requests started since the previous batch"""
+    
+    def __init__(self, rows_queue, batch_rows=512, interval=0.1):
+        self.queue = rows_queue
+        self.batch_rows = batch_rows
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.rows = []
+        self.started_count = 0
+        self.last = time.monotonic()
+    
+    def __call__(self, row):
+        with self.lock:
+            self.rows.append(row)
+            if len(self.rows) >= self.batch_rows or time.monotonic() - self.last >= self.interval:
+                self._flush()
+    
+    def started(self):
+        with self.lock:
+            self.started_count += 1
+            if time.monotonic() - self.last >= self.interval:
+                self._flush()
+    
+    def _flush(self):
+        if self.rows or self.started_count:
+            self.queue.put((self.started_count, self.rows))
+        self.rows = []
+        self.started_count = 0
+        self.last = time.monotonic()
+    
+    def flush(self):
+        with self.lock:
+            self._flush()
 
-# Fetch and display layer-specific metrics
-if args.analyze and latencies:
-    print("\n" + "=" * 60)
-    print("LAYER-SPECIFIC ANALYSIS")
-    print("=" * 60)
-    
-    # Application metrics
-    print("\n[APPLICATION LAYER METRICS]")
+_sessions = threading.local()
+
+def http_client():
+    """requests itself (a new connection per request), or with --keepalive
+    this thread's Session, which keeps its connection to the proxy open"""
+    if not args.keepalive:
+        return requests
+    session = getattr(_sessions, "session", None)
+    if session is None:
+        session = _sessions.session = requests.Session()
+    return session
+
+def send_one(intended, url):
+    """Send one request. Latency is measured from the intended send time, so
+    time spent waiting for a free worker counts (no coordinated omission)."""
+    trace_id = new_trace_id()
+    if note_started:
+        note_started()
     try:
-        app_metrics = requests.get("http://127.0.0.1:5000/metrics", timeout=2).json()
-        print(f"  Total requests processed: {app_metrics['requests_total']}")
-        print(f"  Lock contention events: {app_metrics['lock_contention_count']}")
-        print(f"  Contention rate: {app_metrics['contention_rate']}%")
-        print(f"  Avg processing time: {app_metrics['avg_processing_time_ms']:.2f} ms")
-        
-        wait_time = app_metrics['avg_wait_time_ms']
-        if app_metrics['lock_contention_count'] > 0:
-            if wait_time > 10:  # Only mark as HIGH if wait time is significant
-                print(f"  Avg wait time (contended): {wait_time:.2f} ms  [HIGH]")
-            else:
-                print(f"  Avg wait time (contended): {wait_time:.2f} ms")
+        sent = time.time()
+        headers = {TRACE_HEADER: trace_id}
+        if args.deadline_ms is not None:
+            # What is left of the budget after waiting for a free worker
+            headers[DEADLINE_HEADER] = f"{args.deadline_ms - (sent - intended) * 1000:.2f}"
+        r = http_client().get(url, timeout=10, stream=True, headers=headers)
+        first_byte = time.time()
+        r.content  # read the body
+        done = time.time()
+        elapsed_ms = (done - intended) * 1000
+        parts = join_spans(elapsed_ms, (sent - intended) * 1000,
+                           decode_span(r.headers.get(PROXY_SPAN_HEADER)),
+                           decode_span(r.headers.get(APP_SPAN_HEADER)))
+        ttfb_ms = (first_byte - intended) * 1000
+        # Timing headers from the proxy (NaN when absent)
+        queue_wait = float(r.headers.get("X-Proxy-Queue-Wait-Ms", "nan"))
+        upstream_time = float(r.headers.get("X-Upstream-Time-Ms", "nan"))
+        row = (intended - start_time, done - start_time, elapsed_ms, ttfb_ms,
+               r.status_code, int(trace_id, 16), queue_wait, upstream_time,
+               *(parts[c] for c in COMPONENTS))
+    except Exception:
+        nan = float("nan")
+        row = (intended - start_time, time.time() - start_time, nan, nan, 0,
+               int(trace_id, 16), nan, nan, *(nan for _ in COMPONENTS))
+    emit(row)
+
+def worker():
+    while True:
+        item = next_request()
+        if item is None:
+            return
+        offset, request_url = item
+        if offset is not None:
+            # Open loop (--rate or --replay): each request is due at a fixed point
+            # on the arrival timeline, regardless of how long earlier requests took
+            intended = start_time + offset
+            delay = intended - time.time()
+            if delay > 0:
+                time.sleep(delay)
         else:
-            print(f"  Avg wait time (contended): {wait_time:.2f} ms")
-            
-        print(f"  CPU usage: {app_metrics['cpu_percent']:.1f}%")
-        print(f"  Active threads: {app_metrics['active_threads']}")
-    except Exception as e:
-        print(f"  [ERROR] Could not fetch app metrics: {e}")
-    
-    # Proxy metrics
-    print("\n[PROXY LAYER METRICS]")
+            intended = time.time()
+        send_one(intended, request_url)
+
+def load_process(share, rows_queue):
+    """One --workers process: sends its share of the schedule from its own
+    thread pool and streams the request rows back to the coordinator"""
+    global schedule, emit, live, note_started
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the coordinator handles Ctrl-C
+    schedule = make_schedule(share, args.workers)
+    emit = RowBatcher(rows_queue)
+    note_started = emit.started if live else None
+    live = None
+    time.sleep(max(0.0, start_time - time.time()))
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(process_concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    emit.flush()
+    rows_queue.put(None)  # done
+
+finished_processes = 0
+
+def drain(processes, rows_queue):
+    """Coordinator side of --workers: store row batches as they arrive, until
+    every process has finished (or died)"""
+    global finished_processes
+    while finished_processes < len(processes):
+        try:
+            batch = rows_queue.get(timeout=0.5)
+        except queue.Empty:
+            if not any(p.is_alive() for p in processes):
+                return
+            continue
+        if batch is None:
+            finished_processes += 1
+            continue
+        started, rows = batch
+        if live and started:
+            live.started(started)
+        for row in rows:
+            collect(row)
+
+if args.workers > 1:
+    # Fork before any thread starts; all processes share one arrival timeline
+    start_time = time.time() + 0.5
+    rows_queue = fork.Queue()
+    processes = [fork.Process(target=load_process, args=(k, rows_queue), daemon=True)
+                 for k in range(args.workers)]
+    for p in processes:
+        p.start()
+    time.sleep(max(0.0, start_time - time.time()))
+    threads = []
+else:
+    start_time = time.time()
+    processes = []
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+
+scraper = MetricsScraper(args.scrape_interval)
+scraper.start()
+if live:
+    live.start()
+
+def wait_for_load():
+    if processes:
+        drain(processes, rows_queue)
+    for t in threads:
+        t.join()
+
+for t in threads:
+    t.start()
+try:
+    wait_for_load()
+except KeyboardInterrupt:
+    # Stop handing out requests, let in-flight ones finish, then save and report as usual
+    stop_requested.set()
+    print("\nStopping: waiting for in-flight requests...")
+    wait_for_load()
+for p in processes:
+    p.join()
+
+elapsed = time.time() - start_time
+scraper.stop()
+if live:
+    live.stop()
+if stop_requested.is_set():
+    print(f"Run stopped early after {completed}/{total} requests")
+
+# Final app/proxy totals, kept with the run for the --analyze report
+final_metrics = {}
+for layer, metrics_url in (("app", f"{app_url}/metrics"), ("proxy", f"{host}/proxy/metrics")):
     try:
-        proxy_metrics = requests.get(f"{host}/proxy/metrics", timeout=2).json()
-        print(f"  Total requests: {proxy_metrics['requests_total']}")
-        print(f"  Requests in queue: {proxy_metrics['requests_in_queue']}")
-        print(f"  Avg queue wait: {proxy_metrics['avg_queue_wait_ms']:.2f} ms")
-        print(f"  Proxy overhead events: {proxy_metrics['proxy_overhead_count']}")
-        if proxy_metrics['proxy_overhead_count'] > 0:
-            print(f"  Avg proxy processing: {proxy_metrics['avg_proxy_processing_ms']:.2f} ms  [HIGH]")
-        print(f"  Connection errors: {proxy_metrics['connection_errors']}")
-        print(f"  Upstream timeouts: {proxy_metrics['upstream_timeouts']}")
+        final_metrics[layer] = requests.get(metrics_url, timeout=2).json()
     except Exception as e:
-        print(f"  [ERROR] Could not fetch proxy metrics: {e}")
-    
-    # Network metrics (from collected headers)
-    print("\n[NETWORK LAYER METRICS]")
-    if network_delays:
-        network_p50 = np.percentile(network_delays, 50)
-        network_p99 = np.percentile(network_delays, 99)
-        print(f"  Network delay p50: {network_p50:.2f} ms")
-        print(f"  Network delay p99: {network_p99:.2f} ms  [MONITORED]")
-        print(f"  Retries: {proxy_metrics.get('retries', 0)}")
-        
-        if network_p99 > network_p50 * 5:
-            print(f"  [WARNING] High network variability detected!")
-    
-    # DIAGNOSTIC SUMMARY
-    print("\n" + "=" * 60)
-    print("[DIAGNOSTIC SUMMARY]")
-    print("=" * 60)
-    
-    if args.mode == "app":
-        print("\n[ROOT CAUSE] APPLICATION-LAYER CONTENTION:")
-        print(f"  * Contention rate: {app_metrics.get('contention_rate', 0)}%")
-        print(f"  * Wait time for contended requests: {app_metrics.get('avg_wait_time_ms', 0):.2f} ms")
-        print(f"  * p99 latency aligns with lock hold time (~100ms)")
-        print(f"  * Proxy and network metrics show normal behavior")
-        
-    elif args.mode == "proxy":
-        print("\n[ROOT CAUSE] PROXY OVERHEAD:")
-        print(f"  * Proxy overhead events: {proxy_metrics.get('proxy_overhead_count', 0)}")
-        print(f"  * Avg proxy processing time: {proxy_metrics.get('avg_proxy_processing_ms', 0):.2f} ms")
-        print(f"  * p99 latency aligns with proxy delays (~50ms)")
-        print(f"  * Application processing time remains stable")
-        print(f"  * Network metrics show normal behavior")
-        
-    elif args.mode == "network":
-        print("\n[ROOT CAUSE] NETWORK VARIABILITY:")
-        print(f"  * Network retries: {proxy_metrics.get('retries', 0)}")
-        print(f"  * Network p99 delay: {network_p99:.2f} ms")
-        print(f"  * High variance in network layer measurements")
-        print(f"  * Application and proxy metrics remain stable")
-        print(f"  * p99 latency aligns with network spikes (60-150ms)")
-    
-    print("\n" + "=" * 60)
+        print(f"[WARNING] Could not fetch {layer} metrics: {e}")
+run.close(started=start_time, elapsed=elapsed, errors=errors, final_metrics=final_metrics)
+print(f"\nRun saved to {run_path}")
 
-if args.hist and latencies:
-    plt.figure(figsize=(12, 5))
-    
-    # Subplot 1: Histogram
-    plt.subplot(1, 2, 1)
-    plt.hist(latencies, bins=60, color='skyblue', edgecolor='black')
-    plt.axvline(np.percentile(latencies, 50), color='green', linestyle='--', label='p50')
-    plt.axvline(np.percentile(latencies, 99), color='red', linestyle='--', label='p99')
-    plt.title(f"Latency Distribution ({args.mode})")
-    plt.xlabel("Latency (ms)")
-    plt.ylabel("Count")
-    plt.legend()
-    
-    # Subplot 2: CDF
-    plt.subplot(1, 2, 2)
-    sorted_latencies = np.sort(latencies)
-    cdf = np.arange(1, len(sorted_latencies) + 1) / len(sorted_latencies) * 100
-    plt.plot(sorted_latencies, cdf, linewidth=2)
-    plt.axhline(50, color='green', linestyle='--', alpha=0.5, label='p50')
-    plt.axhline(99, color='red', linestyle='--', alpha=0.5, label='p99')
-    plt.title(f"Cumulative Distribution ({args.mode})")
-    plt.xlabel("Latency (ms)")
-    plt.ylabel("Percentile")
-    plt.grid(True, alpha=0.3)
-    plt.legend()
-    
-    plt.tight_layout()
-    plt.show()
+# Re-read the stored run (memory-mapped) for the report, exactly as
+# `client.py analyze` would
+report.report(open_run(run_path), analyze=args.analyze, hist=args.hist,
+              window=args.window, window_seconds=args.window_seconds,
+              headless=args.headless, dpi=args.dpi, fmt=args.fmt)
@@ -0,0 +1,149 @@
+# compare.py
+import argparse, os, sys
+import numpy as np
+import matplotlib.pyplot as plt
+from report import add_render_arguments, cdf_points, resolve_run, use_headless
+from runstore import open_run
+
+# Per-layer latency columns compared between runs (same layers as the report's bars)
+LAYERS = {
+    "total": "latency_ms",
+    "app": "upstream_ms",
+    "proxy": "proxy_ms",
+    "network": "network_ms",
+}
+PERCENTILES = (50, 99, 99.9)
+
+def layer_samples(run, column):
+    """Sorted finite values of one column over the requests that got a response"""
+    requests = run.table("requests")
+    values = np.asarray(requests[column][requests["status"] != 0], dtype=float)
+    if column in ("proxy_ms", "network_ms"):
+        # Only meaningful for responses that came through the proxy
+        values = values[np.isfinite(requests["queue_wait_ms"][requests["status"] != 0])]
+    return np.sort(values[np.isfinite(values)])
+
+def bootstrap_percentile(sorted_values, p, resamples, rng):
+    """Bootstrap distribution of the p-th percentile, without resampling.
+
+    The k-th smallest of n draws from the empirical distribution is
+    sorted_values[floor(U * n)], where U is the k-th smallest of n uniforms
+    and so Beta(k, n + 1 - k) distributed. Sorting once and drawing
+    `resamples` Betas gives the same distribution as resampling n values
+    each time, in O(n log n + resamples).
+    """
+    n = len(sorted_values)
+    k = max(1, int(np.ceil(p / 100 * n)))
+    u = rng.beta(k, n + 1 - k, resamples)
+    return sorted_values[np.minimum((u * n).astype(np.int64), n - 1)]
+
+def nearest_rank(sorted_values, p):
+    n = len(sorted_values)
+    return sorted_values[max(1, int(np.ceil(p / 100 * n))) - 1]
+
+def compare_runs(runs, resamples=2000, confidence=0.95, seed=0):
+    """Percentile deltas of each run against the first, with bootstrap CIs.
+
+    Returns rows of (run_index, layer, p, baseline, value, delta, lo, hi);
+    the interval is for the delta, from independent bootstraps of both runs.
+    """
+    rng = np.random.default_rng(seed)
+    tail = (1 - confidence) / 2 * 100
+    rows = []
+    for layer, column in LAYERS.items():
+        samples = [layer_samples(run, column) for run in runs]
+        base = samples[0]
+        if not len(base):
+            continue
+        base_boot = {p: bootstrap_percentile(base, p, resamples, rng) for p in PERCENTILES}
+        for i, values in enumerate(samples[1:], start=1):
+            if not len(values):
+                continue
+            for p in PERCENTILES:
+                deltas = bootstrap_percentile(values, p, resamples, rng) - base_boot[p]
+                lo, hi = np.percentile(deltas, [tail, 100 - tail])
+                baseline, value = nearest_rank(base, p), nearest_rank(values, p)
+                rows.append((i, layer, p, baseline, value, value - baseline, lo, hi))
+    return rows
+
+def plot_cdfs(runs, names, filename, dpi=100, show=True):
+    """Overlaid latency CDFs: linear, and the tail on a log scale"""
+    fig, (ax_cdf, ax_tail) = plt.subplots(1, 2, figsize=(14, 5))
+    for run, name in zip(runs, names):
+        values, pct = cdf_points(layer_samples(run, "latency_ms"))
+        if not len(values):
+            continue
+        ax_cdf.plot(values, pct, linewidth=2, label=name)
+        below = pct < 100  # the maximum has nothing above it on a log scale
+        ax_tail.plot(values[below], 100 - pct[below], linewidth=2, label=name)
+
+    ax_cdf.axhline(50, color='green', linestyle='--', alpha=0.5)
+    ax_cdf.axhline(99, color='red', linestyle='--', alpha=0.5)
+    ax_cdf.set_title("Cumulative Distribution")
+    ax_cdf.set_xlabel("Latency (ms)")
+    ax_cdf.set_ylabel("Percentile")
+    ax_cdf.grid(True, alpha=0.3)
+    ax_cdf.legend()
+
+    ax_tail.set_yscale('log')
+    ax_tail.invert_yaxis()
+    ax_tail.set_yticks([50, 10, 1, 0.1, 0.01])
+    ax_tail.set_yticklabels(['p50', 'p90', 'p99', 'p99.9', 'p99.99'])
+    ax_tail.set_title("Tail (log scale)")
+    ax_tail.set_xlabel("Latency (ms)")
+    ax_tail.grid(True, alpha=0.3, which='both')
+    ax_tail.legend()
+
+    plt.tight_layout()
+    fig.savefig(filename, dpi=dpi, bbox_inches='tight')
+    print(f"\n[GRAPH] Saved as: {filename}")
+    if show:
+        plt.show(block=False)
+        plt.pause(0.1)
+    else:
+        plt.close(fig)
+
+def main(argv=None):
+    """`client.py compare BASELINE RUN [RUN ...]`: tail percentile deltas with confidence intervals"""
+    parser = argparse.ArgumentParser(prog="client.py compare",
+                                     description="Compare stored runs against a baseline")
+    parser.add_argument("runs", nargs="+", help="baseline run, then one or more runs to compare ('latest' allowed)")
+    parser.add_argument("--resamples", type=int, default=2000, help="bootstrap resamples (default: 2000)")
+    parser.add_argument("--confidence", type=float, default=0.95, help="confidence level (default: 0.95)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None, help="CDF figure (default: compare.<format>)")
+    parser.add_argument("--fail-on-regression", action="store_true",
+                        help="exit with status 1 if total p99 or p99.9 got significantly worse")
+    parser.add_argument("--runs-dir", default=os.environ.get("RUNS_DIR", "runs"))
+    add_render_arguments(parser)
+    args = parser.parse_args(argv)
+    if len(args.runs) < 2:
+        parser.error("need a baseline and at least one run to compare")
+
+    paths = [resolve_run(path, args.runs_dir) for path in args.runs]
+    runs = [open_run(path) for path in paths]
+    names = [os.path.basename(os.path.normpath(path)) for path in paths]
+    print(f"Baseline: {names[0]} ({runs[0].rows('requests')} requests)")
+
+    rows = compare_runs(runs, args.resamples, args.confidence, args.seed)
+    regressed = False
+    ci = f"{args.confidence * 100:g}% CI"
+    for i, name in enumerate(names[1:], start=1):
+        print("\n" + "=" * 78)
+        print(f"{name} ({runs[i].rows('requests')} requests) vs baseline")
+        print("=" * 78)
+        print(f"  {'layer':8}{'pct':>7}{'baseline':>11}{'run':>11}{'delta':>11}   {ci:<22}")
+        for _, layer, p, baseline, value, delta, lo, hi in (r for r in rows if r[0] == i):
+            # Significant when the interval excludes zero
+            flag = "  [WORSE]" if lo > 0 else "  [BETTER]" if hi < 0 else ""
+            print(f"  {layer:8}{f'p{p:g}':>7}{baseline:>11.2f}{value:>11.2f}{delta:>+11.2f}"
+                  f"   [{lo:+.2f}, {hi:+.2f}]{flag}")
+            if layer == "total" and p >= 99 and lo > 0:
+                regressed = True
+
+    if args.headless:
+        use_headless()
+    plot_cdfs(runs, names, args.out or f"compare.{args.fmt}", dpi=args.dpi, show=not args.headless)
+    if args.fail_on_regression and regressed:
+        print("\n[FAIL] Tail latency regressed significantly")
+        sys.exit(1)
@@ -0,0 +1,97 @@
+# dashboard.py
+import sys, threading, time
+from collections import deque
+from metrics import ShardedMetrics
+from tracing import COMPONENTS
+
+_SHORT = {"client_queue": "client_q", "proxy_queue": "proxy_q"}
+
+class LiveDashboard(threading.Thread):
+    """In-place terminal view of a run while it is in progress.
+
+    Request threads call started()/record()/record_error(), which only touch
+    their own ShardedMetrics shard: a few counter updates and one histogram
+    record, whatever the run length. A background thread snapshots the totals
+    `refresh` times per second and redraws rolling p50/p99/p99.9, request and
+    error rates and the mean per-layer breakdown over the last `window`
+    seconds, from the difference between the newest snapshot and the oldest
+    one still inside the window.
+    """
+
+    def __init__(self, total, mode, refresh=4.0, window=5.0, out=sys.stdout):
+        super().__init__(daemon=True)
+        self.total = total
+        self.mode = mode
+        self.interval = 1.0 / refresh
+        self.window = window
+        self.out = out
+        self.metrics = ShardedMetrics(
+            {"started": 0, "completed": 0, "errors": 0, **{f"{c}_ms": 0.0 for c in COMPONENTS}},
+            ["latency_ms"])
+        self.history = deque()  # (time, counters, latency histogram)
+        self.stopped = threading.Event()
+        self.lines = 0
+        self.start_time = None
+
+    # -- request path --------------------------------------------------------
+    def started(self, n=1):
+        self.metrics.inc("started", n)
+
+    def record(self, latency_ms, parts):
+        metrics = self.metrics
+        metrics.inc("completed")
+        metrics.observe("latency_ms", latency_ms)
+        for c in COMPONENTS:
+            metrics.inc(f"{c}_ms", parts[c])
+
+    def record_error(self):
+        self.metrics.inc("completed")
+        self.metrics.inc("errors")
+
+    # -- refresh thread ------------------------------------------------------
+    def sample(self, now):
+        counters, hists = self.metrics.snapshot()
+        self.history.append((now, counters, hists["latency_ms"]))
+        while len(self.history) > 2 and now - self.history[1][0] >= self.window:
+            self.history.popleft()
+        return counters, hists["latency_ms"]
+
+    def run(self):
+        self.start_time = time.time()
+        self.sample(self.start_time)
+        while not self.stopped.wait(self.interval):
+            self.draw()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.draw()
+
+    def draw(self):
+        now = time.time()
+        counters, latency = self.sample(now)
+        then, old, old_latency = self.history[0]
+        delta = {name: counters[name] - old[name] for name in counters}
+        self.render(now - self.start_time, now - then, counters, delta, latency.since(old_latency))
+
+    def render(self, elapsed, span, counters, delta, window):
+        completed, answered = delta["completed"], delta["completed"] - delta["errors"]
+        rate = completed / span if span > 0 else 0.0
+        error_rate = delta["errors"] / completed * 100 if completed else 0.0
+        p50, p99, p999 = window.percentiles([50, 99, 99.9])
+        header = "".join(f"{_SHORT.get(c, c):>10}" for c in COMPONENTS)
+        means = "".join(f"{delta[f'{c}_ms'] / answered if answered else 0.0:>10.1f}" for c in COMPONENTS)
+        lines = [
+            f"[LIVE] mode: {self.mode}  elapsed: {elapsed:6.1f}s  "
+            f"done: {counters['completed']}/{self.total or '?'}  in flight: {counters['started'] - counters['completed']}"
+            f"  (Ctrl-C stops the run early)",
+            f"  last {span:4.1f}s: {rate:8.1f} req/s  errors: {error_rate:5.1f}%",
+            f"  latency ms   p50: {p50:8.2f}   p99: {p99:8.2f}   p99.9: {p999:8.2f}",
+            f"  mean ms   {header}",
+            f"            {means}",
+        ]
+        # Move back over the previous frame and redraw it in place
+        frame = (f"\x1b[{self.lines}F" if self.lines else "") + "\x1b[J" + "\n".join(lines) + "\n"
+        self.out.write(frame)
+        self.out.flush()
+        self.lines = len(lines)
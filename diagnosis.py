@@ -0,0 +1,214 @@
+# diagnosis.py
+import json, math, os
+import numpy as np
+
+# Span components (tracing.COMPONENTS) grouped by the layer they belong to
+LAYERS = {
+    "client": ("client_queue",),
+    "proxy": ("proxy_queue", "proxy"),
+    "network": ("network",),
+    "app": ("app_wait", "app_work"),
+    "other": ("other",),
+}
+ROOT_CAUSES = {
+    "client": "CLIENT-SIDE QUEUEING (load generator saturated)",
+    "proxy": "PROXY OVERHEAD",
+    "network": "NETWORK VARIABILITY",
+    "app": "APPLICATION-LAYER CONTENTION",
+    "other": "UNATTRIBUTED TIME (no span covers it)",
+}
+# Server-side metrics scraped for each layer: (timeline, column, kind).
+# "delta" columns are cumulative counters, compared per window by their increase.
+# These are the only correlation signals: a layer's own span time is part of
+# the latency, so it tracks p99 by construction. Layers without a metric of
+# their own (client, other) are never flagged.
+LAYER_METRICS = {
+    "app": (("app_timeline", "lock_contention_count", "delta"),
+            ("app_timeline", "requests_waiting", "level"),
+            ("app_timeline", "cpu_usage", "level")),
+    "proxy": (("proxy_timeline", "proxy_overhead_count", "delta"),
+              ("proxy_timeline", "requests_in_queue", "level")),
+    "network": (("proxy_timeline", "retries", "delta"),),
+}
+CORRELATED = 0.5     # Pearson r at which a layer's signal is said to track p99
+ALPHA = 0.01         # and the one-sided significance it needs, split across the layer's signals
+SIGNIFICANT = 0.25   # share of the tail excess that makes a layer a root cause
+MIN_WINDOWS = 10     # fewer windows than this and no correlation is reported
+WINDOW_REQUESTS = 50  # target requests per correlation window
+
+def layer_values(requests, answered):
+    """{layer: per-request ms} summed over the layer's span components"""
+    return {layer: np.nan_to_num(sum(np.asarray(requests[f"{c}_ms"][answered], dtype=float) for c in parts))
+            for layer, parts in LAYERS.items()}
+
+def tail_attribution(latency, layers, threshold):
+    """Share of the tail's excess latency contributed by each layer.
+
+    For requests at or above `threshold`, a layer's excess is its mean time
+    over its median across all requests; shares are the positive excesses
+    normalised to 1.
+    """
+    tail = latency >= threshold
+    rows = {}
+    for layer, values in layers.items():
+        typical = float(np.median(values)) if len(values) else 0.0
+        tail_mean = float(values[tail].mean()) if tail.any() else 0.0
+        rows[layer] = {"median_ms": typical, "tail_mean_ms": tail_mean, "excess_ms": tail_mean - typical}
+    total = sum(max(0.0, row["excess_ms"]) for row in rows.values())
+    for row in rows.values():
+        row["share"] = max(0.0, row["excess_ms"]) / total if total > 0 else 0.0
+    return int(np.count_nonzero(tail)), rows
+
+def window_percentile(bins, values, windows, p):
+    """p-th (nearest-rank) percentile of `values` (>= 0) in each window, NaN
+    where empty. One sort of 64-bit keys, the window in the high half and the
+    value's float32 bits (which order like non-negative floats) in the low
+    half, is ~15x faster than a two-key lexsort; float32 is plenty for r."""
+    keys = np.maximum(values, 0.0).astype(np.float32).view(np.uint32).astype(np.uint64)
+    keys |= bins.astype(np.uint64) << np.uint64(32)
+    keys.sort()
+    counts = np.bincount(bins, minlength=windows)
+    starts = np.cumsum(counts) - counts
+    ranks = np.maximum(np.ceil(p / 100 * counts).astype(np.int64), 1) - 1
+    out = np.full(windows, np.nan)
+    filled = counts > 0
+    low = keys[starts[filled] + ranks[filled]] & np.uint64(0xFFFFFFFF)
+    out[filled] = low.astype(np.uint32).view(np.float32)
+    return out
+
+def window_means(bins, values, windows):
+    counts = np.bincount(bins, minlength=windows)
+    sums = np.bincount(bins, weights=values, minlength=windows)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+def correlation(x, y):
+    """Pearson r over the windows where both are defined, and the one-sided
+    p-value of r > 0 from the Fisher z-transform; (NaN, NaN) below MIN_WINDOWS"""
+    ok = np.isfinite(x) & np.isfinite(y)
+    n = int(np.count_nonzero(ok))
+    if n < MIN_WINDOWS:
+        return math.nan, math.nan
+    x, y = x[ok], y[ok]
+    if x.std() == 0 or y.std() == 0:
+        return 0.0, 1.0
+    r = float(np.corrcoef(x, y)[0, 1])
+    z = math.atanh(min(r, 1 - 1e-12)) * math.sqrt(n - 3)
+    return r, 0.5 * math.erfc(z / math.sqrt(2))
+
+def timeline_signal(table, column, kind, edges):
+    """A scraped metric per window: the counter's increase, or the mean level"""
+    times = np.asarray(table["timestamps"], dtype=float)
+    values = np.asarray(table[column], dtype=float)
+    if not len(times):
+        return None
+    bins = np.clip(np.searchsorted(edges, times, side="right") - 1, 0, len(edges) - 2)
+    windows = len(edges) - 1
+    if kind == "delta":
+        increase = np.diff(values, prepend=values[:1])
+        counts = np.bincount(bins, minlength=windows)
+        return np.where(counts > 0, np.bincount(bins, weights=increase, minlength=windows), np.nan)
+    return window_means(bins, values, windows)
+
+def diagnose(run, threshold, scrape_interval=0.1):
+    """Root-cause attribution for one stored run. Returns a JSON-friendly dict.
+
+    `threshold` is the run's p99 latency; requests at or above it form the
+    tail. Every step is a vectorised pass over the request columns, so it
+    scales to runs with millions of requests.
+    """
+    requests = run.table("requests")
+    answered = np.asarray(requests["status"]) != 0
+    latency = np.asarray(requests["latency_ms"][answered], dtype=float)
+    times = np.asarray(requests["completed"][answered], dtype=float)
+    layers = layer_values(requests, answered)
+    tail_count, attribution = tail_attribution(latency, layers, threshold)
+
+    # Time windows of about WINDOW_REQUESTS requests, no shorter than a scrape
+    elapsed = float(times.max(initial=0.0))
+    windows = max(1, len(latency) // WINDOW_REQUESTS)
+    if scrape_interval > 0 and elapsed > 0:
+        windows = max(1, min(windows, int(elapsed / scrape_interval)))
+    edges = np.linspace(0.0, elapsed if elapsed > 0 else 1.0, windows + 1)
+    bins = np.clip(np.searchsorted(edges, times, side="right") - 1, 0, windows - 1)
+    p99_series = window_percentile(bins, latency, windows, 99)
+
+    tables = {name: run.table(name) for name in ("app_timeline", "proxy_timeline")}
+    correlations = {}
+    for layer in layers:
+        signals = {}
+        for table, column, kind in LAYER_METRICS.get(layer, ()):
+            series = timeline_signal(tables[table], column, kind, edges)
+            if series is not None:
+                signals[column] = series
+        tests = {name: correlation(series, p99_series) for name, series in signals.items()}
+        scored = [name for name in tests if math.isfinite(tests[name][0])]
+        best = max(scored, key=lambda name: tests[name][0]) if scored else None
+        r, p = tests[best] if best else (math.nan, math.nan)
+        correlations[layer] = {"r": r, "p": p, "signal": best,
+                               "signals": {name: r for name, (r, _) in tests.items()},
+                               "correlated": best is not None and r >= CORRELATED and p < ALPHA / len(tests)}
+
+    ranked = sorted(attribution, key=lambda layer: attribution[layer]["share"], reverse=True)
+    causes = [layer for layer in ranked if attribution[layer]["share"] >= SIGNIFICANT] or ranked[:1]
+    return {
+        "p99_ms": threshold,
+        "tail_requests": tail_count,
+        "windows": windows,
+        "window_seconds": float(edges[1] - edges[0]),
+        "attribution": attribution,
+        "correlation": correlations,
+        "root_causes": causes,
+    }
+
+def print_summary(result):
+    attribution, correlations = result["attribution"], result["correlation"]
+    print(f"\nTail attribution ({result['tail_requests']} requests >= p99 {result['p99_ms']:.2f} ms):")
+    print(f"  {'layer':10}{'share':>8}{'tail mean':>12}{'median':>10}   temporal r vs p99")
+    for layer in sorted(attribution, key=lambda layer: attribution[layer]["share"], reverse=True):
+        row, corr = attribution[layer], correlations[layer]
+        bar = "#" * int(round(row["share"] * 20))
+        flag = "  [TRACKS p99]" if corr["correlated"] else ""
+        if corr["signal"] is None:
+            temporal = ("no metric" if layer not in LAYER_METRICS else
+                        "too few windows" if result["windows"] < MIN_WINDOWS else "no data")
+        else:
+            temporal = f"{corr['r']:+.2f} ({corr['signal']}, p={corr['p']:.3f})"
+        print(f"  {layer:10}{row['share'] * 100:>7.1f}%{row['tail_mean_ms']:>10.1f}ms{row['median_ms']:>8.1f}ms"
+              f"   {temporal:38}{flag}  {bar}")
+    print(f"  (r over {result['windows']} windows of {result['window_seconds']:.2f}s; "
+          f"needs {MIN_WINDOWS}+ windows, r >= {CORRELATED} and p < {ALPHA} to flag a layer)")
+    for layer in result["root_causes"]:
+        row, corr = attribution[layer], correlations[layer]
+        if corr["correlated"]:
+            evidence = f"its {corr['signal']} tracks the p99 spikes (r={corr['r']:+.2f}, p={corr['p']:.3f})"
+        elif layer not in LAYER_METRICS:
+            evidence = "it has no metric of its own to check against p99 over time"
+        elif corr["signal"] is None:
+            evidence = "too few windows to check its metrics against p99 over time"
+        else:
+            evidence = "none of its metrics tracks p99 in time"
+        print(f"\n[ROOT CAUSE] {ROOT_CAUSES[layer]}:")
+        print(f"  * {row['share'] * 100:.0f}% of the tail's excess latency "
+              f"({row['tail_mean_ms']:.1f} ms in tail requests vs {row['median_ms']:.1f} ms typical)")
+        print(f"  * {evidence}")
+    calm = [layer for layer in attribution if layer not in result["root_causes"]
+            and attribution[layer]["share"] < 0.1 and not correlations[layer]["correlated"]]
+    if calm:
+        print(f"  * Stable layers: {', '.join(calm)}")
+
+def save(result, path):
+    """Write the diagnosis as JSON; NaN correlations become null"""
+    def clean(value):
+        if isinstance(value, dict):
+            return {k: clean(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [clean(v) for v in value]
+        if isinstance(value, float) and not math.isfinite(value):
+            return None
+        return value
+    with open(path, "w") as f:
+        json.dump(clean(result), f, indent=2)
+
+def diagnosis_path(run):
+    return os.path.join(run.path, "diagnosis.json")
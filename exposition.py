@@ -0,0 +1,126 @@
+# exposition.py
+import argparse, math, time, urllib.request
+
+# Prometheus text exposition format, served by /metrics/prom on the app and
+# /proxy/metrics/prom on the proxy. Everything is rendered from the merged
+# ShardedMetrics snapshot (counters plus LogHistograms), so a scrape costs
+# one vector add per shard and a prefix sum per histogram, however much
+# traffic was recorded.
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+PREFIX = "latency_demo_"
+
+# `le` bounds in ms for every latency histogram (exposed in seconds)
+LATENCY_BUCKETS_MS = (0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+def _number(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and not value.is_integer():
+        return repr(value)
+    return str(int(value))
+
+class Exposition:
+    """Accumulates metric families and renders them as one text page"""
+
+    def __init__(self, prefix=PREFIX):
+        self.prefix = prefix
+        self.lines = []
+
+    def _family(self, name, kind, help_text):
+        name = self.prefix + name
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} {kind}")
+        return name
+
+    def counter(self, name, help_text, value):
+        name = self._family(name + "_total", "counter", help_text)
+        self.lines.append(f"{name} {_number(value)}")
+
+    def gauge(self, name, help_text, value):
+        name = self._family(name, "gauge", help_text)
+        self.lines.append(f"{name} {_number(value)}")
+
+    def histogram_ms(self, name, help_text, hist, bounds_ms=LATENCY_BUCKETS_MS):
+        """A LogHistogram of milliseconds as a cumulative histogram in seconds"""
+        name = self._family(name + "_seconds", "histogram", help_text)
+        for bound, count in zip(bounds_ms, hist.cumulative_counts(bounds_ms)):
+            self.lines.append(f'{name}_bucket{{le="{bound / 1000:g}"}} {count}')
+        count = int(hist.counts.sum())
+        self.lines.append(f'{name}_bucket{{le="+Inf"}} {count}')
+        self.lines.append(f"{name}_sum {_number(hist.sum / 1000)}")
+        self.lines.append(f"{name}_count {count}")
+
+    def render(self):
+        return ("\n".join(self.lines) + "\n").encode()
+
+def parse(text):
+    """{(name, labels): value} for every sample line of a text exposition"""
+    samples = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        series, value = line.rsplit(" ", 1)
+        name, _, labels = series.partition("{")
+        samples[(name, labels.rstrip("}"))] = float(value)
+    return samples
+
+def check(samples):
+    """Problems with the histograms in parsed samples (empty when consistent)"""
+    problems = []
+    buckets = {}
+    for (name, labels), value in samples.items():
+        if name.endswith("_bucket"):
+            le = labels.split('"')[1]
+            buckets.setdefault(name[:-len("_bucket")], []).append(
+                (math.inf if le == "+Inf" else float(le), value))
+    for base, points in buckets.items():
+        counts = [value for _, value in sorted(points)]
+        if counts != sorted(counts):
+            problems.append(f"{base}: bucket counts are not cumulative")
+        if counts[-1] != samples.get((base + "_count", ""), counts[-1]):
+            problems.append(f"{base}: +Inf bucket != _count")
+    return problems
+
+def main(argv=None):
+    """Stand-in for a Prometheus server: scrape endpoints on an interval,
+    check that the histograms are consistent and report the scrape time
+    and request rates"""
+    parser = argparse.ArgumentParser(description="Scrape /metrics/prom endpoints like Prometheus would")
+    parser.add_argument("urls", nargs="*", default=["http://127.0.0.1:5000/metrics/prom",
+                                                     "http://127.0.0.1:8080/proxy/metrics/prom"])
+    parser.add_argument("--interval", type=float, default=1.0, help="seconds between scrapes (default: 1)")
+    parser.add_argument("--count", type=int, default=0, help="stop after this many rounds (default: run until Ctrl-C)")
+    args = parser.parse_args(argv)
+
+    previous = {}
+    rounds = 0
+    try:
+        while not args.count or rounds < args.count:
+            for url in args.urls:
+                start = time.perf_counter()
+                try:
+                    with urllib.request.urlopen(url, timeout=2) as resp:
+                        text = resp.read().decode()
+                except OSError as e:
+                    print(f"{url}: scrape failed: {e}")
+                    continue
+                scrape_ms = (time.perf_counter() - start) * 1000
+                samples = parse(text)
+                requests = sum(v for (name, _), v in samples.items() if name.endswith("requests_total"))
+                now = time.time()
+                rate = ""
+                if url in previous:
+                    then, before = previous[url]
+                    rate = f"  {(requests - before) / (now - then):8.1f} req/s"
+                previous[url] = (now, requests)
+                problems = check(samples)
+                print(f"{url}: {len(samples)} samples, {len(text)} bytes, {scrape_ms:.2f} ms{rate}"
+                      + ("" if not problems else "  [INVALID] " + "; ".join(problems)))
+            rounds += 1
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
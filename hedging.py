@@ -0,0 +1,155 @@
+# hedging.py
+import heapq, itertools, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from histogram import LogHistogram
+from upstream import Abort
+
+class TokenBucket:
+    """Retry budget: every request deposits `ratio` tokens (up to `burst`)
+    and every hedge spends one, so hedges stay at or below `ratio` of the
+    traffic on average"""
+
+    def __init__(self, ratio=0.1, burst=10.0):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = burst
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def take(self):
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+class _Hedged:
+    """Shared state of one hedged request"""
+
+    def __init__(self, start):
+        self.start = start
+        self.lock = threading.Lock()
+        self.aborts = (Abort(), Abort())
+        self.first_done = False  # attempt 0 returned; no hedge may fire after this
+        self.fired_at = None     # seconds from the start when the hedge was fired
+        self.winner = None
+        self.result = None
+        self.hedge_error = None
+        self.hedge_done = threading.Event()
+
+class Hedger:
+    """Hedged requests: if the first attempt hasn't answered after `delay`,
+    fire a second one and take whichever answers first.
+
+    The first attempt runs in the caller's thread, so its clock starts with
+    the request; a timer thread fires hedges into an executor of `workers`
+    threads (the upstream pool size is a natural bound). `delay` is fixed
+    when `delay_ms` is given; otherwise it tracks the `percentile` of
+    first-attempt times, recomputed over every `window` requests
+    (`initial_delay_ms` until the first window fills). When a hedge wins,
+    the first attempt's time is censored: only known to be at least the
+    time until the request finished, and that lower bound is what gets
+    recorded, so slow first attempts still pull the delay up instead of
+    dropping out of the sample. The loser is aborted
+    through its upstream.Abort: one still in its network delay never
+    reaches the upstream, one already sent has its connection shut down.
+    """
+
+    def __init__(self, delay_ms=None, percentile=95, ratio=0.1, burst=10.0, window=1000,
+                 initial_delay_ms=50.0, workers=32):
+        self.fixed = delay_ms is not None
+        self.delay = (delay_ms if self.fixed else initial_delay_ms) / 1000
+        self.percentile = percentile
+        self.window = window
+        self.budget = TokenBucket(ratio, burst)
+        self._times = LogHistogram()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hedge")
+        self._timers = []  # heap of (due, sequence, state, attempt, start)
+        self._sequence = itertools.count()
+        self._timer_cond = threading.Condition()
+        threading.Thread(target=self._timer_loop, name="hedge-timer", daemon=True).start()
+
+    def observe(self, seconds):
+        """Feed one first attempt's duration (or its lower bound) into the adaptive delay"""
+        if self.fixed:
+            return
+        with self._lock:
+            self._times.record(seconds * 1000)
+            if self._times.count >= self.window:
+                self.delay = self._times.percentile(self.percentile) / 1000
+                self._times = LogHistogram()
+
+    def _timer_loop(self):
+        while True:
+            with self._timer_cond:
+                while not self._timers or self._timers[0][0] > time.monotonic():
+                    self._timer_cond.wait(self._timers[0][0] - time.monotonic() if self._timers else None)
+                _, _, state, attempt, start = heapq.heappop(self._timers)
+            self._fire(state, attempt, start)
+
+    def _fire(self, state, attempt, start):
+        with state.lock:
+            if state.first_done or not self.budget.take():
+                return
+            state.fired_at = time.monotonic() - start
+        self._executor.submit(self._hedge, state, attempt)
+
+    def _hedge(self, state, attempt):
+        result, error = None, None
+        try:
+            result = attempt(1, state.aborts[1])
+        except Exception as e:
+            error = e
+        with state.lock:
+            won = result is not None and state.winner is None
+            if won:
+                state.winner, state.result = 1, result
+            else:
+                state.hedge_error = error
+            first_pending = not state.first_done
+        if won:
+            if first_pending:
+                self.observe(time.monotonic() - state.start)  # attempt 0 takes at least this long
+            state.aborts[0].abort()
+        state.hedge_done.set()
+
+    def run(self, attempt):
+        """Call attempt(index, abort) once, and a second time (index 1) if
+        the first is slower than the hedge delay and the budget allows.
+        attempt returns a result, or None if it saw `abort` and gave up;
+        errors from an aborted attempt are ignored.
+
+        Returns (result, index of the winner, seconds from the start until
+        the winner was fired, whether a hedge was sent). If every attempt
+        fails, the first error is raised.
+        """
+        self.budget.deposit()
+        start = time.monotonic()
+        state = _Hedged(start)
+        with self._timer_cond:
+            heapq.heappush(self._timers, (start + self.delay, next(self._sequence), state, attempt, start))
+            self._timer_cond.notify()
+
+        result, error = None, None
+        try:
+            result = attempt(0, state.aborts[0])
+        except Exception as e:
+            error = e
+        with state.lock:
+            state.first_done = True
+            if result is not None and state.winner is None:
+                state.winner, state.result = 0, result
+            hedged = state.fired_at is not None
+        if state.winner == 0:
+            self.observe(time.monotonic() - start)
+            state.aborts[1].abort()
+            return result, 0, 0.0, hedged
+        if hedged:
+            state.hedge_done.wait()
+            if state.winner == 1:
+                return state.result, 1, state.fired_at, True
+        raise error if error is not None else state.hedge_error
@@ -0,0 +1,165 @@
+# histogram.py
+import math
+import numpy as np
+
+class LogHistogram:
+    """Fixed-memory latency histogram with log-spaced buckets (HDR-style).
+
+    Values from `lowest` to `highest` are recorded with a relative error of
+    about `precision` (1% by default); smaller values share bucket 0 and
+    larger ones are clamped into the last bucket. Recording is O(1), and two
+    histograms with the same layout are merged with one vector add of their
+    bucket counts (a NumPy int64 array).
+    """
+
+    def __init__(self, lowest=0.001, highest=3_600_000.0, precision=0.01):
+        self.lowest = lowest
+        self.highest = highest
+        self.precision = precision
+        self._growth = 1 + 2 * precision
+        self._inv_log_growth = 1 / math.log(self._growth)
+        self.counts = np.zeros(self._index(highest) + 1, dtype=np.int64)
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    @property
+    def counts(self):
+        return self._counts
+
+    @counts.setter
+    def counts(self, counts):
+        self._counts = counts
+        self._view = memoryview(counts)  # record() increments through it: cheaper than NumPy indexing
+
+    def _index(self, value):
+        if value < self.lowest:
+            return 0
+        return int(math.log(value / self.lowest) * self._inv_log_growth) + 1
+
+    def _value_at(self, index):
+        """Representative (geometric midpoint) value of a bucket"""
+        if index == 0:
+            return 0.0
+        return self.lowest * self._growth ** (index - 0.5)
+
+    def record(self, value):
+        i = self._index(value)
+        view = self._view
+        if i >= len(view):
+            i = len(view) - 1
+        view[i] += 1
+        self.count += 1
+        self.sum += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def record_array(self, values):
+        """Record a whole array of samples at once (vectorised)"""
+        values = np.asarray(values, dtype=float)
+        if not len(values):
+            return self
+        index = np.zeros(len(values), dtype=np.int64)
+        above = values >= self.lowest
+        index[above] = (np.log(values[above] / self.lowest) * self._inv_log_growth).astype(np.int64) + 1
+        np.minimum(index, len(self.counts) - 1, out=index)
+        self.counts += np.bincount(index, minlength=len(self.counts))
+        self.count += len(values)
+        self.sum += float(values.sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        return self
+
+    def same_layout(self, other):
+        return (self.lowest, self.highest, self.precision) == (other.lowest, other.highest, other.precision)
+
+    def merge(self, other):
+        """Add another histogram's samples into this one"""
+        if not self.same_layout(other):
+            raise ValueError("cannot merge histograms with different bucket layouts")
+        self.counts += other.counts
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def since(self, earlier):
+        """Samples recorded after `earlier`, an older copy of this histogram.
+
+        Bucket counts are exact; min and max are this histogram's, so they
+        only bound the window's percentiles.
+        """
+        if not self.same_layout(earlier):
+            raise ValueError("cannot diff histograms with different bucket layouts")
+        h = LogHistogram(self.lowest, self.highest, self.precision)
+        h.counts = self.counts - earlier.counts
+        h.count = self.count - earlier.count
+        h.sum = self.sum - earlier.sum
+        if h.count:
+            h.min, h.max = self.min, self.max
+        return h
+
+    def copy(self):
+        h = LogHistogram(self.lowest, self.highest, self.precision)
+        return h.merge(self)
+
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+    def percentiles(self, ps):
+        """Nearest-rank percentiles for each p in `ps` (0-100), in one pass"""
+        # Rank against the bucket total rather than self.count, which can run
+        # ahead of the buckets when merging a histogram that is being written to
+        cumulative = np.cumsum(self.counts)
+        total = int(cumulative[-1])
+        if not total:
+            return [0.0] * len(ps)
+        ranks = [max(1, math.ceil(p / 100 * total)) for p in ps]
+        buckets = np.searchsorted(cumulative, ranks).tolist()
+        return [min(max(self._value_at(i), self.min), self.max) for i in buckets]
+
+    def percentile(self, p):
+        return self.percentiles([p])[0]
+
+    def cumulative_counts(self, bounds):
+        """Number of samples at or below each of the ascending `bounds`, as
+        for Prometheus `le` buckets. The bucket holding a bound is counted
+        in full, so a bound is effectively raised by up to 2 * precision."""
+        cumulative = np.cumsum(self.counts)
+        last = len(self.counts) - 1
+        return cumulative[[min(self._index(bound), last) for bound in bounds]].tolist()
+
+    def summary(self, ps=(50, 95, 99, 99.9)):
+        """Dict of rounded percentiles plus max, keyed like p50/p99_9"""
+        data = {f"p{p:g}".replace(".", "_"): round(v, 2) for p, v in zip(ps, self.percentiles(ps))}
+        data["max"] = round(self.max, 2) if self.count else 0.0
+        return data
+
+    def to_dict(self):
+        """JSON-friendly form with sparse bucket counts"""
+        return {
+            "lowest": self.lowest,
+            "highest": self.highest,
+            "precision": self.precision,
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+            "buckets": {str(i): int(self.counts[i]) for i in np.flatnonzero(self.counts)},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        h = cls(data["lowest"], data["highest"], data["precision"])
+        for i, c in data["buckets"].items():
+            h.counts[int(i)] = c
+        h.count = data["count"]
+        h.sum = data["sum"]
+        if h.count:
+            h.min = data["min"]
+            h.max = data["max"]
+        return h
@@ -0,0 +1,174 @@
+# metrics.py
+import threading, multiprocessing, mmap
+from collections import deque
+import numpy as np
+from histogram import LogHistogram
+
+class _Lease:
+    """Held in a thread's local storage; when the thread exits and its locals
+    are dropped, the shard goes back on the free list for the next thread"""
+
+    def __init__(self, free, shard):
+        self.free = free
+        self.shard = shard
+
+    def __del__(self):
+        self.free.append(self.shard)
+
+class ShardedMetrics:
+    """Named counters and latency histograms sharded per thread.
+
+    Writers only touch their own thread's shard, so the request path never
+    takes a shared lock. Shards are leased: when a thread exits, its shard
+    (totals included) is handed to the next new thread, so thread-per-
+    connection servers only allocate a shard, and take the registry lock,
+    when more threads are alive at once than ever before. Readers merge all
+    shards, whose number is bounded by that peak.
+    """
+
+    def __init__(self, counters, histograms=()):
+        self._initial = dict(counters)  # name -> zero value (0 or 0.0)
+        self._histograms = tuple(histograms)
+        self._local = threading.local()
+        self._registry_lock = threading.Lock()
+        self._generation = 0
+        self._shards = []  # (counters, histograms)
+        self._free = deque()  # shards of exited threads, ready for reuse
+
+    @property
+    def initial_counters(self):
+        return dict(self._initial)
+
+    @property
+    def histogram_names(self):
+        return self._histograms
+
+    def _new_shard(self):
+        return dict(self._initial), {name: LogHistogram() for name in self._histograms}
+
+    def _shard(self):
+        local = self._local
+        if getattr(local, "generation", None) != self._generation:
+            generation, free = self._generation, self._free
+            try:
+                shard = free.pop()
+            except IndexError:
+                shard = self._new_shard()
+                with self._registry_lock:
+                    if generation == self._generation:
+                        self._shards.append(shard)
+            local.counters, local.hists = shard
+            local.lease = _Lease(free, shard)
+            local.generation = generation
+        return local
+
+    def inc(self, name, amount=1):
+        self._shard().counters[name] += amount
+
+    def dec(self, name, amount=1):
+        self._shard().counters[name] -= amount
+
+    def observe(self, name, value):
+        """Record a sample into the named histogram"""
+        self._shard().hists[name].record(value)
+
+    def snapshot(self):
+        """Merged totals across all shards: (counters, histograms)"""
+        totals = dict(self._initial)
+        merged = {name: LogHistogram() for name in self._histograms}
+        with self._registry_lock:
+            shards = list(self._shards)
+        for counters, hists in shards:
+            for name, value in counters.items():
+                totals[name] += value
+            for name, h in hists.items():
+                merged[name].merge(h)
+        return totals, merged
+
+    def reset(self):
+        """Zero everything; threads pick up fresh shards on their next write"""
+        with self._registry_lock:
+            self._generation += 1
+            self._shards = []
+            self._free = deque()
+
+class SharedMetricsBoard:
+    """Per-process metrics slots in an anonymous shared-memory region.
+
+    Create it before forking; each worker process then publishes snapshots of
+    its own ShardedMetrics into its slot, and any worker can read the totals
+    across all slots. A shared generation counter lets one worker ask all the
+    others to reset. Resets, publishes and reads take one process-shared lock,
+    so a generation bump is never lost and a snapshot taken before a reset is
+    never written over the zeroed slots.
+    """
+
+    _HIST_HEADER = 4  # count, sum, min, max
+
+    def __init__(self, slots, counters, histograms=()):
+        self.slots = slots
+        self._initial = dict(counters)  # name -> zero value (0 or 0.0)
+        self.counters = tuple(counters)
+        self.histograms = tuple(histograms)
+        self._buckets = len(LogHistogram().counts)
+        self._hist_size = self._HIST_HEADER + self._buckets
+        self._slot_size = len(self.counters) + len(self.histograms) * self._hist_size
+        # cell 0 is the reset generation, slots follow
+        self._buf = mmap.mmap(-1, 8 * (1 + slots * self._slot_size))
+        self._cells = np.frombuffer(self._buf, dtype=np.float64)
+        self._lock = multiprocessing.Lock()
+
+    @property
+    def generation(self):
+        return int(self._cells[0])
+
+    def request_reset(self):
+        """Zero every slot and bump the generation so workers reset their
+        local metrics; returns the new generation"""
+        with self._lock:
+            self._cells[0] += 1
+            self._cells[1:] = 0.0
+            return int(self._cells[0])
+
+    def publish(self, slot, counters, hists, generation):
+        """Write one process's totals into its slot, unless a reset has
+        happened since the process synced to `generation`"""
+        row = np.empty(self._slot_size)
+        row[:len(self.counters)] = [counters.get(name, 0) for name in self.counters]
+        offset = len(self.counters)
+        for name in self.histograms:
+            h = hists[name]
+            row[offset:offset + self._HIST_HEADER] = (h.count, h.sum, h.min if h.count else 0.0,
+                                                      h.max if h.count else 0.0)
+            row[offset + self._HIST_HEADER:offset + self._hist_size] = h.counts
+            offset += self._hist_size
+        base = 1 + slot * self._slot_size
+        with self._lock:
+            if int(self._cells[0]) == generation:
+                self._cells[base:base + self._slot_size] = row
+
+    def read(self):
+        """Totals across all slots: (counters, histograms)"""
+        totals = dict.fromkeys(self.counters, 0.0)
+        merged = {name: LogHistogram() for name in self.histograms}
+        with self._lock:
+            cells = self._cells.copy()
+        for slot in range(self.slots):
+            base = 1 + slot * self._slot_size
+            row = cells[base:base + self._slot_size]
+            for name, value in zip(self.counters, row[:len(self.counters)].tolist()):
+                totals[name] += value
+            offset = len(self.counters)
+            for name in self.histograms:
+                count, total, lo, hi = row[offset:offset + self._HIST_HEADER].tolist()
+                if count:
+                    h = merged[name]
+                    h.counts += row[offset + self._HIST_HEADER:offset + self._hist_size].astype(np.int64)
+                    h.count += int(count)
+                    h.sum += total
+                    h.min = min(h.min, lo)
+                    h.max = max(h.max, hi)
+                offset += self._hist_size
+        # Shared memory holds doubles; restore integer counters
+        totals = {name: type(self._initial[name])(value) for name, value in totals.items()}
+        return totals, merged
@@ -1,205 +1,891 @@
 # proxy.py
-from http.server import BaseHTTPRequestHandler, HTTPServer
-import requests, urllib.parse, random, time, threading, os, json
-from collections import deque
+from http.server import BaseHTTPRequestHandler, HTTPServer, ThreadingHTTPServer
+import http.client, urllib.parse, random, time, threading, os, json, queue, selectors, socket
+from upstream import UpstreamPool
+from hedging import Hedger
+from cache import ResponseCache, CACHE_HEADER
+from admission import AdmissionControl, DEADLINE_HEADER, SHED_HEADER, SHED_REASONS
+from metrics import ShardedMetrics
+from exposition import Exposition, CONTENT_TYPE as PROM_CONTENT_TYPE
+from tracing import TRACE_HEADER, PROXY_SPAN_HEADER, APP_SPAN_HEADER, new_trace_id, encode_span
 
 UPSTREAM = os.environ.get("SERVER", "http://127.0.0.1:5000")
 
-# Proxy metrics
-proxy_metrics = {
+# Serving engine: "single" handles one connection at a time (original behaviour),
+# "threaded" spawns a thread per connection, "pool" uses a fixed worker pool fed
+# by a bounded queue of accepted connections
+ENGINES = ("single", "threaded", "pool")
+ENGINE = os.environ.get("PROXY_ENGINE", "single")
+
+# Streaming relay: forward the upstream status and headers as soon as they
+# arrive and copy the body through in CHUNK_SIZE pieces, instead of buffering
+# the whole response first
+STREAMING = os.environ.get("PROXY_STREAMING", "0") != "0"
+CHUNK_SIZE = int(os.environ.get("PROXY_CHUNK_SIZE", "65536"))
+
+# Downstream keep-alive: clients may send further requests on a connection
+# (HTTP/1.1) until it has been idle for IDLE_TIMEOUT seconds. Past
+# PROXY_MAX_KEEPALIVE open connections, responses carry "Connection: close".
+KEEPALIVE = os.environ.get("PROXY_KEEPALIVE", "1") != "0"
+IDLE_TIMEOUT = float(os.environ.get("PROXY_IDLE_TIMEOUT", "5"))
+
+HOP_BY_HOP = ("connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+              "te", "trailers", "transfer-encoding", "upgrade")
+
+# Keep-alive connections to the upstream app, shared by all proxy workers
+upstream_pool = UpstreamPool(
+    UPSTREAM,
+    size=int(os.environ.get("UPSTREAM_POOL_SIZE", os.environ.get("PROXY_WORKERS", "32"))),
+    idle_timeout=float(os.environ.get("UPSTREAM_IDLE_TIMEOUT", "30")),
+    timeout=5,
+    keepalive=os.environ.get("UPSTREAM_KEEPALIVE", "1") != "0",
+)
+
+# Admission control in front of the upstream (PROXY_ADMISSION_LIMIT=0: off;
+# client deadlines are honoured either way)
+admission = AdmissionControl(
+    limit=int(os.environ.get("PROXY_ADMISSION_LIMIT", "0")),
+    queue_size=int(os.environ.get("PROXY_ADMISSION_QUEUE", "64")),
+    max_queue_time=float(os.environ.get("PROXY_MAX_QUEUE_MS", "1000")) / 1000,
+)
+
+# Hedged requests (opt-in, buffered relay only): a second upstream attempt
+# after PROXY_HEDGE_DELAY_MS, or the observed PROXY_HEDGE_PERCENTILE of
+# first-attempt times when unset, within a budget of PROXY_HEDGE_BUDGET hedges
+# per request (bursts of up to PROXY_HEDGE_BURST)
+hedger = None
+if os.environ.get("PROXY_HEDGE", "0") != "0" and not STREAMING:
+    hedger = Hedger(
+        delay_ms=float(os.environ["PROXY_HEDGE_DELAY_MS"]) if os.environ.get("PROXY_HEDGE_DELAY_MS") else None,
+        percentile=float(os.environ.get("PROXY_HEDGE_PERCENTILE", "95")),
+        ratio=float(os.environ.get("PROXY_HEDGE_BUDGET", "0.1")),
+        burst=float(os.environ.get("PROXY_HEDGE_BURST", "10")),
+        workers=upstream_pool.size,
+    )
+
+# Response cache (opt-in, buffered relay only) keyed on path and query:
+# entries live PROXY_CACHE_TTL_MS, LRU-evicted past PROXY_CACHE_MAX_ENTRIES
+# or PROXY_CACHE_MAX_MB; concurrent misses for a key share one upstream call
+response_cache = None
+if os.environ.get("PROXY_CACHE", "0") != "0" and not STREAMING:
+    response_cache = ResponseCache(
+        max_entries=int(os.environ.get("PROXY_CACHE_MAX_ENTRIES", "1024")),
+        max_bytes=int(float(os.environ.get("PROXY_CACHE_MAX_MB", "64")) * 1024 * 1024),
+        ttl=float(os.environ.get("PROXY_CACHE_TTL_MS", "1000")) / 1000,
+    )
+
+# Proxy metrics (per-thread shards, merged on read). Timings go into
+# log-bucketed histograms, so percentiles need no retained samples.
+proxy_metrics = ShardedMetrics({
     "requests_total": 0,
     "requests_in_queue": 0,
-    "queue_wait_times": deque(maxlen=1000),
-    "proxy_processing_times": deque(maxlen=1000),
     "proxy_overhead_count": 0,
-    "network_delays": deque(maxlen=1000),
     "connection_errors": 0,
+    "downstream_disconnects": 0,
     "retries": 0,
     "upstream_timeouts": 0,
-}
-proxy_lock = threading.Lock()
+    "bytes_relayed": 0,
+    "downstream_connections": 0,
+    "downstream_requests": 0,
+    "downstream_reused": 0,
+    "keepalive_closes": 0,
+    "idle_timeouts": 0,
+    **{f"shed_{reason}": 0 for reason in SHED_REASONS},
+    "hedge_requests": 0,
+    "hedges_sent": 0,
+    "hedge_wins": 0,
+}, histograms=("queue_wait_ms", "accept_wait_ms", "admission_wait_ms", "proxy_processing_ms",
+               "network_delay_ms", "upstream_time_ms", "relay_ms"))
+
+# Chunk-size line room in front of the relay buffer (hex length + CRLF)
+_FRAME_HEAD = 10
+_relay_local = threading.local()
+
+def relay_buffer():
+    """This thread's reusable relay buffer, with room for chunked framing"""
+    buf = getattr(_relay_local, "buf", None)
+    if buf is None or len(buf) != _FRAME_HEAD + CHUNK_SIZE + 2:
+        buf = _relay_local.buf = memoryview(bytearray(_FRAME_HEAD + CHUNK_SIZE + 2))
+    return buf
+
+def draw_network_delay(mode):
+    """Simulated network delay in seconds for one trip to the upstream"""
+    if mode not in ("mixed", "network"):
+        return 0.0
+    # mixed: 7% chance of issues in total; network: small probability of big
+    # jitter and small probability of medium jitter
+    r = random.random()
+    if r < (0.03 if mode == "mixed" else 0.02):
+        proxy_metrics.inc("retries")
+        return 0.15   # 150ms spike (packet loss, retransmission)
+    if r < 0.07:
+        return 0.06   # 60ms jitter (congestion)
+    return 0.002      # base small delay
+
+class ConnectionCap:
+    """Open downstream connections; only the first `limit` may stay open
+    between requests"""
+    
+    def __init__(self, limit):
+        self.limit = limit
+        self.open = 0
+        self.lock = threading.Lock()
+    
+    def opened(self):
+        """Count a new connection; True if it may be kept alive"""
+        with self.lock:
+            self.open += 1
+            return self.open <= self.limit
+    
+    def closed(self):
+        with self.lock:
+            self.open -= 1
+
+downstream = ConnectionCap(int(os.environ.get("PROXY_MAX_KEEPALIVE", "256")))
+
+class ThreadPoolHTTPServer(HTTPServer):
+    """HTTPServer that hands accepted connections to a fixed pool of worker
+    threads. When the queue is full the accept loop blocks, pushing back into
+    the listen backlog instead of growing without bound."""
+    request_queue_size = 128
+    
+    def __init__(self, server_address, handler_class, workers=32, queue_size=128):
+        super().__init__(server_address, handler_class)
+        self.pending = queue.Queue(maxsize=queue_size)  # (socket, address, queued at, kept-alive state)
+        self.local = threading.local()
+        self.idle = IdleConnections(self, IDLE_TIMEOUT)
+        self.idle.start()
+        self.workers = [threading.Thread(target=self._worker, daemon=True) for _ in range(workers)]
+        for t in self.workers:
+            t.start()
+    
+    def process_request(self, request, client_address):
+        self.pending.put((request, client_address, time.time(), None))
+    
+    def _worker(self):
+        local = self.local
+        while True:
+            request, client_address, queued_at, local.resumed = self.pending.get()
+            local.accept_wait = time.time() - queued_at
+            local.parked = False
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                if not local.parked:
+                    self.shutdown_request(request)
+    
+    def accept_wait(self):
+        """Time the current worker's connection sat in the queue before pickup"""
+        return getattr(self.local, "accept_wait", 0.0)
+    
+    def resumed(self):
+        """Kept-alive state of the connection this worker picked up, if it
+        is coming back from IdleConnections"""
+        return self.local.resumed
+    
+    def park(self, request, client_address, state):
+        """Hand a kept-alive connection to IdleConnections instead of closing it"""
+        self.local.parked = True
+        self.idle.park(request, client_address, state)
+
+class IdleConnections(threading.Thread):
+    """Kept-alive connections between requests, for the worker pool: they
+    wait on a selector instead of holding a worker, go back on the queue as
+    soon as their next request arrives, and are closed once idle for
+    `idle_timeout` seconds"""
+    
+    def __init__(self, server, idle_timeout):
+        super().__init__(daemon=True)
+        self.server = server
+        self.idle_timeout = idle_timeout
+        self.selector = selectors.DefaultSelector()
+        self.wakeup, self._wakeup_send = socket.socketpair()
+        self.wakeup.setblocking(False)
+        self._wakeup_send.setblocking(False)
+        self.selector.register(self.wakeup, selectors.EVENT_READ)
+        self.lock = threading.Lock()
+        self.incoming = []
+        self.parked = {}  # socket -> (address, state, parked at), oldest first
+    
+    def park(self, sock, client_address, state):
+        with self.lock:
+            self.incoming.append((sock, client_address, state))
+        try:
+            self._wakeup_send.send(b"\0")
+        except BlockingIOError:
+            pass  # a wakeup is already pending
+    
+    def run(self):
+        parked = self.parked
+        while True:
+            timeout = None
+            if parked:
+                oldest = next(iter(parked.values()))[2]
+                timeout = max(0.0, oldest + self.idle_timeout - time.monotonic())
+            for key, _ in self.selector.select(timeout):
+                sock = key.fileobj
+                if sock is self.wakeup:
+                    try:
+                        while sock.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    continue
+                # Next request (or the client closing): back to a worker
+                self.selector.unregister(sock)
+                client_address, state, _ = parked.pop(sock)
+                self.server.pending.put((sock, client_address, time.time(), state))
+            with self.lock:
+                incoming, self.incoming = self.incoming, []
+            now = time.monotonic()
+            for sock, client_address, state in incoming:
+                self.selector.register(sock, selectors.EVENT_READ)
+                parked[sock] = (client_address, state, now)
+            while parked:
+                sock, (_, _, since) = next(iter(parked.items()))
+                if now - since < self.idle_timeout:
+                    break
+                del parked[sock]
+                self.selector.unregister(sock)
+                self.server.shutdown_request(sock)
+                downstream.closed()
+                proxy_metrics.inc("idle_timeouts")
+
+class ThreadPerConnectionHTTPServer(ThreadingHTTPServer):
+    request_queue_size = 128
 
 class Handler(BaseHTTPRequestHandler):
+    disable_nagle_algorithm = True  # streamed bodies go out as many small writes
+    # HTTP/1.1 keeps connections open between requests; the socket timeout
+    # is the idle timeout (see run() for the single-threaded engine)
+    protocol_version = "HTTP/1.1" if KEEPALIVE else "HTTP/1.0"
+    timeout = IDLE_TIMEOUT if KEEPALIVE else None
+    
+    def setup(self):
+        super().setup()
+        self.picked_up = False  # first request through this handler instance
+        self.parked = False
+        state = self.server.resumed() if hasattr(self.server, "resumed") else None
+        if state:
+            self.served, self.keepalive_slot = state
+            return
+        self.served = 0
+        self.keepalive_slot = downstream.opened()
+        proxy_metrics.inc("downstream_connections")
+    
+    def handle(self):
+        """Serve requests on the connection. With the worker pool, a kept-alive
+        connection with no request waiting is parked (IdleConnections) rather
+        than holding this worker until its next request."""
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection:
+            if hasattr(self.server, "park") and not self.request_buffered():
+                self.server.park(self.connection, self.client_address, (self.served, self.keepalive_slot))
+                self.parked = True
+                return
+            self.handle_one_request()
+    
+    def request_buffered(self):
+        """Whether the next request is already readable without blocking"""
+        self.connection.setblocking(False)
+        try:
+            return bool(self.rfile.peek(1))
+        except OSError:
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+    
+    def finish(self):
+        try:
+            super().finish()
+        finally:
+            if not self.parked:
+                downstream.closed()
+    
     def log_message(self, format, *args):
         # Suppress default logging
         pass
     
+    def log_error(self, format, *args):
+        # The only error the base handler logs on a quiet connection
+        if format.startswith("Request timed out"):
+            proxy_metrics.inc("idle_timeouts")
+    
+    def keep_alive(self):
+        """Whether this connection may stay open after the current response
+        (it was opened under the connection cap)"""
+        return self.keepalive_slot
+    
+    def end_headers(self):
+        if not self.close_connection and not self.keep_alive():
+            self.send_header("Connection", "close")  # also sets close_connection
+            proxy_metrics.inc("keepalive_closes")
+        super().end_headers()
+    
+    def flush_headers(self):
+        try:
+            super().flush_headers()
+        except (BrokenPipeError, ConnectionResetError):
+            self.client_gone = True
+            raise
+    
+    def send_downstream(self, data):
+        """Write part of the response to the client, noting a client that
+        went away so it is not blamed on the upstream"""
+        try:
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            self.client_gone = True
+            raise
+    
+    def discard_request_body(self):
+        """Read past a request body we do not forward, so the next request on
+        the connection starts at the right byte; a chunked one ends it"""
+        if "chunked" in self.headers.get("Transfer-Encoding", "").lower():
+            self.close_connection = True
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+    
     def do_GET(self):
-        global proxy_metrics
-        
         request_start = time.time()
+        accept_wait = self.server.accept_wait() if hasattr(self.server, "accept_wait") else 0.0
+        if self.picked_up:
+            accept_wait = 0.0  # only the first request after pickup waited for a worker
+        self.picked_up = True
+        self.discard_request_body()
         
         # Special endpoints for proxy metrics
         if self.path == "/proxy/metrics":
             self.serve_proxy_metrics()
             return
+        elif self.path == "/proxy/metrics/prom":
+            self.serve_prometheus_metrics()
+            return
         elif self.path == "/proxy/metrics/reset":
             self.reset_proxy_metrics()
             return
         
+        # Requests on a connection that already carried one skipped the handshake
+        self.served += 1
+        proxy_metrics.inc("downstream_requests")
+        if self.served > 1:
+            proxy_metrics.inc("downstream_reused")
+        
         # parse query params, keep 'mode' param and forward it
         parsed = urllib.parse.urlparse(self.path)
         qs = urllib.parse.parse_qs(parsed.query)
         mode = qs.get("mode", ["none"])[0]
         
+        # Join the client's trace, or start one
+        self.trace_id = self.headers.get(TRACE_HEADER) or new_trace_id()
+        self.arrival = request_start - accept_wait
+        self.timings = (accept_wait, 0.0, 0.0, 0.0)
+        self.admitted = False
+        self.upstream_time = None
+        
+        # A fresh cached response is answered without crossing the network
+        upstream_path = parsed.path + ("?" + parsed.query if parsed.query else "")
+        cached = response_cache.get(upstream_path) if response_cache else None
+        
+        # Shed on arrival, before the simulated proxy and network delays, so a
+        # request that is already past its deadline (or can't get a slot) gets
+        # its early 503 at once. With the cache only the deadline is checked
+        # here: the slot is taken by the request that actually goes upstream,
+        # not by one that joins an identical fetch in progress (fetch_upstream)
+        if cached is None:
+            reason = self.check_deadline() if response_cache else self.admit()
+            if reason:
+                self.send_shed_response(reason, self.timings)
+                return
+        
         # Track queue entry
-        with proxy_lock:
-            proxy_metrics["requests_in_queue"] += 1
+        proxy_metrics.inc("requests_in_queue")
         
         queue_start = time.time()
         proxy_delay = 0.0
         network_delay = 0.0
         
         # MIXED MODE: Realistic scenario where any layer can have issues
-        if mode == "mixed":
-            # 5% chance of proxy overhead
-            if random.random() < 0.05:
-                proxy_delay = 0.05
-                time.sleep(proxy_delay)
-                with proxy_lock:
-                    proxy_metrics["proxy_overhead_count"] += 1
-            
-            # Network issues (7% chance total)
-            r = random.random()
-            if r < 0.03:
-                network_delay = 0.15  # Big spike - 3%
-                time.sleep(network_delay)
-                with proxy_lock:
-                    proxy_metrics["retries"] += 1
-            elif r < 0.07:
-                network_delay = 0.06  # Medium jitter - 4%
-                time.sleep(network_delay)
-            else:
-                network_delay = 0.002  # Base delay
-                time.sleep(network_delay)
-        
-        # Simulate proxy overhead (mode=proxy): 5% of requests get 50ms delay
-        # This represents proxy CPU saturation, config parsing, routing logic
-        elif mode == "proxy":
+        # (5% chance of proxy overhead); mode=proxy: 5% of requests get 50ms
+        # delay, representing proxy CPU saturation, config parsing, routing logic
+        if mode in ("mixed", "proxy"):
             if random.random() < 0.05:
                 proxy_delay = 0.05
                 time.sleep(proxy_delay)  # 50 ms proxy-induced delay
-                with proxy_lock:
-                    proxy_metrics["proxy_overhead_count"] += 1
-
-        # Simulate network variability (mode=network): random jitter/packet loss
-        elif mode == "network":
-            # Small probability of big jitter and small probability of medium jitter
-            r = random.random()
-            if r < 0.02:
-                network_delay = 0.15   # 150ms spike (packet loss, retransmission)
-                time.sleep(network_delay)
-                with proxy_lock:
-                    proxy_metrics["retries"] += 1
-            elif r < 0.07:
-                network_delay = 0.06   # 60ms jitter (congestion)
-                time.sleep(network_delay)
-            else:
-                network_delay = 0.002  # base small delay
-                time.sleep(network_delay)
+                proxy_metrics.inc("proxy_overhead_count")
+        
+        # Network issues. With hedging each upstream attempt sleeps its own
+        # draw instead (see fetch_hedged), so a hedge can dodge a spike
+        if cached is None:
+            network_delay = draw_network_delay(mode)
+        if network_delay and not hedger:
+            time.sleep(network_delay)
         
         queue_wait = time.time() - queue_start
         
         # Track that we're processing (out of queue)
-        with proxy_lock:
-            proxy_metrics["requests_in_queue"] -= 1
-            proxy_metrics["requests_total"] += 1
-            proxy_metrics["queue_wait_times"].append(queue_wait * 1000)
-            if proxy_delay > 0:
-                proxy_metrics["proxy_processing_times"].append(proxy_delay * 1000)
-            if network_delay > 0:
-                proxy_metrics["network_delays"].append(network_delay * 1000)
+        proxy_metrics.dec("requests_in_queue")
+        proxy_metrics.inc("requests_total")
+        proxy_metrics.observe("queue_wait_ms", queue_wait * 1000)
+        proxy_metrics.observe("accept_wait_ms", accept_wait * 1000)
+        if proxy_delay > 0:
+            proxy_metrics.observe("proxy_processing_ms", proxy_delay * 1000)
+        if network_delay > 0:
+            proxy_metrics.observe("network_delay_ms", network_delay * 1000)
+        
+        if cached is not None:
+            self.send_cached(cached, (accept_wait, queue_wait, proxy_delay, 0.0))
+            return
+        
+        # Admission wait (if any) is already in the first slot
+        self.timings = (self.timings[0], queue_wait, proxy_delay, network_delay)
+        self.response_started = False
+        self.client_gone = False
+        self.mode = mode
         
         # Forward request to upstream app, preserving mode param
-        upstream_url = UPSTREAM + parsed.path + ("?" + parsed.query if parsed.query else "")
         try:
-            upstream_start = time.time()
-            resp = requests.get(upstream_url, timeout=5)
-            upstream_time = time.time() - upstream_start
-            
-            body = resp.content
-            self.send_response(resp.status_code)
-            
-            # Add proxy timing headers for observability
-            self.send_header("X-Proxy-Queue-Wait-Ms", f"{queue_wait * 1000:.2f}")
-            self.send_header("X-Proxy-Processing-Ms", f"{proxy_delay * 1000:.2f}")
-            self.send_header("X-Network-Delay-Ms", f"{network_delay * 1000:.2f}")
-            self.send_header("X-Upstream-Time-Ms", f"{upstream_time * 1000:.2f}")
+            if STREAMING:
+                self.forward_streaming(upstream_path, self.timings)
+            else:
+                self.forward_buffered(upstream_path)
+        except TimeoutError:
+            proxy_metrics.inc("upstream_timeouts")
+            self.send_error_response(504, b"Gateway Timeout")
+        except (OSError, http.client.HTTPException) as e:
+            if self.client_gone:
+                # The client hung up mid-response; the upstream was fine
+                proxy_metrics.inc("downstream_disconnects")
+                self.close_connection = True
+            else:
+                proxy_metrics.inc("connection_errors")
+                self.send_error_response(502, str(e).encode())
+        finally:
+            if self.admitted:
+                admission.release(self.upstream_time)
+    
+    def admit(self):
+        """Wait for an upstream slot. Returns None once admitted, else the
+        reason the request is shed; the wait counts as proxy queueing in
+        the span (added to self.timings)"""
+        reason, admission_wait = admission.admit(self.deadline())
+        proxy_metrics.observe("admission_wait_ms", admission_wait * 1000)
+        accept_wait, queue_wait, proxy_delay, network_delay = self.timings
+        self.timings = (accept_wait + admission_wait, queue_wait, proxy_delay, network_delay)
+        if reason:
+            proxy_metrics.inc(f"shed_{reason}")
+            return reason
+        self.admitted = True
+        return None
+    
+    def check_deadline(self):
+        """The shed reason if the deadline already can't be met, else None"""
+        if admission.expired(self.deadline()):
+            proxy_metrics.inc("shed_deadline")
+            return "deadline"
+        return None
+    
+    def deadline(self):
+        """Unix time by which the client needs its answer, from the remaining
+        budget in DEADLINE_HEADER (ms, counted from arrival); None if unset"""
+        budget = self.headers.get(DEADLINE_HEADER)
+        if budget is None:
+            return None
+        try:
+            return self.arrival + float(budget) / 1000
+        except ValueError:
+            return None
+    
+    @staticmethod
+    def shed_response(reason):
+        """(status, headers, body) of the early 503 for a shed request"""
+        body = f"Service Unavailable: shed ({reason})".encode()
+        return 503, [(SHED_HEADER, reason), ("Retry-After", "1")], body
+    
+    def send_shed_response(self, reason, timings):
+        """Early 503 for a request the proxy won't forward"""
+        status, headers, body = self.shed_response(reason)
+        self.send_upstream_head(status, headers, timings, 0.0)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def send_upstream_head(self, status, headers, timings, upstream_time, skip=()):
+        """Status line, proxy timing headers and the upstream's end-to-end headers"""
+        accept_wait, queue_wait, proxy_delay, network_delay = timings
+        self.send_response(status)
+        
+        # Add proxy timing headers for observability
+        self.send_header("X-Proxy-Queue-Wait-Ms", f"{queue_wait * 1000:.2f}")
+        self.send_header("X-Proxy-Processing-Ms", f"{proxy_delay * 1000:.2f}")
+        self.send_header("X-Network-Delay-Ms", f"{network_delay * 1000:.2f}")
+        self.send_header("X-Upstream-Time-Ms", f"{upstream_time * 1000:.2f}")
+        self.send_header(TRACE_HEADER, self.trace_id)
+        self.send_header(PROXY_SPAN_HEADER, encode_span(
+            arrival=self.arrival, queue=accept_wait * 1000, proxy=proxy_delay * 1000,
+            network=network_delay * 1000, upstream=upstream_time * 1000))
+        
+        skip = (TRACE_HEADER.lower(),) + tuple(skip)
+        for k, v in headers:
+            # skip hop-by-hop headers
+            if k.lower() not in HOP_BY_HOP and k.lower() not in skip:
+                self.send_header(k, v)
+    
+    def forward_buffered(self, upstream_path):
+        """Read the whole upstream response, then send it on. With the cache,
+        a request that found another one already fetching the same key waits
+        for it, and that wait is its upstream time; if the fetching request
+        was shed, so is the waiting one. The app's span belongs to the
+        request that fetched, so it is only passed on to that one."""
+        upstream_start = time.time()
+        outcome = None
+        if response_cache:
+            (status, headers, body), outcome = response_cache.fetch(
+                upstream_path, lambda: self.fetch_upstream(upstream_path))
+        else:
+            status, headers, body = self.fetch_upstream(upstream_path)
+        if self.upstream_time is None:
+            self.upstream_time = time.time() - upstream_start
+        upstream_time, timings = self.upstream_time, self.timings
+        proxy_metrics.observe("upstream_time_ms", upstream_time * 1000)
+        
+        skip = ("content-length",) + ((APP_SPAN_HEADER.lower(),) if outcome == "coalesced" else ())
+        self.send_upstream_head(status, headers, timings, upstream_time, skip=skip)
+        self.send_header("Content-Length", str(len(body)))
+        if outcome:
+            self.send_header(CACHE_HEADER, outcome.upper())
+        self.end_headers()
+        self.response_started = True
+        relay_start = time.time()
+        self.send_downstream(body)
+        proxy_metrics.observe("relay_ms", (time.time() - relay_start) * 1000)
+        proxy_metrics.inc("bytes_relayed", len(body))
+    
+    def fetch_upstream(self, upstream_path):
+        """One upstream GET, hedged if enabled. Sets self.upstream_time (and,
+        when hedging, self.timings) and returns (status, headers, body).
+        With the cache, admission is taken here; a shed request gets the
+        503 as its response."""
+        if response_cache:
+            reason = self.admit()
+            if reason:
+                self.upstream_time = 0.0
+                return self.shed_response(reason)
+        if hedger:
+            status, headers, body, self.timings, self.upstream_time = self.fetch_hedged(
+                upstream_path, self.timings)
+            return status, headers, body
+        upstream_start = time.time()
+        response = upstream_pool.get(upstream_path, {TRACE_HEADER: self.trace_id})
+        self.upstream_time = time.time() - upstream_start
+        return response
+    
+    def send_cached(self, response, timings):
+        """Answer from the cache: no network delay, no upstream time"""
+        status, headers, body = response
+        self.send_upstream_head(status, headers, timings, 0.0,
+                                skip=("content-length", APP_SPAN_HEADER.lower()))
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header(CACHE_HEADER, "HIT")
+        self.end_headers()
+        self.wfile.write(body)
+        proxy_metrics.inc("bytes_relayed", len(body))
+    
+    def fetch_hedged(self, upstream_path, timings):
+        """Upstream GET through the hedger. Each attempt first sleeps its own
+        simulated network delay (the first reuses the one drawn in do_GET).
+        Returns the winner's response plus timings adjusted to it: its
+        network delay, and the wait before it was fired counted as proxy time."""
+        accept_wait, queue_wait, proxy_delay, network_delay = timings
+        headers = {TRACE_HEADER: self.trace_id}
+        mode = self.mode
+        
+        def attempt(index, abort):
+            network = network_delay if index == 0 else draw_network_delay(mode)
+            if network and abort.wait(network):
+                return None  # the other attempt already answered
+            if index:
+                proxy_metrics.observe("network_delay_ms", network * 1000)
+            start = time.time()
+            status, resp_headers, body = upstream_pool.get(upstream_path, headers, abort=abort)
+            return status, resp_headers, body, network, time.time() - start
+        
+        result, winner, fired_at, hedged = hedger.run(attempt)
+        status, resp_headers, body, network, upstream_time = result
+        proxy_metrics.inc("hedge_requests")
+        if hedged:
+            proxy_metrics.inc("hedges_sent")
+            if winner:
+                proxy_metrics.inc("hedge_wins")
+        return (status, resp_headers, body,
+                (accept_wait, queue_wait, proxy_delay + fired_at, network), upstream_time)
+    
+    def forward_streaming(self, upstream_path, timings):
+        """Send the upstream head as soon as it arrives, then copy the body
+        through a reused buffer. X-Upstream-Time-Ms is time to the upstream's
+        response head."""
+        upstream_start = time.time()
+        with upstream_pool.stream(upstream_path, {TRACE_HEADER: self.trace_id}) as resp:
+            upstream_time = self.upstream_time = time.time() - upstream_start
+            proxy_metrics.observe("upstream_time_ms", upstream_time * 1000)
             
-            for k, v in resp.headers.items():
-                # skip hop-by-hop headers
-                if k.lower() not in ("connection","keep-alive","proxy-authenticate","proxy-authorization","te","trailers","transfer-encoding","upgrade"):
-                    self.send_header(k, v)
-            self.end_headers()
-            self.wfile.write(body)
-        except requests.Timeout:
-            with proxy_lock:
-                proxy_metrics["upstream_timeouts"] += 1
-            self.send_response(504)
-            self.end_headers()
-            self.wfile.write(b"Gateway Timeout")
-        except requests.RequestException as e:
-            with proxy_lock:
-                proxy_metrics["connection_errors"] += 1
-            self.send_response(502)
+            # Keep the upstream's Content-Length if it sent one; otherwise
+            # re-chunk for HTTP/1.1 clients, or delimit the body by closing
+            length_known = resp.getheader("Content-Length") is not None
+            chunked = (not length_known and self.request_version == "HTTP/1.1"
+                       and self.protocol_version == "HTTP/1.1")
+            self.send_upstream_head(resp.status, resp.getheaders(), timings, upstream_time)
+            if chunked:
+                self.send_header("Transfer-Encoding", "chunked")
+            elif not length_known:
+                self.send_header("Connection", "close")
+                self.close_connection = True
             self.end_headers()
-            self.wfile.write(str(e).encode())
+            self.response_started = True
+            
+            relay_start = time.time()
+            try:
+                relayed = self.relay_body(resp, chunked)
+            finally:
+                proxy_metrics.observe("relay_ms", (time.time() - relay_start) * 1000)
+        proxy_metrics.inc("bytes_relayed", relayed)
+    
+    def relay_body(self, resp, chunked):
+        """Copy the upstream body downstream in pieces of up to CHUNK_SIZE.
+        Length-delimited bodies are read straight into the reused buffer;
+        chunked ones are relayed a chunk at a time as they arrive, since
+        readinto() would wait for a full buffer."""
+        buf = relay_buffer()
+        body = buf[_FRAME_HEAD:_FRAME_HEAD + CHUNK_SIZE]
+        total = 0
+        while True:
+            if resp.chunked:
+                data = resp.read1(CHUNK_SIZE)
+                n = len(data)
+                body[:n] = data
+            else:
+                n = resp.readinto(body)
+            if not n:
+                break
+            total += n
+            if chunked:
+                # Frame in place: size line before the data, CRLF after it
+                size_line = b"%x\r\n" % n
+                start = _FRAME_HEAD - len(size_line)
+                buf[start:_FRAME_HEAD] = size_line
+                buf[_FRAME_HEAD + n:_FRAME_HEAD + n + 2] = b"\r\n"
+                self.send_downstream(buf[start:_FRAME_HEAD + n + 2])
+            else:
+                self.send_downstream(body[:n])
+        if chunked:
+            self.send_downstream(b"0\r\n\r\n")
+        return total
+    
+    def send_error_response(self, status, message):
+        """Error status for the client; once the response has started the
+        only option left is to cut the connection"""
+        if self.response_started:
+            self.close_connection = True
+            return
+        self.send_response(status)
+        self.send_header(TRACE_HEADER, self.trace_id)
+        self.send_header("Content-Length", str(len(message)))
+        self.end_headers()
+        self.wfile.write(message)
     
     def serve_proxy_metrics(self):
         """Serve proxy metrics"""
-        with proxy_lock:
-            avg_queue_wait = (sum(proxy_metrics["queue_wait_times"]) / len(proxy_metrics["queue_wait_times"])
-                             if proxy_metrics["queue_wait_times"] else 0)
-            avg_proxy_processing = (sum(proxy_metrics["proxy_processing_times"]) / len(proxy_metrics["proxy_processing_times"])
-                                   if proxy_metrics["proxy_processing_times"] else 0)
-            avg_network_delay = (sum(proxy_metrics["network_delays"]) / len(proxy_metrics["network_delays"])
-                                if proxy_metrics["network_delays"] else 0)
-            
-            metrics_data = {
-                "requests_total": proxy_metrics["requests_total"],
-                "requests_in_queue": proxy_metrics["requests_in_queue"],
-                "avg_queue_wait_ms": round(avg_queue_wait, 2),
-                "proxy_overhead_count": proxy_metrics["proxy_overhead_count"],
-                "avg_proxy_processing_ms": round(avg_proxy_processing, 2),
-                "avg_network_delay_ms": round(avg_network_delay, 2),
-                "connection_errors": proxy_metrics["connection_errors"],
-                "retries": proxy_metrics["retries"],
-                "upstream_timeouts": proxy_metrics["upstream_timeouts"],
-            }
+        m, hists = proxy_metrics.snapshot()
+        
+        metrics_data = {
+            "engine": ENGINE,
+            "requests_total": m["requests_total"],
+            "requests_in_queue": m["requests_in_queue"],
+            "pending_connections": self.server.pending.qsize() if hasattr(self.server, "pending") else 0,
+            "avg_accept_wait_ms": round(hists["accept_wait_ms"].mean(), 2),
+            "avg_queue_wait_ms": round(hists["queue_wait_ms"].mean(), 2),
+            "proxy_overhead_count": m["proxy_overhead_count"],
+            "avg_proxy_processing_ms": round(hists["proxy_processing_ms"].mean(), 2),
+            "avg_network_delay_ms": round(hists["network_delay_ms"].mean(), 2),
+            "connection_errors": m["connection_errors"],
+            "downstream_disconnects": m["downstream_disconnects"],
+            "retries": m["retries"],
+            "upstream_timeouts": m["upstream_timeouts"],
+            "streaming": STREAMING,
+            "bytes_relayed": m["bytes_relayed"],
+            "upstream_pool": upstream_pool.snapshot(),
+            "downstream": {
+                "keepalive": self.protocol_version == "HTTP/1.1",
+                "idle_timeout_s": self.timeout,
+                "max_keepalive": downstream.limit,
+                "connections_open": downstream.open,
+                "connections_total": m["downstream_connections"],
+                "requests": m["downstream_requests"],
+                "reused_requests": m["downstream_reused"],
+                # Share of proxied requests that arrived on an existing connection
+                "reuse_ratio": round(m["downstream_reused"] / m["downstream_requests"], 4)
+                               if m["downstream_requests"] else 0.0,
+                "keepalive_closes": m["keepalive_closes"],
+                "idle_timeouts": m["idle_timeouts"],
+            },
+            "hedging": self.hedging_stats(m),
+            "cache": {"enabled": True, **response_cache.snapshot()} if response_cache else {"enabled": False},
+            "admission": {
+                **admission.snapshot(),
+                "shed": {reason: m[f"shed_{reason}"] for reason in SHED_REASONS},
+            },
+        }
+        # Full latency distributions, e.g. "queue_wait_ms": {"p50": ..., "p99": ...}
+        for name, h in hists.items():
+            metrics_data[name] = h.summary()
         
+        body = json.dumps(metrics_data).encode()
         self.send_response(200)
         self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def hedging_stats(self, m):
+        """Hedge rate (hedges per hedgeable request) and win rate (hedges
+        that answered first)"""
+        if not hedger:
+            return {"enabled": False}
+        return {
+            "enabled": True,
+            "delay_ms": round(hedger.delay * 1000, 2),
+            "adaptive": not hedger.fixed,
+            "budget_tokens": round(hedger.budget.tokens, 2),
+            "requests": m["hedge_requests"],
+            "hedges": m["hedges_sent"],
+            "wins": m["hedge_wins"],
+            "hedge_rate": round(m["hedges_sent"] / m["hedge_requests"], 4) if m["hedge_requests"] else 0.0,
+            "win_rate": round(m["hedge_wins"] / m["hedges_sent"], 4) if m["hedges_sent"] else 0.0,
+        }
+    
+    def serve_prometheus_metrics(self):
+        """Serve proxy metrics in Prometheus text format"""
+        m, hists = proxy_metrics.snapshot()
+        pool = upstream_pool.snapshot()
+        
+        out = Exposition()
+        out.counter("proxy_requests", "Requests forwarded upstream", m["requests_total"])
+        out.gauge("proxy_requests_in_queue", "Requests inside the proxy's delay stage", m["requests_in_queue"])
+        out.gauge("proxy_pending_connections", "Accepted connections waiting for a pool worker",
+                  self.server.pending.qsize() if hasattr(self.server, "pending") else 0)
+        out.counter("proxy_overhead_events", "Requests that hit injected proxy overhead", m["proxy_overhead_count"])
+        out.counter("proxy_retries", "Injected network retries", m["retries"])
+        out.counter("proxy_connection_errors", "Upstream connection errors", m["connection_errors"])
+        out.counter("proxy_downstream_disconnects", "Clients that disconnected mid-response",
+                    m["downstream_disconnects"])
+        out.counter("proxy_upstream_timeouts", "Upstream timeouts", m["upstream_timeouts"])
+        out.counter("proxy_relayed_bytes", "Response body bytes relayed downstream", m["bytes_relayed"])
+        out.histogram_ms("proxy_queue_wait", "Time in the proxy's delay stage", hists["queue_wait_ms"])
+        out.histogram_ms("proxy_accept_wait", "Time an accepted connection waited for a worker",
+                         hists["accept_wait_ms"])
+        out.histogram_ms("proxy_delay", "Injected proxy processing delay", hists["proxy_processing_ms"])
+        out.histogram_ms("proxy_network_delay", "Injected network delay", hists["network_delay_ms"])
+        out.histogram_ms("proxy_upstream", "Upstream response time", hists["upstream_time_ms"])
+        out.histogram_ms("proxy_relay", "Time to relay the response body", hists["relay_ms"])
+        for stat in ("hits", "new_connections", "waits", "idle_evictions", "stale_retries"):
+            out.counter(f"proxy_upstream_pool_{stat}", f"Upstream pool {stat.replace('_', ' ')}", pool[stat])
+        out.gauge("proxy_upstream_pool_idle", "Idle upstream connections", pool["idle"])
+        out.counter("proxy_downstream_connections", "Client connections accepted", m["downstream_connections"])
+        out.gauge("proxy_downstream_connections_open", "Open client connections", downstream.open)
+        out.counter("proxy_downstream_requests", "Proxied client requests", m["downstream_requests"])
+        out.counter("proxy_downstream_reused_requests", "Proxied requests on an already open client connection",
+                    m["downstream_reused"])
+        out.counter("proxy_keepalive_closes", "Client connections closed by the keep-alive cap",
+                    m["keepalive_closes"])
+        out.counter("proxy_idle_timeouts", "Client connections closed after the idle timeout", m["idle_timeouts"])
+        for reason in SHED_REASONS:
+            out.counter(f"proxy_shed_{reason}", f"Requests shed with a 503 ({reason.replace('_', ' ')})",
+                        m[f"shed_{reason}"])
+        out.counter("proxy_hedge_requests", "Requests forwarded through the hedger", m["hedge_requests"])
+        out.counter("proxy_hedges", "Hedged (second) upstream attempts", m["hedges_sent"])
+        out.counter("proxy_hedge_wins", "Hedged attempts that answered first", m["hedge_wins"])
+        out.gauge("proxy_hedge_delay_seconds", "Current hedge delay", hedger.delay if hedger else 0)
+        if response_cache:
+            cache = response_cache.snapshot()
+            for outcome in ("hit", "miss", "coalesced"):
+                out.counter(f"proxy_cache_{outcome}", f"Cacheable requests by outcome ({outcome})", cache[outcome])
+            out.counter("proxy_cache_evictions", "Cache entries evicted by the entry or byte limit",
+                        cache["evictions"])
+            out.counter("proxy_cache_expirations", "Cache entries dropped after their TTL", cache["expirations"])
+            out.gauge("proxy_cache_entries", "Cached responses", cache["entries"])
+            out.gauge("proxy_cache_bytes", "Bytes held by cached responses", cache["bytes"])
+        out.gauge("proxy_admission_inflight", "Requests admitted to the upstream", admission.inflight)
+        out.gauge("proxy_admission_waiting", "Requests waiting for admission", admission.waiting)
+        out.histogram_ms("proxy_admission_wait", "Time waiting for admission to the upstream",
+                         hists["admission_wait_ms"])
+        body = out.render()
+        
+        self.send_response(200)
+        self.send_header("Content-Type", PROM_CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
         self.end_headers()
-        self.wfile.write(json.dumps(metrics_data).encode())
+        self.wfile.write(body)
     
     def reset_proxy_metrics(self):
         """Reset proxy metrics"""
-        global proxy_metrics
-        with proxy_lock:
-            proxy_metrics = {
-                "requests_total": 0,
-                "requests_in_queue": 0,
-                "queue_wait_times": deque(maxlen=1000),
-                "proxy_processing_times": deque(maxlen=1000),
-                "proxy_overhead_count": 0,
-                "network_delays": deque(maxlen=1000),
-                "connection_errors": 0,
-                "retries": 0,
-                "upstream_timeouts": 0,
-            }
+        proxy_metrics.reset()
+        upstream_pool.reset_stats()
+        if response_cache:
+            response_cache.reset_stats()
         
+        body = json.dumps({"status": "reset"}).encode()
         self.send_response(200)
         self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
         self.end_headers()
-        self.wfile.write(json.dumps({"status": "reset"}).encode())
+        self.wfile.write(body)
 
-def run(server_class=HTTPServer, handler_class=Handler, port=8080):
+def run(handler_class=Handler, port=8080, engine="single", workers=32, queue_size=128):
     server_address = ('', port)
-    httpd = server_class(server_address, handler_class)
-    print(f"Proxy listening on :{port}, forwarding to {UPSTREAM}")
+    if engine == "pool":
+        httpd = ThreadPoolHTTPServer(server_address, handler_class, workers=workers, queue_size=queue_size)
+        engine_desc = f"pool ({workers} workers, queue {queue_size})"
+    elif engine == "threaded":
+        httpd = ThreadPerConnectionHTTPServer(server_address, handler_class)
+        engine_desc = "thread per connection"
+    else:
+        httpd = HTTPServer(server_address, handler_class)
+        engine_desc = "single-threaded"
+        # One idle kept-alive client would block every other connection
+        handler_class.protocol_version, handler_class.timeout = "HTTP/1.0", None
+    print(f"Proxy listening on :{port}, forwarding to {UPSTREAM} [{engine_desc}]")
+    print(f"Response relay: {f'streaming ({CHUNK_SIZE} byte chunks)' if STREAMING else 'buffered'}")
+    print(f"Upstream pool: {upstream_pool.size} connections, "
+          f"keep-alive {'on' if upstream_pool.keepalive else 'off'}, idle timeout {upstream_pool.idle_timeout:g}s")
+    if handler_class.protocol_version == "HTTP/1.1":
+        print(f"Downstream keep-alive: up to {downstream.limit} connections, idle timeout {IDLE_TIMEOUT:g}s")
+    else:
+        print("Downstream keep-alive: off (one request per connection)")
+    if hedger:
+        delay = f"{hedger.delay * 1000:g} ms" if hedger.fixed else f"adaptive p{hedger.percentile:g} of first-attempt times"
+        print(f"Hedging: second attempt after {delay}, budget {hedger.budget.ratio:g} hedges/request")
+    elif os.environ.get("PROXY_HEDGE", "0") != "0":
+        print("Hedging: off (needs the buffered relay, PROXY_STREAMING=0)")
+    if response_cache:
+        print(f"Response cache: TTL {response_cache.ttl * 1000:g} ms, up to {response_cache.max_entries} entries "
+              f"/ {response_cache.max_bytes / (1024 * 1024):g} MB, concurrent misses coalesced")
+    elif os.environ.get("PROXY_CACHE", "0") != "0":
+        print("Response cache: off (needs the buffered relay, PROXY_STREAMING=0)")
+    if admission.limit:
+        print(f"Admission control: {admission.limit} upstream requests at once, up to {admission.queue_size} "
+              f"waiting for at most {admission.max_queue_time * 1000:g} ms")
     print(f"Proxy metrics available at http://127.0.0.1:{port}/proxy/metrics")
     httpd.serve_forever()
 
 if __name__ == "__main__":
     port = int(os.environ.get("PROXY_PORT", "8080"))
-    run(port=port)
+    if ENGINE not in ENGINES:
+        raise SystemExit(f"PROXY_ENGINE must be one of {', '.join(ENGINES)} (got {ENGINE!r})")
+    run(port=port, engine=ENGINE,
+        workers=int(os.environ.get("PROXY_WORKERS", "32")),
+        queue_size=int(os.environ.get("PROXY_QUEUE_SIZE", "128")))
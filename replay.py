@@ -0,0 +1,113 @@
+# replay.py
+import argparse, json, math, random
+from urllib.parse import urlencode
+
+# A workload trace is JSONL with one request per line, in offset order:
+#
+#   {"offset_ms": 0, "path": "/work", "mode": "app"}
+#   {"offset_ms": 12.5, "mode": "proxy", "params": {"payload_kb": 64}}
+#
+# Only offset_ms is required. path defaults to /work; mode and params are
+# added to the query string on top of the client's defaults. Offsets are
+# relative to the first record, so a trace cut from the middle of a day
+# starts replaying at once.
+
+DEFAULT_PATH = "/work"
+
+def read_trace(path, defaults=None, speed=1.0, limit=None, share=(0, 1)):
+    """Lazily yield (offset_seconds, path_and_query) for each trace record.
+
+    Lines are read and parsed one at a time, so a trace of any length is
+    replayed in constant memory. Offsets are divided by `speed`; `defaults`
+    are query parameters every record inherits unless it overrides them.
+    `share=(k, n)` yields only every n-th record starting at the k-th, for
+    splitting one trace across n processes; other records are not parsed.
+    """
+    defaults = dict(defaults or {})
+    index, shares = share
+    first = None
+    count = 0
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            if limit is not None and count >= limit:
+                return
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            count += 1
+            if (count - 1) % shares != index and first is not None:
+                continue
+            try:
+                record = json.loads(line)
+                offset = float(record["offset_ms"]) / 1000
+            except (ValueError, KeyError, TypeError) as e:
+                raise ValueError(f"{path}:{number}: bad trace record ({e!r})") from None
+            if first is None:
+                first = offset
+                if index:
+                    continue
+            query = dict(defaults)
+            if "mode" in record:
+                query["mode"] = record["mode"]
+            query.update(record.get("params") or {})
+            target = record.get("path", DEFAULT_PATH)
+            if query:
+                target += ("&" if "?" in target else "?") + urlencode(query)
+            yield (offset - first) / speed, target
+
+# -- trace synthesis ---------------------------------------------------------
+
+def arrival_rate(shape, t, rate, duration, burst_every, burst_seconds, burst_factor):
+    """Requests/sec at time t for each traffic shape"""
+    if shape == "burst":
+        return rate * burst_factor if t % burst_every < burst_seconds else rate
+    if shape == "diurnal":
+        # One compressed day over the trace: trough at the start and end, peak midway
+        return rate * (1 - math.cos(2 * math.pi * t / duration)) / 2
+    if shape == "ramp":
+        return rate * t / duration
+    return rate
+
+def synthesize(out, shape, duration, rate, modes, burst_every=10.0, burst_seconds=1.0,
+               burst_factor=5.0, seed=None):
+    """Write a Poisson trace whose rate follows `shape`, by thinning against
+    the peak rate. Lines are streamed out, so long traces use no memory."""
+    rng = random.Random(seed)
+    peak = rate * (burst_factor if shape == "burst" else 1)
+    t = 0.0
+    written = 0
+    with open(out, "w") as f:
+        while True:
+            t += rng.expovariate(peak)
+            if t >= duration:
+                break
+            if rng.random() * peak > arrival_rate(shape, t, rate, duration, burst_every,
+                                                  burst_seconds, burst_factor):
+                continue
+            f.write(json.dumps({"offset_ms": round(t * 1000, 3), "mode": rng.choice(modes)}) + "\n")
+            written += 1
+    return written
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a synthetic workload trace for client.py --replay")
+    parser.add_argument("out", help="trace file to write (JSONL)")
+    parser.add_argument("--shape", choices=["steady", "burst", "diurnal", "ramp"], default="steady")
+    parser.add_argument("--duration", type=float, default=60, help="seconds of traffic (default: 60)")
+    parser.add_argument("--rate", type=float, default=100,
+                        help="requests/sec: the base rate, or the peak for diurnal/ramp (default: 100)")
+    parser.add_argument("--modes", default="app,proxy,network",
+                        help="comma-separated modes, picked uniformly per request (default: app,proxy,network)")
+    parser.add_argument("--burst-every", type=float, default=10, help="seconds between bursts (default: 10)")
+    parser.add_argument("--burst-seconds", type=float, default=1, help="length of each burst (default: 1)")
+    parser.add_argument("--burst-factor", type=float, default=5, help="rate multiplier in a burst (default: 5)")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+    if args.rate <= 0 or args.duration <= 0:
+        parser.error("--rate and --duration must be positive")
+
+    written = synthesize(args.out, args.shape, args.duration, args.rate, args.modes.split(","),
+                         args.burst_every, args.burst_seconds, args.burst_factor, args.seed)
+    print(f"Wrote {written} requests ({args.shape}, {args.duration:g}s) to {args.out}")
+
+if __name__ == "__main__":
+    main()
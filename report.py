@@ -0,0 +1,752 @@
+# report.py
+import argparse, os
+import numpy as np
+import matplotlib.pyplot as plt
+from diagnosis import diagnose, diagnosis_path, print_summary, save
+from histogram import LogHistogram
+from rolling import rolling_percentiles, rolling_std
+from runstore import open_run
+from tracing import COMPONENTS
+
+# Time series are reduced to this many points whatever the run length or
+# dpi: about one per pixel of the panels' width at the default 100 dpi
+SERIES_POINTS = 1500
+# Above this many scrape samples, event counts are drawn as a filled step
+# curve instead of one bar patch each
+MAX_BARS = 500
+
+def histogram_of(values):
+    """LogHistogram of the finite values in a column"""
+    values = np.asarray(values, dtype=float)
+    return LogHistogram().record_array(values[np.isfinite(values)])
+
+def use_headless():
+    """Render with Agg: no GUI windows, figures are only written to disk"""
+    plt.switch_backend("Agg")
+
+def minmax_decimate(x, y, points):
+    """Reduce a series to the min and max of each of `points` // 2 equal-count
+    buckets, in time order, so spikes and dips survive at plot resolution"""
+    x, y = np.asarray(x), np.asarray(y, dtype=float)
+    n = len(y)
+    if n <= points:
+        return x, y
+    step = -(-2 * n // points)
+    buckets = -(-n // step)
+    padded = np.pad(y, (0, buckets * step - n), mode="edge").reshape(buckets, step)
+    starts = np.arange(buckets) * step
+    lo = np.minimum(starts + padded.argmin(axis=1), n - 1)
+    hi = np.minimum(starts + padded.argmax(axis=1), n - 1)
+    idx = np.column_stack((np.minimum(lo, hi), np.maximum(lo, hi))).ravel()
+    return x[idx], y[idx]
+
+def cdf_points(sorted_values, points=1000):
+    """(values, percentiles) at evenly spaced quantiles plus a log-spaced tail,
+    so the curve stays exact in the tail without plotting every sample"""
+    n = len(sorted_values)
+    q = np.linspace(0, 1, points)
+    if n > 10:
+        q = np.union1d(q, 1 - np.logspace(-1, -np.log10(n), points))
+    idx = np.minimum((q * n).astype(np.int64), n - 1)
+    return sorted_values[idx], (idx + 1) / n * 100
+
+def increments(counter):
+    """Per-sample increase of a cumulative counter (0 for the first sample)"""
+    counter = np.asarray(counter, dtype=float)
+    return np.diff(counter, prepend=counter[:1])
+
+def mark_events(axes, times, counts, color, alpha, pixels):
+    """Shade every pixel column that holds new events, full height on every
+    axis. Each axis gets one step-filled PolyCollection instead of an axvline
+    per event, so the cost is bounded by the figure width, not the run length."""
+    times = np.asarray(times, dtype=float)
+    if not len(times) or times[-1] <= 0:
+        return
+    edges = np.linspace(0, times[-1], pixels + 1)
+    hit = np.histogram(times[np.asarray(counts) > 0], bins=edges)[0] > 0
+    if not hit.any():
+        return
+    for ax in axes:
+        ax.fill_between(edges, 0, np.append(hit, False), step='post', transform=ax.get_xaxis_transform(),
+                        color=color, alpha=alpha, linewidth=0)
+
+class RunAnalysis:
+    """Percentiles, rolling windows, span attribution and the diagnostic
+    figure for one stored run. Columns stay memory-mapped; every statistic
+    is computed with vectorised NumPy."""
+    
+    def __init__(self, run, window=50, window_seconds=None):
+        self.run = run
+        self.meta = run.meta
+        self.args = run.meta.get("args", {})
+        self.mode = self.args.get("mode", "mixed")
+        self.scrape_interval = self.args.get("scrape_interval", 0.1)
+        self.window = window
+        self.window_seconds = window_seconds
+        
+        self.requests = run.table("requests")
+        self.answered = self.requests["status"] != 0
+        self.errors = int(np.count_nonzero(~self.answered))
+        # Rows are stored as requests finish, which concurrent requests leave
+        # out of completion-time order; every per-request series below is
+        # indexed in time order
+        answered = np.flatnonzero(self.answered)
+        self.order = answered[np.argsort(self.requests["completed"][answered], kind="stable")]
+        self.shed = self.requests["status"][self.order] == 503  # turned away by proxy admission control
+        self.latencies = self.requests["latency_ms"][self.order]
+        self.latency_timestamps = self.requests["completed"][self.order]  # Time since test started
+        self.network_delays = self.requests["network_ms"][self.order]
+        self.app_metrics_timeline = run.table("app_timeline")
+        self.proxy_metrics_timeline = run.table("proxy_timeline")
+        self.elapsed = self.meta.get("elapsed") or float(self.latency_timestamps.max(initial=0.0))
+        
+        # Summary percentiles come from log-bucketed histograms, like the servers'
+        self.latency_hist = histogram_of(self.latencies)
+        self.ttfb_hist = histogram_of(self.requests["ttfb_ms"][self.order])
+        self.upstream_hist = histogram_of(self.requests["upstream_ms"][self.order])
+        # Proxy and network delays only count for responses that came through the proxy
+        proxied = self.answered & np.isfinite(self.requests["queue_wait_ms"])
+        self.proxy_hist = histogram_of(self.requests["proxy_ms"][proxied])
+        self.network_hist = histogram_of(self.requests["network_ms"][proxied])
+    
+    def plot_layers(self, dpi=100, fmt="png", show=True):
+        """Layer comparison bars plus the time-aligned diagnostic panels,
+        saved as layer_analysis_<mode>.<fmt>"""
+        mode, scrape_interval = self.mode, self.scrape_interval
+        latencies, latency_timestamps, network_delays = self.latencies, self.latency_timestamps, self.network_delays
+        upstream_hist, proxy_hist, network_hist = self.upstream_hist, self.proxy_hist, self.network_hist
+        # Every series is evaluated or aggregated down to a fixed width
+        pixels = SERIES_POINTS
+        step = max(1, len(latencies) // pixels)
+        app_metrics_timeline, proxy_metrics_timeline = self.app_metrics_timeline, self.proxy_metrics_timeline
+        
+        def plot_series(ax, times, values, color, linewidth, alpha, marker=None, markersize=None,
+                        line_alpha=None, base=0):
+            """Line with the area under it filled, min/max-decimated to the pixel width"""
+            times, values = minmax_decimate(times, values, pixels)
+            ax.plot(times, values, color=color, linewidth=linewidth, marker=marker, markersize=markersize,
+                    alpha=line_alpha)
+            ax.fill_between(times, base, values, alpha=alpha, color=color)
+        
+        def plot_event_counts(ax, timeline, counter, color, edgecolor, alpha, linewidth):
+            """Bars of new events per scrape from a cumulative counter; long runs
+            get a filled step curve of the per-pixel maxima instead. Returns the
+            (timestamps, increments) for mark_events."""
+            times, counts = timeline['timestamps'], increments(timeline[counter])
+            if len(times) <= MAX_BARS:
+                ax.bar(times, counts, width=scrape_interval, color=color, alpha=alpha,
+                       edgecolor=edgecolor, linewidth=linewidth)
+            else:
+                peak_times, peaks = minmax_decimate(times, counts, pixels)
+                ax.fill_between(peak_times, 0, peaks, step='mid', color=color, alpha=alpha,
+                                edgecolor=edgecolor, linewidth=linewidth)
+            return times, counts
+        
+        # Use actual measurements from headers, or use minimal values if not available
+        # APPLICATION LAYER: upstream processing time from app server
+        # PROXY LAYER: proxy processing time (overhead)
+        # NETWORK LAYER: network delays
+        def layer_percentiles(hist, fallback):
+            return hist.percentiles([50, 99]) if hist.count else [fallback, fallback]
+        
+        # Create comprehensive visualization: layer comparison + time series
+        # For mixed mode, use larger figure to show all metrics
+        if mode == "mixed":
+            fig = plt.figure(figsize=(18, 18))
+            gs_top = fig.add_gridspec(1, 3, hspace=0.3, wspace=0.3, 
+                                      top=0.95, bottom=0.60, left=0.08, right=0.98)
+        else:
+            fig = plt.figure(figsize=(18, 14))
+            gs_top = fig.add_gridspec(1, 3, hspace=0.3, wspace=0.3, 
+                                      top=0.95, bottom=0.50, left=0.08, right=0.98)
+        
+        # Top section: Layer comparison (3 bar charts)
+        axes = [fig.add_subplot(gs_top[0, i]) for i in range(3)]
+        
+        layers = [
+            ('APPLICATION LAYER', layer_percentiles(upstream_hist, 2.0), '#FF6B6B'),
+            ('PROXY LAYER', layer_percentiles(proxy_hist, 0.0), '#4ECDC4'),
+            ('NETWORK LAYER', layer_percentiles(network_hist, 0.0), '#95E1D3')
+        ]
+        
+        for idx, (layer_name, (p50_layer, p99_layer), color) in enumerate(layers):
+            ax = axes[idx]
+            
+            # Bar chart for p50 and p99
+            x_pos = [0, 1]
+            bar1 = ax.bar(x_pos[0], p50_layer, color=color, alpha=0.6, edgecolor='black', linewidth=2)
+            bar2 = ax.bar(x_pos[1], p99_layer, color=color, alpha=1.0, edgecolor='black', linewidth=2)
+            
+            ax.set_xticks(x_pos)
+            ax.set_xticklabels(['p50', 'p99'])
+            
+            # Add value labels on bars
+            ax.text(x_pos[0], p50_layer, f'{p50_layer:.2f}ms',
+                   ha='center', va='bottom', fontweight='bold', fontsize=11)
+            ax.text(x_pos[1], p99_layer, f'{p99_layer:.2f}ms',
+                   ha='center', va='bottom', fontweight='bold', fontsize=11)
+            
+            ax.set_ylabel('Latency (ms)', fontsize=11, fontweight='bold')
+            ax.set_title(layer_name, fontsize=12, fontweight='bold')
+            ax.grid(True, alpha=0.3, axis='y')
+            ax.set_ylim(bottom=0)
+            
+            # Highlight if p99 is significantly higher
+            if p99_layer > p50_layer * 2:
+                ax.set_facecolor('#fff5f5')
+                ax.text(0.5, 0.95, 'HIGH p99', transform=ax.transAxes,
+                       ha='center', va='top', fontsize=10, color='red', fontweight='bold',
+                       bbox=dict(boxstyle='round', facecolor='yellow', alpha=0.3))
+        
+        # Bottom section: Time-series graphs with SHARED X-AXIS for perfect correlation
+        if mode == "mixed":
+            # For mixed mode, show MORE metrics (9 total: 1 latency + 8 layer metrics)
+            gs_bottom = fig.add_gridspec(9, 1, hspace=0.05, 
+                                          top=0.57, bottom=0.03, left=0.10, right=0.95)
+        else:
+            gs_bottom = fig.add_gridspec(5, 1, hspace=0.05, 
+                                          top=0.45, bottom=0.05, left=0.10, right=0.95)
+        
+        # Calculate rolling percentiles (count- or time-based window)
+        timestamps_arr = np.asarray(latency_timestamps)
+        idx, rolling = rolling_percentiles(latencies, (50, 99), window=self.window, times=timestamps_arr,
+                                           window_seconds=self.window_seconds, step=step)
+        times = timestamps_arr[idx]
+        p50_over_time = rolling[50]
+        p99_over_time = rolling[99]
+        
+        def network_variance_series():
+            """Rolling std of network delay (20-request window, or the time window)"""
+            idx, std = rolling_std(network_delays, window=20, times=timestamps_arr,
+                                   window_seconds=self.window_seconds, step=step)
+            return timestamps_arr[idx], std
+        
+        # Create subplots sharing the same x-axis
+        if mode == "mixed":
+            # 9 subplots for mixed mode (all layers)
+            ax1 = fig.add_subplot(gs_bottom[0])  # Latency
+            ax2 = fig.add_subplot(gs_bottom[1], sharex=ax1)  # App: Lock Contention
+            ax3 = fig.add_subplot(gs_bottom[2], sharex=ax1)  # App: CPU
+            ax4 = fig.add_subplot(gs_bottom[3], sharex=ax1)  # App: Blocked Requests
+            ax5 = fig.add_subplot(gs_bottom[4], sharex=ax1)  # Proxy: Overhead
+            ax6 = fig.add_subplot(gs_bottom[5], sharex=ax1)  # Proxy: Queue Depth
+            ax7 = fig.add_subplot(gs_bottom[6], sharex=ax1)  # Network: Retries
+            ax8 = fig.add_subplot(gs_bottom[7], sharex=ax1)  # Network: Variance
+            ax9 = fig.add_subplot(gs_bottom[8], sharex=ax1)  # Network: Delay
+        else:
+            # 5 subplots for single-layer modes
+            ax1 = fig.add_subplot(gs_bottom[0])  # Latency
+            ax2 = fig.add_subplot(gs_bottom[1], sharex=ax1)
+            ax3 = fig.add_subplot(gs_bottom[2], sharex=ax1)
+            ax4 = fig.add_subplot(gs_bottom[3], sharex=ax1)
+            ax5 = fig.add_subplot(gs_bottom[4], sharex=ax1)
+        
+        # Get max time for consistent x-axis
+        max_time = times.max() if len(times) else 1
+        
+        # 1. Latency over time (p50 vs p99)
+        ax1.plot(times, p50_over_time, color='#4CAF50', linewidth=2.5, label='p50 (stable)', alpha=0.8)
+        ax1.plot(times, p99_over_time, color='#F44336', linewidth=2.5, label='p99 (spikes)', alpha=0.8)
+        ax1.fill_between(times, p50_over_time, p99_over_time, alpha=0.15, color='red')
+        
+        ax1.set_ylabel('Latency\n(ms)', fontsize=10, fontweight='bold', rotation=0, ha='right', va='center')
+        
+        # Dynamic title based on mode
+        if mode == "app":
+            layer_title = "APPLICATION LAYER"
+        elif mode == "proxy":
+            layer_title = "PROXY LAYER"
+        else:
+            layer_title = "NETWORK LAYER"
+        
+        ax1.set_title(f'{layer_title}: Time-Aligned Diagnostic Metrics', fontsize=12, fontweight='bold', pad=10)
+        ax1.legend(loc='upper right', fontsize=9, ncol=2)
+        ax1.grid(True, alpha=0.3, axis='y')
+        ax1.set_xlim(0, max_time)
+        plt.setp(ax1.get_xticklabels(), visible=False)
+        
+        # Choose which metrics to display based on mode
+        if mode == "mixed":
+            # MIXED MODE: Show ALL metrics from ALL layers for diagnosis
+            ax1.set_title('REALISTIC SCENARIO: Diagnose Which Layer is Causing p99 Spikes', 
+                         fontsize=12, fontweight='bold', pad=10)
+            
+            # APPLICATION METRICS
+            # 2. Lock Contention
+            if len(app_metrics_timeline['timestamps']) > 0:
+                events = plot_event_counts(ax2, app_metrics_timeline, 'lock_contention_count',
+                                           color='#FF6B6B', edgecolor='darkred', alpha=0.7, linewidth=1)
+                mark_events([ax1, ax2, ax3, ax4, ax5, ax6, ax7, ax8, ax9], *events,
+                            color='red', alpha=0.08, pixels=pixels)
+            ax2.set_ylabel('[APP]\nLock Events', fontsize=9, fontweight='bold', rotation=0, ha='right', va='center')
+            ax2.grid(True, alpha=0.3, axis='y')
+            ax2.set_xlim(0, max_time)
+            plt.setp(ax2.get_xticklabels(), visible=False)
+            
+            # 3. CPU
+            if len(app_metrics_timeline['timestamps']) > 0:
+                plot_series(ax3, app_metrics_timeline['timestamps'], app_metrics_timeline['cpu_usage'],
+                            color='#FF9800', linewidth=2, alpha=0.2, marker='o', markersize=2)
+            ax3.set_ylabel('[APP]\nCPU %', fontsize=9, fontweight='bold', rotation=0, ha='right', va='center')
+            ax3.grid(True, alpha=0.3, axis='y')
+            ax3.set_xlim(0, max_time)
+            plt.setp(ax3.get_xticklabels(), visible=False)
+            
+            # 4. Blocked Requests
+            if len(app_metrics_timeline['timestamps']) > 0:
+                plot_series(ax4, app_metrics_timeline['timestamps'], app_metrics_timeline['requests_waiting'],
+                            color='#9C27B0', linewidth=2, alpha=0.2, marker='^', markersize=2)
+            ax4.set_ylabel('[APP]\nBlocked', fontsize=9, fontweight='bold', rotation=0, ha='right', va='center')
+            ax4.grid(True, alpha=0.3, axis='y')
+            ax4.set_xlim(0, max_time)
+            plt.setp(ax4.get_xticklabels(), visible=False)
+            
+            # PROXY METRICS
+            # 5. Proxy Overhead
+            if len(proxy_metrics_timeline['timestamps']) > 0:
+                events = plot_event_counts(ax5, proxy_metrics_timeline, 'proxy_overhead_count',
+                                           color='#4ECDC4', edgecolor='#008B8B', alpha=0.7, linewidth=1)
+                mark_events([ax1, ax2, ax3, ax4, ax5, ax6, ax7, ax8, ax9], *events,
+                            color='cyan', alpha=0.08, pixels=pixels)
+            ax5.set_ylabel('[PROXY]\nOverhead', fontsize=9, fontweight='bold', rotation=0, ha='right', va='center')
+            ax5.grid(True, alpha=0.3, axis='y')
+            ax5.set_xlim(0, max_time)
+            plt.setp(ax5.get_xticklabels(), visible=False)
+            
+            # 6. Queue Depth
+            if len(proxy_metrics_timeline['timestamps']) > 0:
+                plot_series(ax6, proxy_metrics_timeline['timestamps'], proxy_metrics_timeline['requests_in_queue'],
+                            color='#FF9800', linewidth=2, alpha=0.2, marker='o', markersize=2)
+            ax6.set_ylabel('[PROXY]\nQueue', fontsize=9, fontweight='bold', rotation=0, ha='right', va='center')
+            ax6.grid(True, alpha=0.3, axis='y')
+            ax6.set_xlim(0, max_time)
+            plt.setp(ax6.get_xticklabels(), visible=False)
+            
+            # NETWORK METRICS
+            # 7. Network Retries
+            if len(proxy_metrics_timeline['timestamps']) > 0:
+                events = plot_event_counts(ax7, proxy_metrics_timeline, 'retries',
+                                           color='#95E1D3', edgecolor='#00A896', alpha=0.7, linewidth=1)
+                mark_events([ax1, ax2, ax3, ax4, ax5, ax6, ax7, ax8, ax9], *events,
+                            color='green', alpha=0.08, pixels=pixels)
+            ax7.set_ylabel('[NET]\nRetries', fontsize=9, fontweight='bold', rotation=0, ha='right', va='center')
+            ax7.grid(True, alpha=0.3, axis='y')
+            ax7.set_xlim(0, max_time)
+            plt.setp(ax7.get_xticklabels(), visible=False)
+            
+            # 8. Network Variance
+            if network_hist.count:
+                plot_series(ax8, *network_variance_series(), color='#FF5722', linewidth=2, alpha=0.2,
+                            marker='o', markersize=2)
+            ax8.set_ylabel('[NET]\nVariance', fontsize=9, fontweight='bold', rotation=0, ha='right', va='center')
+            ax8.grid(True, alpha=0.3, axis='y')
+            ax8.set_xlim(0, max_time)
+            plt.setp(ax8.get_xticklabels(), visible=False)
+            
+            # 9. Network Delay
+            if network_hist.count:
+                plot_series(ax9, latency_timestamps, network_delays, color='#673AB7', linewidth=1, alpha=0.15,
+                            line_alpha=0.5)
+            ax9.set_ylabel('[NET]\nDelay (ms)', fontsize=9, fontweight='bold', rotation=0, ha='right', va='center')
+            ax9.set_xlabel('Time (seconds)', fontsize=11, fontweight='bold')
+            ax9.grid(True, alpha=0.3, axis='y')
+            ax9.set_xlim(0, max_time)
+        
+        elif mode == "proxy":
+            # PROXY MODE: Show proxy-specific metrics
+            if len(proxy_metrics_timeline['timestamps']) > 0:
+                # 2. Proxy Overhead Events
+                events = plot_event_counts(ax2, proxy_metrics_timeline, 'proxy_overhead_count',
+                                           color='#4ECDC4', edgecolor='#008B8B', alpha=0.8, linewidth=1.5)
+                
+                # Add vertical lines to show correlation
+                mark_events([ax1, ax2, ax3, ax4, ax5], *events, color='cyan', alpha=0.15, pixels=pixels)
+            
+            ax2.set_ylabel('Proxy\nOverhead', fontsize=10, fontweight='bold', rotation=0, ha='right', va='center')
+            ax2.grid(True, alpha=0.3, axis='y')
+            ax2.set_xlim(0, max_time)
+            plt.setp(ax2.get_xticklabels(), visible=False)
+            
+            # 3. Queue Depth (Requests Waiting in Proxy)
+            if len(proxy_metrics_timeline['timestamps']) > 0:
+                plot_series(ax3, proxy_metrics_timeline['timestamps'], proxy_metrics_timeline['requests_in_queue'],
+                            color='#FF9800', linewidth=2.5, alpha=0.3, marker='o', markersize=3)
+            
+            ax3.set_ylabel('Queue\nDepth', fontsize=10, fontweight='bold', rotation=0, ha='right', va='center')
+            ax3.grid(True, alpha=0.3, axis='y')
+            ax3.set_xlim(0, max_time)
+            plt.setp(ax3.get_xticklabels(), visible=False)
+            
+            # 4. Average Queue Wait Time
+            if len(proxy_metrics_timeline['timestamps']) > 0:
+                plot_series(ax4, proxy_metrics_timeline['timestamps'], proxy_metrics_timeline['avg_queue_wait'],
+                            color='#2196F3', linewidth=2.5, alpha=0.3, marker='s', markersize=3)
+            
+            ax4.set_ylabel('Avg Queue\nWait (ms)', fontsize=10, fontweight='bold', rotation=0, ha='right', va='center')
+            ax4.grid(True, alpha=0.3, axis='y')
+            ax4.set_xlim(0, max_time)
+            plt.setp(ax4.get_xticklabels(), visible=False)
+            
+            # 5. Connection Errors
+            if len(proxy_metrics_timeline['timestamps']) > 0:
+                plot_series(ax5, proxy_metrics_timeline['timestamps'], proxy_metrics_timeline['connection_errors'],
+                            color='#9C27B0', linewidth=2.5, alpha=0.3, marker='^', markersize=3)
+            
+            ax5.set_ylabel('Connection\nErrors', fontsize=10, fontweight='bold', rotation=0, ha='right', va='center')
+            ax5.set_xlabel('Time (seconds)', fontsize=11, fontweight='bold')
+            ax5.grid(True, alpha=0.3, axis='y')
+            ax5.set_xlim(0, max_time)
+        
+        elif mode == "network":
+            # NETWORK MODE: Show network-specific metrics
+            if len(proxy_metrics_timeline['timestamps']) > 0:
+                # 2. Network Retries/Retransmissions (new retries since last poll)
+                events = plot_event_counts(ax2, proxy_metrics_timeline, 'retries',
+                                           color='#95E1D3', edgecolor='#00A896', alpha=0.8, linewidth=1.5)
+                
+                # Add vertical lines to show correlation
+                mark_events([ax1, ax2, ax3, ax4, ax5], *events, color='green', alpha=0.15, pixels=pixels)
+            
+            ax2.set_ylabel('Network\nRetries', fontsize=10, fontweight='bold', rotation=0, ha='right', va='center')
+            ax2.grid(True, alpha=0.3, axis='y')
+            ax2.set_xlim(0, max_time)
+            plt.setp(ax2.get_xticklabels(), visible=False)
+            
+            # 3. Network Delay Variance (using rolling window)
+            if network_hist.count:
+                # Calculate rolling variance
+                plot_series(ax3, *network_variance_series(), color='#FF9800', linewidth=2.5, alpha=0.3,
+                            marker='o', markersize=3)
+            
+            ax3.set_ylabel('Network\nVariance', fontsize=10, fontweight='bold', rotation=0, ha='right', va='center')
+            ax3.grid(True, alpha=0.3, axis='y')
+            ax3.set_xlim(0, max_time)
+            plt.setp(ax3.get_xticklabels(), visible=False)
+            
+            # 4. Connection Errors Over Time
+            if len(proxy_metrics_timeline['timestamps']) > 0:
+                plot_series(ax4, proxy_metrics_timeline['timestamps'], proxy_metrics_timeline['connection_errors'],
+                            color='#E53935', linewidth=2.5, alpha=0.3, marker='s', markersize=3)
+            
+            ax4.set_ylabel('Connection\nErrors', fontsize=10, fontweight='bold', rotation=0, ha='right', va='center')
+            ax4.grid(True, alpha=0.3, axis='y')
+            ax4.set_xlim(0, max_time)
+            plt.setp(ax4.get_xticklabels(), visible=False)
+            
+            # 5. Network Delay (instantaneous)
+            if network_hist.count:
+                plot_series(ax5, latency_timestamps, network_delays, color='#9C27B0', linewidth=1.5, alpha=0.2,
+                            line_alpha=0.6)
+            
+            ax5.set_ylabel('Network\nDelay (ms)', fontsize=10, fontweight='bold', rotation=0, ha='right', va='center')
+            ax5.set_xlabel('Time (seconds)', fontsize=11, fontweight='bold')
+            ax5.grid(True, alpha=0.3, axis='y')
+            ax5.set_xlim(0, max_time)
+        
+        else:
+            # APP MODE: Show application-specific metrics
+            # 2. Lock Contention Events over time
+            if len(app_metrics_timeline['timestamps']) > 0:
+                # New lock contention events since last poll
+                events = plot_event_counts(ax2, app_metrics_timeline, 'lock_contention_count',
+                                           color='#FF6B6B', edgecolor='darkred', alpha=0.8, linewidth=1.5)
+                
+                # Add vertical lines to show correlation
+                mark_events([ax1, ax2, ax3, ax4, ax5], *events, color='red', alpha=0.1, pixels=pixels)
+            
+            ax2.set_ylabel('Lock\nEvents', fontsize=10, fontweight='bold', rotation=0, ha='right', va='center')
+            ax2.grid(True, alpha=0.3, axis='y')
+            ax2.set_xlim(0, max_time)
+            plt.setp(ax2.get_xticklabels(), visible=False)
+            
+            # 3. CPU Usage over time
+            if len(app_metrics_timeline['timestamps']) > 0:
+                plot_series(ax3, app_metrics_timeline['timestamps'], app_metrics_timeline['cpu_usage'],
+                            color='#FF9800', linewidth=2.5, alpha=0.3, marker='o', markersize=3)
+            
+            ax3.set_ylabel('CPU\n(%)', fontsize=10, fontweight='bold', rotation=0, ha='right', va='center')
+            ax3.grid(True, alpha=0.3, axis='y')
+            ax3.set_xlim(0, max_time)
+            plt.setp(ax3.get_xticklabels(), visible=False)
+            
+            # 4. Active Threads over time
+            if len(app_metrics_timeline['timestamps']) > 0:
+                plot_series(ax4, app_metrics_timeline['timestamps'], app_metrics_timeline['active_threads'],
+                            color='#2196F3', linewidth=2.5, alpha=0.3, marker='s', markersize=3,
+                            base=app_metrics_timeline['active_threads'].min() - 0.5)
+            
+            ax4.set_ylabel('Active\nThreads', fontsize=10, fontweight='bold', rotation=0, ha='right', va='center')
+            ax4.grid(True, alpha=0.3, axis='y')
+            ax4.set_xlim(0, max_time)
+            plt.setp(ax4.get_xticklabels(), visible=False)
+            
+            # 5. Requests Waiting (Blocked) over time
+            if len(app_metrics_timeline['timestamps']) > 0:
+                plot_series(ax5, app_metrics_timeline['timestamps'], app_metrics_timeline['requests_waiting'],
+                            color='#9C27B0', linewidth=2.5, alpha=0.3, marker='^', markersize=3)
+            
+            ax5.set_ylabel('Blocked\nRequests', fontsize=10, fontweight='bold', rotation=0, ha='right', va='center')
+            ax5.set_xlabel('Time (seconds)', fontsize=11, fontweight='bold')
+            ax5.grid(True, alpha=0.3, axis='y')
+            ax5.set_xlim(0, max_time)
+        
+        # Dynamic title based on mode
+        if mode == "app":
+            title = 'Tail Latency Diagnosis - Application Contention Metrics'
+        elif mode == "proxy":
+            title = 'Tail Latency Diagnosis - Proxy Overhead Metrics'
+        else:
+            title = 'Tail Latency Diagnosis - Network Variability Metrics'
+        
+        plt.suptitle(f'{title} (Mode: {mode.upper()})',
+                    fontsize=15, fontweight='bold', y=0.99)
+        
+        # Save the figure (margins are fixed by the gridspecs, so no
+        # bbox_inches='tight': it would draw the whole figure an extra time)
+        filename = f'layer_analysis_{mode}.{fmt}'
+        fig.savefig(filename, dpi=dpi)
+        print(f"\n[GRAPH] Saved as: {filename}")
+        
+        if show:
+            plt.show(block=False)
+            plt.pause(0.1)
+        else:
+            plt.close(fig)
+    
+    def print_trace_breakdown(self, p99, slowest=5):
+        """Where the time went for the slowest requests, from their joined spans"""
+        req = self.requests
+        tail = np.flatnonzero(self.answered & (req["latency_ms"] >= p99))
+        if not len(tail):
+            return
+        tail = tail[np.argsort(req["latency_ms"][tail])[::-1]]
+        columns = [req["latency_ms"][tail]] + [req[f"{c}_ms"][tail] for c in COMPONENTS]
+        short = {"client_queue": "client_q", "proxy_queue": "proxy_q"}
+        header = "".join(f"{short.get(c, c):>10}" for c in COMPONENTS)
+        print(f"\nTail breakdown (mean ms over {len(tail)} requests >= p99):")
+        print(f"  {'':18}{'total':>10}{header}")
+        print(f"  {'mean':18}" + "".join(f"{col.mean():>10.1f}" for col in columns))
+        print(f"Slowest {min(slowest, len(tail))} requests by trace:")
+        for row, i in enumerate(tail[:slowest]):
+            trace_id = f"{int(req['trace_id'][i]):016x}"
+            print(f"  {trace_id:18}" + "".join(f"{col[row]:>10.1f}" for col in columns))
+    
+    def print_latency_results(self):
+        mode, latencies, elapsed, errors = self.mode, self.latencies, self.elapsed, self.errors
+        latency_hist, ttfb_hist = self.latency_hist, self.ttfb_hist
+        payload_kb = self.args.get("payload_kb")
+        
+        print("\n" + "=" * 60)
+        print("LATENCY RESULTS")
+        print("=" * 60)
+        
+        if len(latencies):
+            p50, p95, p99, p99_9 = latency_hist.percentiles([50, 95, 99, 99.9])
+            max_lat = latency_hist.max
+            
+            print(f"Mode: {mode}")
+            print(f"Requests: {len(self.answered)}  |  Errors: {errors}")
+            shed = int(np.count_nonzero(self.shed))
+            print(f"Throughput: {len(latencies) / elapsed:.1f} req/s over {elapsed:.2f}s")
+            print(f"\nPercentiles:")
+            print(f"  p50:   {p50:.2f} ms")
+            print(f"  p95:   {p95:.2f} ms")
+            print(f"  p99:   {p99:.2f} ms  [TAIL LATENCY]")
+            print(f"  p99.9: {p99_9:.2f} ms")
+            print(f"  max:   {max_lat:.2f} ms")
+            if shed:
+                served = histogram_of(latencies[~self.shed])
+                served_p50, served_p99 = served.percentiles([50, 99])
+                print(f"\nShed by the proxy (503): {shed} ({shed / len(latencies) * 100:.1f}%)")
+                print(f"  served p50: {served_p50:.2f} ms   served p99: {served_p99:.2f} ms")
+            if payload_kb:
+                ttfb_p50, ttfb_p99 = ttfb_hist.percentiles([50, 99])
+                print(f"\nTime to first byte ({payload_kb:g} KB payload):")
+                print(f"  p50:   {ttfb_p50:.2f} ms")
+                print(f"  p99:   {ttfb_p99:.2f} ms")
+            
+            # Calculate the delta between p99 and p50 (key metric!)
+            self.print_trace_breakdown(p99)
+            
+            p99_inflation = ((p99 - p50) / p50) * 100
+            print(f"\nP99 Inflation: {p99_inflation:.1f}% above p50")
+        else:
+            print("No successful requests.")
+    
+    def print_layer_analysis(self):
+        """Final app/proxy metrics recorded with the run, network delay
+        percentiles from the proxy headers, and the root-cause diagnosis
+        (also written to diagnosis.json in the run directory)"""
+        network_hist = self.network_hist
+        final = self.meta.get("final_metrics", {})
+        app_metrics = final.get("app") or {}
+        proxy_metrics = final.get("proxy") or {}
+        
+        print("\n" + "=" * 60)
+        print("LAYER-SPECIFIC ANALYSIS")
+        print("=" * 60)
+        
+        # Application metrics
+        print("\n[APPLICATION LAYER METRICS]")
+        try:
+            print(f"  Total requests processed: {app_metrics['requests_total']}")
+            print(f"  Lock contention events: {app_metrics['lock_contention_count']}")
+            print(f"  Contention rate: {app_metrics['contention_rate']}%")
+            print(f"  Avg processing time: {app_metrics['avg_processing_time_ms']:.2f} ms")
+            
+            wait_time = app_metrics['avg_wait_time_ms']
+            if app_metrics['lock_contention_count'] > 0:
+                if wait_time > 10:  # Only mark as HIGH if wait time is significant
+                    print(f"  Avg wait time (contended): {wait_time:.2f} ms  [HIGH]")
+                else:
+                    print(f"  Avg wait time (contended): {wait_time:.2f} ms")
+            else:
+                print(f"  Avg wait time (contended): {wait_time:.2f} ms")
+                
+            print(f"  CPU usage: {app_metrics['cpu_percent']:.1f}%")
+            print(f"  Active threads: {app_metrics['active_threads']}")
+        except KeyError:
+            print("  [ERROR] No app metrics recorded with this run")
+        
+        # Proxy metrics
+        print("\n[PROXY LAYER METRICS]")
+        try:
+            print(f"  Total requests: {proxy_metrics['requests_total']}")
+            print(f"  Requests in queue: {proxy_metrics['requests_in_queue']}")
+            print(f"  Avg queue wait: {proxy_metrics['avg_queue_wait_ms']:.2f} ms")
+            print(f"  Proxy overhead events: {proxy_metrics['proxy_overhead_count']}")
+            if proxy_metrics['proxy_overhead_count'] > 0:
+                print(f"  Avg proxy processing: {proxy_metrics['avg_proxy_processing_ms']:.2f} ms  [HIGH]")
+            print(f"  Connection errors: {proxy_metrics['connection_errors']}")
+            print(f"  Upstream timeouts: {proxy_metrics['upstream_timeouts']}")
+            hedging = proxy_metrics.get("hedging") or {}
+            if hedging.get("enabled"):
+                print(f"  Hedged requests: {hedging['hedges']}/{hedging['requests']} "
+                      f"(rate {hedging['hedge_rate'] * 100:.1f}%, hedge won {hedging['win_rate'] * 100:.1f}%, "
+                      f"delay {hedging['delay_ms']:.1f} ms)")
+            cache = proxy_metrics.get("cache") or {}
+            if cache.get("enabled"):
+                print(f"  Response cache: {cache['hit']} hits, {cache['miss']} misses, "
+                      f"{cache['coalesced']} coalesced (hit ratio {cache['hit_ratio'] * 100:.1f}%), "
+                      f"{cache['entries']} entries / {cache['bytes'] / 1024:.1f} KB")
+        except KeyError:
+            print("  [ERROR] No proxy metrics recorded with this run")
+        
+        # Network metrics (from collected headers)
+        print("\n[NETWORK LAYER METRICS]")
+        if network_hist.count:
+            network_p50, network_p99 = network_hist.percentiles([50, 99])
+            print(f"  Network delay p50: {network_p50:.2f} ms")
+            print(f"  Network delay p99: {network_p99:.2f} ms  [MONITORED]")
+            print(f"  Retries: {proxy_metrics.get('retries', 0)}")
+            
+            if network_p99 > network_p50 * 5:
+                print(f"  [WARNING] High network variability detected!")
+        
+        # DIAGNOSTIC SUMMARY
+        print("\n" + "=" * 60)
+        print("[DIAGNOSTIC SUMMARY]")
+        print("=" * 60)
+        
+        result = diagnose(self.run, self.latency_hist.percentile(99), self.scrape_interval)
+        print_summary(result)
+        path = diagnosis_path(self.run)
+        try:
+            save(result, path)
+            print(f"\n[DIAGNOSIS] Saved as: {path}")
+        except OSError as e:
+            print(f"\n[DIAGNOSIS] Could not save {path}: {e}")
+        
+        print("\n" + "=" * 60)
+    
+    def plot_histogram(self, dpi=100, fmt="png", show=True):
+        """Latency histogram and CDF; saved as latency_hist_<mode>.<fmt> when not shown"""
+        mode, latencies = self.mode, self.latencies
+        
+        fig = plt.figure(figsize=(12, 5))
+        
+        # Subplot 1: Histogram
+        plt.subplot(1, 2, 1)
+        plt.hist(latencies, bins=60, color='skyblue', edgecolor='black')
+        plt.axvline(np.percentile(latencies, 50), color='green', linestyle='--', label='p50')
+        plt.axvline(np.percentile(latencies, 99), color='red', linestyle='--', label='p99')
+        plt.title(f"Latency Distribution ({mode})")
+        plt.xlabel("Latency (ms)")
+        plt.ylabel("Count")
+        plt.legend()
+        
+        # Subplot 2: CDF
+        plt.subplot(1, 2, 2)
+        plt.plot(*cdf_points(np.sort(latencies)), linewidth=2)
+        plt.axhline(50, color='green', linestyle='--', alpha=0.5, label='p50')
+        plt.axhline(99, color='red', linestyle='--', alpha=0.5, label='p99')
+        plt.title(f"Cumulative Distribution ({mode})")
+        plt.xlabel("Latency (ms)")
+        plt.ylabel("Percentile")
+        plt.grid(True, alpha=0.3)
+        plt.legend()
+        
+        plt.tight_layout()
+        if show:
+            plt.show()
+        else:
+            filename = f'latency_hist_{mode}.{fmt}'
+            fig.savefig(filename, dpi=dpi, bbox_inches='tight')
+            print(f"\n[GRAPH] Saved as: {filename}")
+            plt.close(fig)
+
+
+def report(run, analyze=False, hist=False, window=50, window_seconds=None,
+           headless=False, dpi=100, fmt="png"):
+    """Print and plot everything client.py shows after a live run.
+    `headless` renders with Agg and only writes the figures to disk."""
+    if headless:
+        use_headless()
+    analysis = RunAnalysis(run, window=window, window_seconds=window_seconds)
+    if len(analysis.latencies):
+        analysis.plot_layers(dpi=dpi, fmt=fmt, show=not headless)
+    analysis.print_latency_results()
+    if analyze and len(analysis.latencies):
+        analysis.print_layer_analysis()
+    if hist and len(analysis.latencies):
+        analysis.plot_histogram(dpi=dpi, fmt=fmt, show=not headless)
+    return analysis
+
+def add_render_arguments(parser):
+    """Figure output options shared by the live client, `analyze` and `compare`"""
+    parser.add_argument("--headless", action="store_true",
+                        help="render without a GUI (Agg) and only save the figures")
+    parser.add_argument("--dpi", type=int, default=100, help="figure resolution (default: 100)")
+    parser.add_argument("--format", dest="fmt", choices=["png", "svg", "pdf"], default="png",
+                        help="figure file format (default: png)")
+
+def resolve_run(path, runs_dir="runs"):
+    """A run directory, or the most recent run for 'latest'"""
+    if path != "latest":
+        return path
+    runs = sorted(d for d in os.listdir(runs_dir) if os.path.isdir(os.path.join(runs_dir, d)))
+    if not runs:
+        raise SystemExit(f"no runs in {runs_dir}/")
+    return os.path.join(runs_dir, runs[-1])
+
+def main(argv=None):
+    """`client.py analyze RUN`: re-run the report on a stored run without sending traffic"""
+    parser = argparse.ArgumentParser(prog="client.py analyze",
+                                     description="Recompute the report for a stored run")
+    parser.add_argument("run", help="run directory, or 'latest'")
+    parser.add_argument("--hist", action="store_true", help="show histogram")
+    parser.add_argument("--analyze", action="store_true", help="show detailed analysis")
+    parser.add_argument("--window", type=int, default=50,
+                        help="rolling percentile window in requests (default: 50)")
+    parser.add_argument("--window-seconds", type=float, default=None,
+                        help="use a time-based rolling window of this many seconds instead")
+    parser.add_argument("--runs-dir", default=os.environ.get("RUNS_DIR", "runs"),
+                        help="where to look for 'latest' (default: runs)")
+    add_render_arguments(parser)
+    args = parser.parse_args(argv)
+    
+    path = resolve_run(args.run, args.runs_dir)
+    run = open_run(path)
+    print(f"Analysing {path}: {run.rows('requests')} requests (mode: {run.meta.get('args', {}).get('mode')})")
+    report(run, analyze=args.analyze, hist=args.hist, window=args.window,
+           window_seconds=args.window_seconds, headless=args.headless, dpi=args.dpi, fmt=args.fmt)
@@ -0,0 +1,117 @@
+# rolling.py
+import bisect
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Cap on elements copied per vectorised percentile chunk (~32MB of float64)
+_CHUNK_ELEMENTS = 4_000_000
+
+def _interpolated(sorted_values, p):
+    """Percentile of an already-sorted list, linear interpolation like np.percentile"""
+    pos = (len(sorted_values) - 1) * p / 100
+    lo = int(pos)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (pos - lo)
+
+def _time_window_starts(times, window_seconds):
+    """Index of the first sample inside (t_i - window_seconds, t_i] for each i
+    (`times` sorted)"""
+    return np.searchsorted(times, times - window_seconds, side="right")
+
+def _time_order(times):
+    """Stable order that sorts `times`, or None if they already are sorted"""
+    if np.all(times[1:] >= times[:-1]):
+        return None
+    return np.argsort(times, kind="stable")
+
+def rolling_percentiles(values, ps=(50, 99), window=50, times=None, window_seconds=None, step=1):
+    """Percentiles over a sliding window ending at each sample.
+
+    Count-based (default): windows of the last `window` samples, computed
+    with vectorised strided views in bounded-memory chunks. Returns
+    (indices, {p: array}) where indices are the positions of each window's
+    last sample.
+
+    Time-based (`window_seconds` and `times` given): windows cover the
+    samples in (t_i - window_seconds, t_i], maintained as a sliding sorted
+    list, so each step costs O(log w) comparisons. Every sample gets a value.
+    Samples need not arrive in time order (concurrent requests complete out
+    of order): they are windowed in time order, and the returned indices
+    point into `values` as given, listed in time order.
+
+    With `step` > 1 only every step-th window is evaluated, which is all a
+    plot of a long run needs.
+    """
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    if window_seconds is not None:
+        times = np.asarray(times, dtype=float)
+        order = _time_order(times)
+        if order is not None:
+            indices, out = rolling_percentiles(values[order], ps, times=times[order],
+                                               window_seconds=window_seconds, step=step)
+            return order[indices], out
+        starts = _time_window_starts(times, window_seconds)
+        if step > 1:
+            indices = np.arange(0, n, step)
+            chunk = np.array([np.percentile(values[starts[i]:i + 1], ps) for i in indices])
+            return indices, {p: chunk[:, k] if len(indices) else np.empty(0) for k, p in enumerate(ps)}
+        starts = starts.tolist()
+        samples = values.tolist()
+        out = {p: np.empty(n) for p in ps}
+        window_sorted = []
+        left = 0
+        for i in range(n):
+            bisect.insort(window_sorted, samples[i])
+            while left < starts[i]:
+                del window_sorted[bisect.bisect_left(window_sorted, samples[left])]
+                left += 1
+            for p in ps:
+                out[p][i] = _interpolated(window_sorted, p)
+        return np.arange(n), out
+
+    if n < window:
+        return np.arange(0), {p: np.empty(0) for p in ps}
+    view = sliding_window_view(values, window)[::step]
+    rows = max(1, _CHUNK_ELEMENTS // window)
+    out = {p: np.empty(len(view)) for p in ps}
+    for start in range(0, len(view), rows):
+        chunk = np.percentile(view[start:start + rows], ps, axis=1)
+        for p, row in zip(ps, chunk):
+            out[p][start:start + rows] = row
+    return np.arange(window - 1, n, step), out
+
+def rolling_std(values, window=20, times=None, window_seconds=None, step=1):
+    """Population standard deviation over a sliding window, from running sums.
+
+    Same windowing (and `step`, and time ordering) as rolling_percentiles;
+    O(n) either way. Returns (indices, array).
+    """
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    if window_seconds is not None:
+        times = np.asarray(times, dtype=float)
+        order = _time_order(times)
+        if order is not None:
+            indices, std = rolling_std(values[order], times=times[order], window_seconds=window_seconds, step=step)
+            return order[indices], std
+    # Centre first so the sum-of-squares difference doesn't lose precision
+    centred = values - (values.mean() if n else 0.0)
+    s1 = np.concatenate(([0.0], np.cumsum(centred)))
+    s2 = np.concatenate(([0.0], np.cumsum(centred * centred)))
+    if window_seconds is not None:
+        starts = _time_window_starts(times, window_seconds)
+        ends = np.arange(1, n + 1)
+        indices = np.arange(n)
+    else:
+        if n < window:
+            return np.arange(0), np.empty(0)
+        ends = np.arange(window, n + 1)
+        starts = ends - window
+        indices = ends - 1
+    if step > 1:
+        starts, ends, indices = starts[::step], ends[::step], indices[::step]
+    counts = ends - starts
+    mean = (s1[ends] - s1[starts]) / counts
+    var = (s2[ends] - s2[starts]) / counts - mean * mean
+    return indices, np.sqrt(np.maximum(var, 0.0))
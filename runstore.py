@@ -0,0 +1,144 @@
+# runstore.py
+import json, os, threading, time
+import numpy as np
+
+# A run is a directory holding header.json plus one raw little-endian file
+# per column, e.g.
+#
+#   runs/20261016-120000-mixed/
+#     header.json                  schema (tables -> [[column, dtype], ...]) and run metadata
+#     requests.latency_ms.bin      float64 values, one per row
+#     requests.status.bin          int16 values, ...
+#
+# Columns are only ever appended to, in batches, so a crashed run keeps
+# everything up to its last flush; readers memory-map the files and trim
+# every column of a table to the shortest one.
+
+HEADER = "header.json"
+VERSION = 1
+
+def _write_json(path, data):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+def _make_unique_dir(path):
+    """Create `path`, or path-2, path-3, ... if it exists; returns the one made.
+    makedirs is atomic, so concurrent writers never share a directory."""
+    candidate, n = path, 1
+    while True:
+        try:
+            os.makedirs(candidate)
+            return candidate
+        except FileExistsError:
+            n += 1
+            candidate = f"{path}-{n}"
+
+def _column_path(directory, table, column):
+    return os.path.join(directory, f"{table}.{column}.bin")
+
+class RunWriter:
+    """Buffers rows per table and appends them column by column.
+
+    `tables` maps a table name to its [(column, dtype), ...] schema. Rows are
+    tuples in schema order. A table is flushed when it has `batch_rows` rows
+    buffered or `flush_interval` seconds have passed since its last flush.
+    With `unique`, an existing `path` gets a -2, -3, ... suffix instead of
+    failing; `self.path` is the directory actually used. Thread-safe.
+    """
+
+    def __init__(self, path, tables, meta=None, batch_rows=4096, flush_interval=1.0, unique=False):
+        if unique:
+            path = _make_unique_dir(path)
+        else:
+            os.makedirs(path)
+        self.path = path
+        self.batch_rows = batch_rows
+        self.flush_interval = flush_interval
+        self._schema = {name: [(col, np.dtype(dt).newbyteorder("<")) for col, dt in cols]
+                        for name, cols in tables.items()}
+        self._header = {
+            "version": VERSION,
+            "meta": dict(meta or {}),
+            "tables": {name: [[col, dt.str] for col, dt in cols] for name, cols in self._schema.items()},
+        }
+        self._lock = threading.Lock()
+        self._pending = {name: [] for name in tables}
+        self._last_flush = {name: time.monotonic() for name in tables}
+        self._rows = dict.fromkeys(tables, 0)
+        _write_json(os.path.join(path, HEADER), self._header)
+        self._files = {(name, col): open(_column_path(path, name, col), "ab")
+                       for name, cols in self._schema.items() for col, _ in cols}
+
+    def append(self, table, row):
+        with self._lock:
+            pending = self._pending[table]
+            pending.append(row)
+            if (len(pending) >= self.batch_rows
+                    or time.monotonic() - self._last_flush[table] >= self.flush_interval):
+                self._flush(table)
+
+    def _flush(self, table):
+        """Write out a table's buffered rows (lock held)"""
+        rows = self._pending[table]
+        self._last_flush[table] = time.monotonic()
+        if not rows:
+            return
+        for (col, dtype), values in zip(self._schema[table], zip(*rows)):
+            f = self._files[table, col]
+            f.write(np.asarray(values, dtype=dtype).tobytes())
+            f.flush()
+        self._rows[table] += len(rows)
+        self._pending[table] = []
+
+    def flush(self):
+        with self._lock:
+            for table in self._pending:
+                self._flush(table)
+
+    def update_meta(self, **meta):
+        """Merge into the run metadata and rewrite the header"""
+        with self._lock:
+            self._header["meta"].update(meta)
+            _write_json(os.path.join(self.path, HEADER), self._header)
+
+    def close(self, **meta):
+        self.flush()
+        self.update_meta(rows=dict(self._rows), **meta)
+        for f in self._files.values():
+            f.close()
+
+class Run:
+    """Read-only view of a stored run; columns are memory-mapped on demand"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, HEADER)) as f:
+            header = json.load(f)
+        if header.get("version") != VERSION:
+            raise ValueError(f"{path}: unsupported run format version {header.get('version')!r}")
+        self.meta = header["meta"]
+        self.schema = {name: [(col, np.dtype(dt)) for col, dt in cols]
+                       for name, cols in header["tables"].items()}
+
+    def _map(self, table, column, dtype, rows):
+        if not rows:
+            return np.empty(0, dtype)
+        return np.memmap(_column_path(self.path, table, column), dtype=dtype, mode="r", shape=(rows,))
+
+    def rows(self, table):
+        """Complete rows on disk: the shortest column wins after a crash"""
+        lengths = []
+        for col, dtype in self.schema[table]:
+            path = _column_path(self.path, table, col)
+            lengths.append(os.path.getsize(path) // dtype.itemsize if os.path.exists(path) else 0)
+        return min(lengths, default=0)
+
+    def table(self, name):
+        """{column: array} for every column of a table"""
+        rows = self.rows(name)
+        return {col: self._map(name, col, dtype, rows) for col, dtype in self.schema[name]}
+
+def open_run(path):
+    return Run(path)
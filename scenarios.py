@@ -0,0 +1,364 @@
+# scenarios.py
+import threading, queue, random, time, os, zlib, math
+from metrics import ShardedMetrics
+
+# Contention scenarios for /work. A scenario spec is a name plus parameters,
+# written either as a string (APP_SCENARIO="striped:stripes=8,hold=exp:100")
+# or as query args (/work?mode=app&scenario=striped&stripes=8&hold=exp:100).
+#
+#   lock      one global lock (the original behaviour)
+#   rwlock    reader-writer lock; write_ratio of acquisitions are writers
+#   striped   N-way striped locks; stripe from ?key= or picked at random
+#   pool      semaphore of size K, like a DB connection pool
+#   queue     bounded work queue served by W worker threads
+#
+# Common parameters: rate (fraction of requests that touch the primitive,
+# default 0.05) and hold (hold-time distribution in ms, default fixed:100).
+
+DEFAULTS = {
+    "rate": "0.05",
+    "hold": "fixed:100",
+    "write_ratio": "0.1",
+    "stripes": "8",
+    "size": "4",
+    "workers": "4",
+    "capacity": "64",
+}
+PARAMS = {
+    "lock": ("rate", "hold"),
+    "rwlock": ("rate", "hold", "write_ratio"),
+    "striped": ("rate", "hold", "stripes"),
+    "pool": ("rate", "hold", "size"),
+    "queue": ("rate", "hold", "workers", "capacity"),
+}
+# Each distinct spec gets its own locks (and, for queue, worker threads), so
+# the number of specs is bounded: past MAX_INSTANCES, the least recently used
+# idle one (nothing running, unused for IDLE_SECONDS) is evicted
+MAX_INSTANCES = 64
+IDLE_SECONDS = 1.0
+
+def parse_distribution(text):
+    """Hold-time sampler in seconds from fixed:MS, exp:MEAN_MS,
+    uniform:LO_MS:HI_MS or lognormal:MEDIAN_MS:SIGMA. Times must be
+    positive (LO and SIGMA may be 0), so a bad spec fails here rather than
+    on the first request that samples it."""
+    kind, *args = text.split(":")
+    try:
+        args = [float(a) for a in args]
+    except ValueError:
+        args = None
+    if args is not None and all(math.isfinite(a) for a in args):
+        if kind == "fixed" and len(args) == 1 and args[0] > 0:
+            ms, = args
+            return lambda: ms / 1000
+        if kind == "exp" and len(args) == 1 and args[0] > 0:
+            rate = 1000 / args[0]
+            return lambda: random.expovariate(rate)
+        if kind == "uniform" and len(args) == 2 and 0 <= args[0] <= args[1] and args[1] > 0:
+            lo, hi = args
+            return lambda: random.uniform(lo, hi) / 1000
+        if kind == "lognormal" and len(args) == 2 and args[0] > 0 and args[1] >= 0:
+            median, sigma = args
+            return lambda: random.lognormvariate(0, sigma) * median / 1000
+    raise ValueError(f"bad hold-time distribution {text!r}")
+
+def positive_int(params, name):
+    """params[name] as an int >= 1"""
+    try:
+        value = int(params[name])
+    except ValueError:
+        value = 0
+    if value < 1:
+        raise ValueError(f"{name} must be a positive integer (got {params[name]!r})")
+    return value
+
+def parse_spec(text):
+    """'striped:stripes=8,hold=exp:100' -> ('striped', {'stripes': '8', 'hold': 'exp:100'})"""
+    name, _, rest = text.partition(":")
+    params = {}
+    for item in filter(None, rest.split(",")):
+        key, sep, value = item.partition("=")
+        if not sep:
+            raise ValueError(f"bad scenario parameter {item!r}")
+        params[key.strip()] = value.strip()
+    return name.strip(), params
+
+class RWLock:
+    """Writer-preferring reader-writer lock"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    def acquire_read(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+
+    def release_write(self):
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+class Scenario:
+    """A contended primitive. run() acquires it, holds it for a sampled time
+    and releases it, returning (wait_seconds, hold_seconds); wait and hold
+    times are recorded into the scenario's own histograms. Subclasses
+    implement _run(); run() also tracks how many requests are inside it, so
+    the engine only evicts idle instances."""
+
+    def __init__(self, name, params):
+        self.name = name
+        self.params = params
+        self.rate = float(params["rate"])
+        if not 0 <= self.rate <= 1:
+            raise ValueError(f"rate must be between 0 and 1 (got {params['rate']!r})")
+        self.hold = parse_distribution(params["hold"])
+        self.metrics = ShardedMetrics({"acquisitions": 0}, histograms=("wait_ms", "hold_ms"))
+        self.active = 0
+        self.last_used = time.monotonic()
+        self._active_lock = threading.Lock()
+
+    @property
+    def spec(self):
+        return self.name + ":" + ",".join(f"{k}={v}" for k, v in sorted(self.params.items()))
+
+    def run(self, key=None):
+        with self._active_lock:
+            self.active += 1
+        try:
+            return self._run(key)
+        finally:
+            with self._active_lock:
+                self.active -= 1
+                self.last_used = time.monotonic()
+
+    def idle(self, now, grace=IDLE_SECONDS):
+        return self.active == 0 and now - self.last_used >= grace
+
+    def close(self):
+        """Release anything that outlives the instance (evicted from the engine)"""
+
+    def _record(self, wait, hold):
+        self.metrics.inc("acquisitions")
+        self.metrics.observe("wait_ms", wait * 1000)
+        self.metrics.observe("hold_ms", hold * 1000)
+        return wait, hold
+
+    def _hold(self):
+        hold = self.hold()
+        time.sleep(hold)  # heavy blocking work while holding the resource
+        return hold
+
+    def stats(self):
+        m, hists = self.metrics.snapshot()
+        return {
+            "spec": self.spec,
+            "acquisitions": m["acquisitions"],
+            "wait_ms": hists["wait_ms"].summary(),
+            "hold_ms": hists["hold_ms"].summary(),
+        }
+
+class LockScenario(Scenario):
+    def __init__(self, name, params, lock_factory=threading.Lock):
+        super().__init__(name, params)
+        self.lock = lock_factory()
+
+    def _run(self, key=None):
+        wait_start = time.time()
+        with self.lock:
+            wait = time.time() - wait_start
+            hold = self._hold()
+        return self._record(wait, hold)
+
+class RWLockScenario(Scenario):
+    def __init__(self, name, params):
+        super().__init__(name, params)
+        self.write_ratio = float(params["write_ratio"])
+        if not 0 <= self.write_ratio <= 1:
+            raise ValueError(f"write_ratio must be between 0 and 1 (got {params['write_ratio']!r})")
+        self.lock = RWLock()
+
+    def _run(self, key=None):
+        writer = random.random() < self.write_ratio
+        wait_start = time.time()
+        if writer:
+            self.lock.acquire_write()
+        else:
+            self.lock.acquire_read()
+        wait = time.time() - wait_start
+        try:
+            hold = self._hold()
+        finally:
+            if writer:
+                self.lock.release_write()
+            else:
+                self.lock.release_read()
+        return self._record(wait, hold)
+
+class StripedLockScenario(Scenario):
+    def __init__(self, name, params, lock_factory=threading.Lock):
+        super().__init__(name, params)
+        self.locks = [lock_factory() for _ in range(positive_int(params, "stripes"))]
+
+    def _run(self, key=None):
+        if key is None:
+            stripe = random.randrange(len(self.locks))
+        else:
+            stripe = zlib.crc32(key.encode()) % len(self.locks)
+        wait_start = time.time()
+        with self.locks[stripe]:
+            wait = time.time() - wait_start
+            hold = self._hold()
+        return self._record(wait, hold)
+
+class PoolScenario(Scenario):
+    def __init__(self, name, params, semaphore_factory=threading.Semaphore):
+        super().__init__(name, params)
+        self.slots = semaphore_factory(positive_int(params, "size"))
+
+    def _run(self, key=None):
+        wait_start = time.time()
+        with self.slots:
+            wait = time.time() - wait_start
+            hold = self._hold()
+        return self._record(wait, hold)
+
+class QueueScenario(Scenario):
+    """Requests submit a job to a bounded queue and block until one of the
+    worker threads has run it. Wait is time queued (including blocking on a
+    full queue); hold is the job's service time."""
+
+    def __init__(self, name, params):
+        super().__init__(name, params)
+        self.workers = positive_int(params, "workers")
+        self.jobs = queue.Queue(maxsize=positive_int(params, "capacity"))
+        self._started_pid = None
+        self._start_lock = threading.Lock()
+    
+    def _ensure_workers(self):
+        # Started lazily in the serving process: threads don't survive fork()
+        if self._started_pid != os.getpid():
+            with self._start_lock:
+                if self._started_pid != os.getpid():
+                    for _ in range(self.workers):
+                        threading.Thread(target=self._worker, daemon=True).start()
+                    self._started_pid = os.getpid()
+
+    def _worker(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:  # closed
+                return
+            job["started"] = time.time()
+            job["hold"] = self._hold()
+            job["done"].set()
+
+    def close(self):
+        with self._start_lock:
+            if self._started_pid == os.getpid():
+                for _ in range(self.workers):
+                    self.jobs.put(None)
+                self._started_pid = None  # a request that resolved us just before still gets served
+
+    def _run(self, key=None):
+        self._ensure_workers()
+        job = {"done": threading.Event()}
+        submitted = time.time()
+        self.jobs.put(job)
+        job["done"].wait()
+        return self._record(job["started"] - submitted, job["hold"])
+
+class ScenarioEngine:
+    """Resolves specs to shared scenario instances (one per distinct spec,
+    at most MAX_INSTANCES, evicting idle ones least recently used first;
+    specs that fail validation are not kept).
+
+    Lock and semaphore factories can be swapped for multiprocessing ones so
+    that instances created before forking are shared across worker
+    processes; rwlock and queue scenarios are always per process.
+    """
+
+    def __init__(self, default_spec="lock", lock_factory=threading.Lock,
+                 semaphore_factory=threading.Semaphore):
+        self.lock_factory = lock_factory
+        self.semaphore_factory = semaphore_factory
+        self._instances = {}
+        self._lock = threading.Lock()
+        self.default = self.resolve(*parse_spec(default_spec))
+
+    def resolve(self, name, params):
+        if name not in PARAMS:
+            raise ValueError(f"unknown scenario {name!r} (choose from {', '.join(PARAMS)})")
+        unknown = set(params) - set(PARAMS[name])
+        if unknown:
+            raise ValueError(f"scenario {name!r} does not take {', '.join(sorted(unknown))}")
+        full = {k: params.get(k, DEFAULTS[k]) for k in PARAMS[name]}
+        key = (name, tuple(sorted(full.items())))
+        scenario = self._instances.get(key)
+        if scenario is None:
+            with self._lock:
+                scenario = self._instances.get(key)
+                if scenario is None:
+                    if len(self._instances) >= MAX_INSTANCES and not self._evict_idle(1):
+                        raise ValueError(f"too many distinct scenarios in use (limit {MAX_INSTANCES})")
+                    scenario = self._instances[key] = self._create(name, full)
+        scenario.last_used = time.monotonic()
+        return scenario
+
+    def _evict_idle(self, limit=None, grace=IDLE_SECONDS):
+        """Drop up to `limit` idle instances other than the default, least
+        recently used first (registry lock held); returns how many"""
+        now = time.monotonic()
+        idle = sorted((s.last_used, key) for key, s in self._instances.items()
+                      if s is not self.default and s.idle(now, grace))[:limit]
+        for _, key in idle:
+            self._instances.pop(key).close()
+        return len(idle)
+
+    def _create(self, name, params):
+        if name == "lock":
+            return LockScenario(name, params, self.lock_factory)
+        if name == "rwlock":
+            return RWLockScenario(name, params)
+        if name == "striped":
+            return StripedLockScenario(name, params, self.lock_factory)
+        if name == "pool":
+            return PoolScenario(name, params, self.semaphore_factory)
+        return QueueScenario(name, params)
+
+    def for_request(self, args):
+        """Scenario named by ?scenario= (with its params from the query), or the default"""
+        name = args.get("scenario")
+        if not name:
+            return self.default
+        params = {k: args[k] for k in PARAMS.get(name, ()) if k in args}
+        return self.resolve(name, params)
+
+    def stats(self):
+        return [s.stats() for s in list(self._instances.values())]
+
+    def reset(self):
+        """Zero every scenario's metrics and drop the non-default ones that
+        no request is running"""
+        with self._lock:
+            self._evict_idle(grace=0)
+        for s in list(self._instances.values()):
+            s.metrics.reset()
@@ -0,0 +1,41 @@
+# test_rolling.py
+import numpy as np
+from rolling import rolling_percentiles, rolling_std
+
+def _shuffled_run(n=400, seed=1):
+    """Completion times out of order, as concurrent requests append them"""
+    rng = np.random.default_rng(seed)
+    times = np.sort(rng.uniform(0, 5, n)) + rng.uniform(-0.6, 0.6, n)
+    values = rng.lognormal(2, 0.5, n)
+    return times, values
+
+def _expected(times, values, window_seconds, stat):
+    """Brute force: stat over the samples in (t - window_seconds, t], in time order"""
+    order = np.argsort(times, kind="stable")
+    t, v = times[order], values[order]
+    return order, np.array([stat(v[(t > t[i] - window_seconds) & (np.arange(len(t)) <= i)])
+                            for i in range(len(t))])
+
+def test_time_window_percentiles_with_unsorted_times():
+    times, values = _shuffled_run()
+    assert np.any(np.diff(times) < 0)
+    order, p99 = _expected(times, values, 0.2, lambda w: np.percentile(w, 99))
+    for step in (1, 7):
+        indices, rolling = rolling_percentiles(values, (50, 99), times=times, window_seconds=0.2, step=step)
+        np.testing.assert_array_equal(indices, order[::step])
+        np.testing.assert_allclose(rolling[99], p99[::step])
+        assert np.all(np.diff(times[indices]) >= 0)
+
+def test_time_window_std_with_unsorted_times():
+    times, values = _shuffled_run()
+    order, std = _expected(times, values, 0.2, np.std)
+    indices, rolling = rolling_std(values, times=times, window_seconds=0.2)
+    np.testing.assert_array_equal(indices, order)
+    np.testing.assert_allclose(rolling, std, atol=1e-9)
+
+def test_sorted_times_keep_their_positions():
+    times = np.arange(100) * 0.25
+    values = np.arange(100, dtype=float)
+    indices, rolling = rolling_percentiles(values, (50,), times=times, window_seconds=1.0)
+    np.testing.assert_array_equal(indices, np.arange(100))
+    assert rolling[50][-1] == np.median(values[-4:])
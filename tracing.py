@@ -0,0 +1,60 @@
+# tracing.py
+import os
+
+# Every request carries a trace ID from the client through the proxy to the
+# app. Each server layer answers with a compact span header of timings in ms
+# (plus its arrival time as a Unix timestamp), and the client joins them into
+# a per-request breakdown:
+#
+#   X-Trace-Id:   3f9c2a71d04e8b65
+#   X-Proxy-Span: arrival=1760000000.123456;queue=0.41;proxy=50.00;network=2.00;upstream=104.20
+#   X-App-Span:   arrival=1760000000.176543;wait=97.80;work=2.10
+
+TRACE_HEADER = "X-Trace-Id"
+PROXY_SPAN_HEADER = "X-Proxy-Span"
+APP_SPAN_HEADER = "X-App-Span"
+
+# Per-request breakdown, in request order. "other" is whatever the spans
+# don't account for: connection setup, transfer and time between layers.
+COMPONENTS = ("client_queue", "proxy_queue", "proxy", "network", "app_wait", "app_work", "other")
+
+def new_trace_id():
+    return os.urandom(8).hex()
+
+def encode_span(**fields):
+    """arrival=<unix seconds>;<name>=<ms>;..."""
+    parts = []
+    for name, value in fields.items():
+        parts.append(f"{name}={value:.6f}" if name == "arrival" else f"{name}={value:.2f}")
+    return ";".join(parts)
+
+def decode_span(text):
+    """Inverse of encode_span; malformed fields are skipped"""
+    span = {}
+    for part in (text or "").split(";"):
+        name, sep, value = part.partition("=")
+        if not sep:
+            continue
+        try:
+            span[name.strip()] = float(value)
+        except ValueError:
+            pass
+    return span
+
+def join_spans(total_ms, client_queue_ms, proxy_span, app_span):
+    """Split one request's end-to-end latency into COMPONENTS (ms).
+
+    `client_queue_ms` is the time between the request's intended and actual
+    send. Layers that sent no span contribute nothing and their share ends up
+    in "other".
+    """
+    parts = {
+        "client_queue": client_queue_ms,
+        "proxy_queue": proxy_span.get("queue", 0.0),
+        "proxy": proxy_span.get("proxy", 0.0),
+        "network": proxy_span.get("network", 0.0),
+        "app_wait": app_span.get("wait", 0.0),
+        "app_work": app_span.get("work", 0.0),
+    }
+    parts["other"] = max(0.0, total_ms - sum(parts.values()))
+    return parts
@@ -0,0 +1,176 @@
+# upstream.py
+import http.client, threading, time, urllib.parse, contextlib, socket
+
+class Abort:
+    """Lets another thread give up on a request in flight. abort() shuts
+    down the socket of the connection it is using, so a blocked send or read
+    fails at once and the connection is closed instead of reused."""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def is_set(self):
+        return self._event.is_set()
+
+    def wait(self, timeout):
+        """Sleep up to `timeout` seconds; True if aborted meanwhile"""
+        return self._event.wait(timeout)
+
+    def abort(self):
+        with self._lock:
+            self._event.set()
+            conn = self._conn
+        sock = conn.sock if conn is not None else None
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def attach(self, conn):
+        with self._lock:
+            self._conn = conn
+
+    def check(self):
+        if self._event.is_set():
+            raise ConnectionAbortedError("request aborted")
+
+class UpstreamPool:
+    """Keep-alive HTTP/1.1 connections to a single upstream server.
+
+    At most `size` connections are checked out at once; callers beyond that
+    wait for a free one. Idle connections are reused most-recently-used first
+    and closed instead of reused once idle for longer than `idle_timeout`.
+    """
+
+    def __init__(self, base_url, size=32, idle_timeout=30.0, timeout=5.0, keepalive=True):
+        parsed = urllib.parse.urlsplit(base_url)
+        self.https = parsed.scheme == "https"
+        self.host = parsed.hostname
+        self.port = parsed.port or (443 if self.https else 80)
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.keepalive = keepalive
+
+        self._idle = []  # stack of (connection, last_used)
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats = {
+                "hits": 0,              # request served on a reused connection
+                "new_connections": 0,   # TCP connects to the upstream
+                "waits": 0,             # callers that found every connection in use
+                "idle_evictions": 0,    # idle connections closed for age
+                "stale_retries": 0,     # reused connection had been closed by the server
+            }
+
+    def _connect(self):
+        cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        return cls(self.host, self.port, timeout=self.timeout)
+
+    def acquire(self):
+        """Check out a connection; returns (connection, reused)"""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.stats["waits"] += 1
+            self._slots.acquire()
+
+        now = time.monotonic()
+        with self._lock:
+            while self._idle:
+                conn, last_used = self._idle.pop()
+                if now - last_used <= self.idle_timeout:
+                    self.stats["hits"] += 1
+                    return conn, True
+                conn.close()
+                self.stats["idle_evictions"] += 1
+            self.stats["new_connections"] += 1
+        return self._connect(), False
+
+    def release(self, conn, reusable=True):
+        if reusable and self.keepalive:
+            with self._lock:
+                self._idle.append((conn, time.monotonic()))
+        else:
+            conn.close()
+        self._slots.release()
+
+    def _send(self, conn, reused, path, headers, abort=None):
+        """Send the request and read the response head, retrying once on a
+        fresh connection if a reused one had been closed by the server"""
+        headers = dict(headers or {})
+        if not self.keepalive:
+            headers["Connection"] = "close"
+        try:
+            self._request(conn, path, headers, abort)
+            return conn.getresponse()
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            if not reused or (abort is not None and abort.is_set()):
+                raise
+            conn.close()
+            with self._lock:
+                self.stats["stale_retries"] += 1
+                self.stats["new_connections"] += 1
+            self._request(conn, path, headers, abort)
+            return conn.getresponse()
+
+    def _request(self, conn, path, headers, abort):
+        if abort is not None:
+            # Connect first, so an abort from here on always finds a socket
+            if conn.sock is None:
+                conn.connect()
+            abort.check()
+        conn.request("GET", path, headers=headers)
+
+    def get(self, path, headers=None, abort=None):
+        """GET `path` and read the whole response; returns (status, headers, body).
+
+        Socket timeouts and connection errors propagate. An `abort` handle
+        lets another thread cut the request off (ConnectionAbortedError or
+        another connection error is raised).
+        """
+        conn, reused = self.acquire()
+        if abort is not None:
+            abort.attach(conn)
+        try:
+            resp = self._send(conn, reused, path, headers, abort)
+            body = resp.read()
+        except BaseException:
+            self.release(conn, reusable=False)
+            raise
+        finally:
+            if abort is not None:
+                abort.attach(None)
+        # An abort that raced the end of the read may have shut the socket down
+        aborted = abort is not None and abort.is_set()
+        self.release(conn, reusable=not resp.will_close and not aborted)
+        return resp.status, resp.getheaders(), body
+
+    @contextlib.contextmanager
+    def stream(self, path, headers=None):
+        """GET `path` and yield the response as soon as its head has arrived,
+        with the body left unread. The connection goes back to the pool only
+        if the caller read the body to the end."""
+        conn, reused = self.acquire()
+        try:
+            resp = self._send(conn, reused, path, headers)
+            yield resp
+        except BaseException:
+            self.release(conn, reusable=False)
+            raise
+        self.release(conn, reusable=resp.isclosed() and not resp.will_close)
+
+    def snapshot(self):
+        """Stats plus current pool occupancy"""
+        with self._lock:
+            data = dict(self.stats)
+            data["idle"] = len(self._idle)
+        data["size"] = self.size
+        data["keepalive"] = self.keepalive
+        return data